@@ -1,30 +1,25 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-# Import functions from our new modules
-from prompts import (
-    format_research_ideas_prompt,
-    format_literature_summary_prompt,
-    format_properties_prediction_prompt,
-    format_final_response_prompt
-)
-from gemini_api import query_model
-from workflow import (
-    generate_research_ideas_from_ai,
-    generate_literature_summary_from_ai,
-    generate_properties_from_ai,
-    compile_final_response_from_ai,
-    perform_chemical_lookup
-)
-from database import init_db, save_search_history, load_search_history, delete_search_history_entry, clear_all_search_history
+# Import functions from our new modules. Prompt, model and workflow helpers are imported by
+# ui_sections; heavy libraries (requests, PyPDF2, python-docx, NumPy) load on first use.
+from database import init_db
+from chemical_cache import init_chemical_cache
+from image_store import init_image_store
+from session_store import get_session_store
+from session_memory import init_session_memory, begin_session_run, end_session_run
+from tracing import set_trace_session, span
 
 # Import the new session state manager and UI sections
-from session_state_manager import initialize_session_state
+from session_state_manager import initialize_session_state, checkpoint_session_state
 from ui_sections import (
     render_input_details_stage,
     render_review_ideas_stage,
     render_literature_summary_stage,
     render_properties_prediction_stage,
-    render_final_compilation_stage
+    render_final_compilation_stage,
+    render_performance_panel,
+    render_memory_panel
 )
 
 
@@ -34,22 +29,54 @@ st.set_page_config(page_title="AI Research Agent", page_icon="🔬", layout="cen
 st.title("🔬 AI Research Agent for Chemists")
 st.markdown("Unlock new research avenues with AI-powered idea generation and workflow management.")
 
-# Initialize the database and session state on app startup
-init_db()
+@st.cache_resource
+def initialize_resources():
+    """
+    Creates the SQLite databases, the image store and the session store, and sets up session
+    memory accounting, once per server process.
+    Every rerun after the first gets the cached result without touching the disk.
+    """
+    init_db()
+    init_chemical_cache()
+    init_image_store()
+    get_session_store()
+    init_session_memory()
+    return True
+
+# Initialize the databases once on app startup
+initialize_resources()
+
+# Spans recorded during this run, and by the background work it starts, belong to this session
+session_id = get_script_run_ctx().session_id
+set_trace_session(session_id)
+
+# Brings back large values moved to disk while the session was idle, before anything reads them
+begin_session_run(session_id)
 initialize_session_state()
 
 # --- UI Flow based on st.session_state.stage ---
 
-if st.session_state.stage == 'input_details':
-    render_input_details_stage()
-elif st.session_state.stage == 'review_ideas':
-    render_review_ideas_stage()
-elif st.session_state.stage == 'literature_summary':
-    render_literature_summary_stage()
-elif st.session_state.stage == 'properties_prediction':
-    render_properties_prediction_stage()
-elif st.session_state.stage == 'final_compilation':
-    render_final_compilation_stage()
+# Each script run is one trace, so the performance panel shows a waterfall per interaction
+with span("app.run", stage=st.session_state.stage):
+    if st.session_state.stage == 'input_details':
+        render_input_details_stage()
+    elif st.session_state.stage == 'review_ideas':
+        render_review_ideas_stage()
+    elif st.session_state.stage == 'literature_summary':
+        render_literature_summary_stage()
+    elif st.session_state.stage == 'properties_prediction':
+        render_properties_prediction_stage()
+    elif st.session_state.stage == 'final_compilation':
+        render_final_compilation_stage()
+
+# Save the workflow so far; a restarted server or another replica resumes it from the URL
+checkpoint_session_state()
+
+render_performance_panel(session_id)
+render_memory_panel()
+
+# Measure what this session holds; idle sessions are evicted from if the server is over its ceiling
+end_session_run(session_id)
 
 st.markdown("---")
 st.markdown("Developed with Streamlit and Google Gemini API.")
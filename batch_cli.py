@@ -0,0 +1,214 @@
+# batch_cli.py
+"""
+Runs the full research workflow (ideas -> literature summary -> properties -> final proposal)
+for many topics without the Streamlit UI.
+
+Usage:
+    python batch_cli.py topics.csv --output results.jsonl --docx-dir proposals --workers 4
+
+The input is a CSV with topic, goal and data columns (an optional id column names each row),
+or a JSONL file with the same keys. Finished rows are appended to the output JSONL; completed
+stages of unfinished rows are checkpointed, so re-running the same command resumes where an
+interrupted run stopped.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from exports import export_document
+from gemini_scheduler import request_priority, PRIORITY_BATCH
+from workflow import (
+    generate_research_ideas_from_ai,
+    generate_literature_summary_from_ai,
+    generate_properties_from_ai,
+    compile_final_response_from_ai,
+    is_stage_error
+)
+
+logger = logging.getLogger("batch_cli")
+
+DEFAULT_WORKERS = 4
+
+# Outputs of the workflow stages, in the order they run
+STAGE_KEYS = ("ideas", "literature_summary", "properties", "final_response")
+
+
+def read_topics(path):
+    """
+    Reads topic rows from a CSV or JSONL file. Returns a list of dicts with
+    id, topic, goal and data keys.
+    """
+    rows = []
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith((".jsonl", ".json")):
+            records = [json.loads(line) for line in f if line.strip()]
+        else:
+            records = list(csv.DictReader(f))
+
+    for index, record in enumerate(records, start=1):
+        row = {key: (record.get(key) or "").strip() for key in ("topic", "goal", "data")}
+        row["id"] = str(record.get("id") or index)
+        rows.append(row)
+    return rows
+
+
+def _load_finished_ids(output_path):
+    finished = set()
+    if os.path.exists(output_path):
+        with open(output_path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    # Rows written before failed model calls were detected may hold "⚠️ ..." outputs
+                    if record.get("status") == "done" and not any(is_stage_error(record.get(key)) for key in STAGE_KEYS):
+                        finished.add(record["id"])
+    return finished
+
+
+def _safe_filename(row_id):
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in row_id)
+
+
+def _checkpoint_path(checkpoint_dir, row_id):
+    return os.path.join(checkpoint_dir, f"{_safe_filename(row_id)}.json")
+
+
+def _load_checkpoint(checkpoint_dir, row_id):
+    try:
+        with open(_checkpoint_path(checkpoint_dir, row_id), encoding="utf-8") as f:
+            results = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {key: value for key, value in results.items() if not is_stage_error(value)}
+
+
+def _save_checkpoint(checkpoint_dir, row_id, results):
+    path = _checkpoint_path(checkpoint_dir, row_id)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(results, f)
+    os.replace(tmp_path, path)
+
+
+def write_proposal_docx(path, record):
+    """
+    Writes the same proposal document the final stage of the app offers for download.
+    """
+    content = (
+        f"Research Idea: {record['idea']}\n\n"
+        f"Literature Summary:\n{record['literature_summary']}\n\n"
+        f"Properties/Approach:\n{record['properties']}\n\n"
+        f"Final Proposal Overview:\n{record['final_response']}"
+    )
+    with open(path, "wb") as f:
+        f.write(export_document("docx", "Final Research Proposal Overview", content))
+
+
+def run_row(row, checkpoint_dir):
+    """
+    Runs the workflow for one topic row, skipping stages recorded in its checkpoint.
+    Returns the output record.
+    """
+    with request_priority(PRIORITY_BATCH): # Yields to interactive sessions sharing this process
+        return _run_row_stages(row, checkpoint_dir)
+
+
+def _run_row_stages(row, checkpoint_dir):
+    started = time.time()
+    results = _load_checkpoint(checkpoint_dir, row["id"])
+    record = dict(row)
+
+    def stage(key, compute):
+        if key not in results:
+            results[key] = compute()
+            if is_stage_error(results[key]):
+                raise RuntimeError(f"stage '{key}' failed")
+            _save_checkpoint(checkpoint_dir, row["id"], results)
+        return results[key]
+
+    try:
+        ideas = stage("ideas", lambda: generate_research_ideas_from_ai(row["topic"], row["goal"], row["data"], uploaded_text_context=""))
+        idea = ideas[0] # The top idea is carried through the rest of the pipeline
+        summary = stage("literature_summary", lambda: generate_literature_summary_from_ai(idea, uploaded_text_context=""))
+        properties = stage("properties", lambda: generate_properties_from_ai(idea))
+        final_response = stage("final_response", lambda: compile_final_response_from_ai(idea, summary, properties))
+        record.update({
+            "ideas": ideas,
+            "idea": idea,
+            "literature_summary": summary,
+            "properties": properties,
+            "final_response": final_response,
+            "status": "done",
+        })
+    except Exception as e:
+        logger.error(f"Row {row['id']} failed: {e}")
+        record.update({"status": "failed", "error": str(e)})
+    record["elapsed_seconds"] = round(time.time() - started, 2)
+    return record
+
+
+def run_batch(input_path, output_path, docx_dir=None, workers=DEFAULT_WORKERS, checkpoint_dir=None):
+    """
+    Runs all rows of an input file with a bounded worker pool, appending each finished row
+    to the output JSONL as soon as it completes. Returns (done, failed, skipped) counts.
+    """
+    checkpoint_dir = checkpoint_dir or f"{output_path}.checkpoints"
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    if docx_dir:
+        os.makedirs(docx_dir, exist_ok=True)
+
+    rows = read_topics(input_path)
+    finished = _load_finished_ids(output_path)
+    pending = [row for row in rows if row["id"] not in finished]
+    logger.info(f"{len(rows)} rows, {len(finished)} already done, {len(pending)} to run with {workers} workers.")
+
+    counts = {"done": 0, "failed": 0}
+    output_lock = threading.Lock()
+    with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_row, row, checkpoint_dir): row for row in pending}
+        try:
+            for future in as_completed(futures):
+                record = future.result()
+                if record["status"] == "done":
+                    if docx_dir:
+                        write_proposal_docx(os.path.join(docx_dir, f"{_safe_filename(record['id'])}.docx"), record)
+                    try:
+                        os.remove(_checkpoint_path(checkpoint_dir, record["id"]))
+                    except OSError:
+                        pass
+                with output_lock:
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+                counts[record["status"]] += 1
+                logger.info(f"Row {record['id']}: {record['status']} in {record['elapsed_seconds']}s "
+                            f"({counts['done'] + counts['failed']}/{len(pending)})")
+        except KeyboardInterrupt:
+            logger.warning("Interrupted; completed stages are checkpointed, re-run to resume.")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    return counts["done"], counts["failed"], len(finished)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the AI research workflow for many topics without the UI.")
+    parser.add_argument("input", help="CSV or JSONL file with topic, goal and data (and optional id) per row")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="JSONL file results are appended to (default: results.jsonl)")
+    parser.add_argument("--docx-dir", help="also write one proposal DOCX per finished row into this directory")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help=f"rows processed concurrently (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--checkpoint-dir", help="where per-row stage checkpoints are kept (default: <output>.checkpoints)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    done, failed, skipped = run_batch(args.input, args.output, args.docx_dir, args.workers, args.checkpoint_dir)
+    print(f"Finished: {done} done, {failed} failed, {skipped} skipped (already done).")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
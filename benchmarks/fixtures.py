@@ -0,0 +1,238 @@
+# benchmarks/fixtures.py
+"""
+Deterministic synthetic inputs for the benchmarks and the load test: generated PDFs, uploaded
+papers, prompt inputs, a populated search history database and local stand-ins for Gemini,
+PubChem, Cactus and Wikidata. Nothing here touches the network or the app's real data directory.
+"""
+import io
+import json
+import random
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import unquote, parse_qs
+
+SEED = 1234
+
+_WORDS = (
+    "catalyst polymer oxidation ligand synthesis yield selectivity framework solvent kinetics "
+    "spectroscopy monomer degradation enzyme cutinase terephthalate glycolysis zinc copper "
+    "temperature pressure reactor adsorption surface porous crystalline amorphous hydrolysis "
+    "membrane electrolyte battery electrode conductivity stability toxicity aqueous organic"
+).split()
+
+
+def prose(word_count, seed=SEED):
+    """Returns reproducible chemistry-flavoured text of about word_count words."""
+    rng = random.Random(seed)
+    sentences = []
+    remaining = word_count
+    while remaining > 0:
+        length = min(remaining, rng.randint(8, 20))
+        words = [rng.choice(_WORDS) for _ in range(length)]
+        sentences.append(" ".join(words).capitalize() + ".")
+        remaining -= length
+    return " ".join(sentences)
+
+
+class _UploadedPdf(io.BytesIO):
+    """Stands in for a Streamlit UploadedFile: bytes plus a file name."""
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name = name
+
+
+def pdf_document(pages):
+    """
+    Builds a PDF with the given number of text pages using the app's own PDF writer.
+    Returns an uploaded-file-like object.
+    """
+    from exports import render_pdf
+
+    # About 46 wrapped lines of ~85 characters fill one page
+    body = "\n".join(prose(14 * 46, seed=SEED + page) for page in range(pages))
+    data = render_pdf("Synthetic paper", body)
+    return _UploadedPdf(data, f"synthetic_{pages}_pages.pdf")
+
+
+def uploaded_papers(count, chars_per_paper):
+    return [
+        {"name": f"paper_{i}.pdf", "extracted_text": prose(chars_per_paper // 7, seed=SEED + i)}
+        for i in range(count)
+    ]
+
+
+def prompt_inputs():
+    """Realistic sizes for every prompt section."""
+    ideas = [prose(120, seed=SEED + i) for i in range(7)]
+    return {
+        "topic": prose(12),
+        "goal": prose(60, seed=SEED + 1),
+        "data": prose(200, seed=SEED + 2),
+        "idea": ideas[0],
+        "ideas": ideas,
+        "feedback": prose(25, seed=SEED + 3),
+        "literature_summary": prose(300, seed=SEED + 4),
+        "properties": prose(500, seed=SEED + 5),
+        "final_response": prose(700, seed=SEED + 6),
+        "question": prose(20, seed=SEED + 7),
+        "conversation_summary": prose(150, seed=SEED + 8),
+        "transcript": prose(1500, seed=SEED + 9),
+        # About 30k tokens: a handful of uploaded papers
+        "uploaded_text": "".join(
+            f"\n--- Start of Document: paper_{i}.pdf ---\n{prose(4000, seed=SEED + 10 + i)}\n--- End of Document: paper_{i}.pdf ---\n"
+            for i in range(5)
+        ),
+    }
+
+
+def populate_search_history(database_file, rows):
+    """Creates the search_history table in database_file and fills it with `rows` entries."""
+    import database
+
+    database.DATABASE_FILE = database_file
+    database.init_db()
+    rng = random.Random(SEED)
+    conn = sqlite3.connect(database_file)
+    conn.executemany(
+        "INSERT INTO search_history (timestamp, topic, goal, data) VALUES (?, ?, ?, ?)",
+        (
+            (f"2024-01-01 00:{i // 60 % 60:02d}:{i % 60:02d}", f"Topic {i} {rng.choice(_WORDS)}",
+             prose(40, seed=i), prose(80, seed=i + 1))
+            for i in range(rows)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+# --- Stub chemical databases ---
+
+STUB_CIDS = {f"stubamine {i}": 100000 + i for i in range(10000)}
+
+
+def _png(width, height):
+    """A valid grey PNG, so the app can display stub structure images."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    rows = b"".join(b"\x00" + bytes([200]) * width for _ in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+STUB_PNG = _png(300, 300)
+
+
+class _StubChemicalHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if "/compound/name/" in self.path:
+            name = unquote(self.path.split("/compound/name/")[1].split("/")[0]).lower()
+            if name in STUB_CIDS:
+                return self._send_json(200, {"IdentifierList": {"CID": [STUB_CIDS[name]]}})
+            return self._send_json(404, {"Fault": {"Code": "PUGREST.NotFound"}})
+        if self.path.startswith("/w/api.php"):
+            return self._send_json(200, {"search": []})
+        if self.path.endswith("/image"):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(STUB_PNG)))
+            self.end_headers()
+            self.wfile.write(STUB_PNG)
+            return
+        self._send_json(404, {})
+
+    def _is_known_image(self):
+        # Cactus answers HEAD probes only for names PubChem knows, so unknown names fall through
+        if not self.path.endswith("/image"):
+            return False
+        name = unquote(self.path.rsplit("/", 2)[-2])
+        return name.lower() in STUB_CIDS or name.startswith("stub-")
+
+    def do_HEAD(self):
+        self.send_response(200 if self._is_known_image() else 404)
+        self.end_headers()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        cids = [int(cid) for cid in form.get("cid", [""])[0].split(",") if cid]
+        self._send_json(200, {"PropertyTable": {"Properties": [
+            {"CID": cid, "IUPACName": f"stub-{cid}-amine"} for cid in cids
+        ]}})
+
+
+def start_stub_chemical_server():
+    """
+    Starts a local server answering like PubChem, Cactus and Wikidata and points
+    chemical_lookup at it. Returns the server; call shutdown() when done.
+    """
+    import chemical_lookup
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubChemicalHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}"
+    chemical_lookup.PUBCHEM_BASE_URL = url
+    chemical_lookup.CACTUS_BASE_URL = url
+    chemical_lookup.WIKIDATA_API_URL = f"{url}/w/api.php"
+    return server
+
+
+# --- Stub Gemini ---
+
+STUB_MODEL_TEXT = (
+    "1. Screen zinc-doped copper frameworks for selective CO2 reduction in aqueous electrolyte.\n"
+    "2. Engineer cutinase variants for low-temperature glycolysis of terephthalate polyesters.\n"
+    "3. Use 2,4-dimethylstubane as a porous ligand for ethanol dehydration over acetone.\n"
+    + prose(250, seed=SEED + 42)
+)
+
+
+class _StubGeminiHandler(BaseHTTPRequestHandler):
+    latency = 0.0 # Seconds each generation takes, to stand in for model time
+    jitter = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        candidate_count = payload.get("generationConfig", {}).get("candidateCount", 1)
+        time.sleep(self.latency + random.uniform(0, self.jitter))
+        body = json.dumps({"candidates": [
+            {"content": {"role": "model", "parts": [{"text": STUB_MODEL_TEXT}]}} for _ in range(candidate_count)
+        ]}).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stub_gemini_server(latency=0.0, jitter=0.0):
+    """
+    Starts a local server answering generateContent requests with a fixed numbered list of ideas
+    after `latency` (plus up to `jitter`) seconds, and points gemini_api at it.
+    Returns the server; call shutdown() when done.
+    """
+    import gemini_api
+
+    handler = type("StubGeminiHandler", (_StubGeminiHandler,), {"latency": latency, "jitter": jitter})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    gemini_api.API_URL = f"http://127.0.0.1:{server.server_port}/v1beta/models/stub:generateContent"
+    gemini_api.API_KEY = gemini_api.API_KEY or "stub-key"
+    return server
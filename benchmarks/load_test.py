@@ -0,0 +1,417 @@
+# benchmarks/load_test.py
+"""
+Drives many simulated users through the full five-stage flow at once and reports how the
+shared server holds up.
+
+Usage (from the repository root):
+    python benchmarks/load_test.py --users 20 --flows 2 --model-latency 1.0 --json load.json
+
+Every user is a headless Streamlit session (AppTest) running app.py in this process, as the
+sessions of one `streamlit run` server do. Each flow enters a topic, generates ideas, approves
+the first idea, the literature summary and the properties (with one chemical lookup in between)
+and compiles the final proposal. Gemini, PubChem, Cactus and Wikidata are local stand-ins from
+fixtures.py; --model-latency sets how long each model call takes.
+
+Reports throughput, latency percentiles per step, the process RSS and how often (and how long)
+SQLite statements waited for a lock held by another session.
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from unittest.mock import MagicMock
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(REPO_ROOT, "app.py")
+sys.path.insert(0, REPO_ROOT)
+
+import fixtures
+
+RSS_SAMPLE_SECONDS = 0.2
+LOOKUP_POLL_SECONDS = 0.05 # How often a flow checks whether its background chemical lookup finished
+PERCENTILES = (50, 90, 95, 99)
+
+# Steps of one flow: (name, stage the session should be in afterwards)
+FLOW_STEPS = (
+    ("load", "input_details"),
+    ("generate_ideas", "review_ideas"),
+    ("approve_idea", "literature_summary"),
+    ("approve_summary", "properties_prediction"),
+    ("chemical_lookup", "properties_prediction"),
+    ("approve_properties", "final_compilation"),
+)
+
+
+class FlowError(Exception):
+    pass
+
+
+# --- SQLite lock waits ---
+
+class LockWaitStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.statements = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, waited=None):
+        with self._lock:
+            self.statements += 1
+            if waited is not None:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+
+lock_waits = LockWaitStats()
+
+
+def _run_with_lock_timing(connection, operation):
+    """
+    Runs a statement with SQLite's busy timeout switched off, so contention surfaces as an
+    immediate "database is locked" error. That statement is then retried with the connection's
+    real timeout and the time until it succeeds is recorded as a lock wait.
+    """
+    try:
+        result = operation()
+    except sqlite3.OperationalError as e:
+        if "locked" not in str(e):
+            raise
+    else:
+        lock_waits.record()
+        return result
+
+    started = time.perf_counter()
+    sqlite3.Connection.execute(connection, f"PRAGMA busy_timeout = {connection.busy_timeout_ms}")
+    try:
+        return operation()
+    finally:
+        lock_waits.record(time.perf_counter() - started)
+        sqlite3.Connection.execute(connection, "PRAGMA busy_timeout = 0")
+
+
+class _LockTimingCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        return _run_with_lock_timing(self.connection, lambda: super(_LockTimingCursor, self).execute(*args))
+
+    def executemany(self, *args):
+        return _run_with_lock_timing(self.connection, lambda: super(_LockTimingCursor, self).executemany(*args))
+
+
+class _LockTimingConnection(sqlite3.Connection):
+    def __init__(self, database, timeout=5.0, *args, **kwargs):
+        super().__init__(database, timeout, *args, **kwargs)
+        self.busy_timeout_ms = int(timeout * 1000)
+        sqlite3.Connection.execute(self, "PRAGMA busy_timeout = 0")
+
+    def cursor(self, factory=_LockTimingCursor):
+        return super().cursor(factory)
+
+    def commit(self):
+        return _run_with_lock_timing(self, super().commit)
+
+
+def install_lock_timing():
+    """
+    Makes every sqlite3.connect() in the app return a connection that records lock waits.
+    """
+    sqlite3.connect = functools.partial(sqlite3.connect, factory=_LockTimingConnection)
+
+
+# --- Process RSS ---
+
+def current_rss_bytes():
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource # Not Linux: only the peak is available
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+class RssSampler(threading.Thread):
+    def __init__(self):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.start_bytes = current_rss_bytes()
+        self.peak_bytes = self.start_bytes
+        self.end_bytes = self.start_bytes
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(RSS_SAMPLE_SECONDS):
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.end_bytes = current_rss_bytes()
+        self.peak_bytes = max(self.peak_bytes, self.end_bytes)
+
+
+# --- Concurrent headless sessions ---
+
+@contextmanager
+def concurrent_app_tests():
+    """
+    Lets AppTest sessions run at the same time in one process, sharing one runtime as the
+    sessions of a real server do.
+
+    AppTest is written for one session at a time: every run installs a fresh mock Runtime as the
+    process-wide instance and removes it when it finishes, patches the global config for its
+    duration and compiles app.py into a fresh script cache. With several sessions running, one
+    finishing would pull the runtime out from under the others. Here the per-run installs land on
+    a subclass instead, and the shared runtime, script cache and config patch are set up once for
+    the whole load test.
+    """
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+    from streamlit.testing.v1 import app_test
+    from streamlit.testing.v1.util import patch_config_options
+
+    class PerRunRuntime(Runtime):
+        pass
+
+    shared_runtime = MagicMock(spec=Runtime)
+    shared_runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    shared_runtime.cache_storage_manager = MemoryCacheStorageManager()
+    shared_runtime.dataframe_source_mgr = DataframeSourceManager()
+
+    shared_script_cache = ScriptCache()
+
+    saved = (app_test.Runtime, app_test.ScriptCache, app_test.patch_config_options, Runtime._instance)
+    app_test.Runtime = PerRunRuntime
+    app_test.ScriptCache = lambda: shared_script_cache
+    app_test.patch_config_options = lambda overrides: nullcontext()
+    Runtime._instance = shared_runtime
+    try:
+        with patch_config_options({"global.appTest": True}):
+            yield
+    finally:
+        app_test.Runtime, app_test.ScriptCache, app_test.patch_config_options, Runtime._instance = saved
+
+
+# --- Simulated users ---
+
+def _click(app_test, label):
+    for button in app_test.button:
+        if button.label == label:
+            return button.click()
+    raise FlowError(f"no '{label}' button on stage '{app_test.session_state['stage']}'")
+
+
+def _run_step(app_test, name, expected_stage, action, step_timings):
+    started = time.perf_counter()
+    action()
+    app_test.run()
+    elapsed = time.perf_counter() - started
+    if app_test.exception:
+        raise FlowError(f"{name}: app raised {app_test.exception[0].value}")
+    if app_test.session_state["stage"] != expected_stage:
+        raise FlowError(f"{name}: ended on stage '{app_test.session_state['stage']}', expected '{expected_stage}'")
+    step_timings.setdefault(name, []).append(elapsed)
+
+
+def run_flow(user, flow, step_timings, timeout):
+    """
+    Takes one fresh session through all five stages. Returns the per-step timings of this flow.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    app_test = AppTest.from_file(APP_FILE, default_timeout=timeout)
+
+    def enter_details():
+        app_test.text_input(key="input_topic").input(f"Plastic recycling catalysts (user {user}, flow {flow})")
+        app_test.text_area(key="input_goal").input("Find catalysts that depolymerize PET below 80 °C.")
+        app_test.text_area(key="input_data").input("Zinc acetate and cutinase give 60% yield at 150 °C.")
+        _click(app_test, "💡 Generate Research Ideas")
+
+    def look_up_chemical():
+        app_test.text_input(key="chemical_lookup_input").input(f"stubamine {(user * 100 + flow) % len(fixtures.STUB_CIDS)}")
+        _click(app_test, "🔎 Look Up Chemical Structure")
+        app_test.run()
+        # The lookup runs in the background; rerun, as the panel's polling would, until it lands
+        deadline = time.monotonic() + timeout
+        while app_test.session_state["chemical_lookup_job"] is not None and time.monotonic() < deadline:
+            time.sleep(LOOKUP_POLL_SECONDS)
+            app_test.run()
+
+    actions = {
+        "load": lambda: None,
+        "generate_ideas": enter_details,
+        "approve_idea": lambda: _click(app_test, "👍 Approve Idea"),
+        "approve_summary": lambda: _click(app_test, "👍 Approve Summary"),
+        "chemical_lookup": look_up_chemical,
+        "approve_properties": lambda: _click(app_test, "👍 Approve Properties"),
+    }
+    for name, expected_stage in FLOW_STEPS:
+        _run_step(app_test, name, expected_stage, actions[name], step_timings)
+    if not app_test.session_state["chemical_lookup_success"]:
+        raise FlowError("chemical_lookup: no structure found")
+    if "⚠️" in (app_test.session_state["final_response"] or "⚠️"):
+        raise FlowError("approve_properties: no final proposal")
+
+
+def run_user(user, flows, start_delay, timeout, think_time, results):
+    time.sleep(start_delay)
+    for flow in range(flows):
+        step_timings = {}
+        started = time.perf_counter()
+        try:
+            run_flow(user, flow, step_timings, timeout)
+        except Exception as e:
+            results["failures"].append(f"user {user} flow {flow}: {e}")
+        else:
+            results["flow_seconds"].append(time.perf_counter() - started)
+        with results["lock"]:
+            for name, timings in step_timings.items():
+                results["steps"].setdefault(name, []).extend(timings)
+        if think_time:
+            time.sleep(random.uniform(0, 2 * think_time))
+
+
+# --- Report ---
+
+def percentile(values, p):
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, -(-p * len(ordered) // 100) - 1)) # Nearest rank
+    return ordered[rank]
+
+
+def summarize_timings(values):
+    summary = {f"p{p}_ms": round(percentile(values, p) * 1000, 1) for p in PERCENTILES}
+    summary["max_ms"] = round(max(values) * 1000, 1)
+    summary["count"] = len(values)
+    return summary
+
+
+def run_load_test(users, flows, ramp_up, model_latency, model_jitter, think_time, timeout):
+    """
+    Runs the load test in a temporary working directory. Returns the report as a dict.
+    """
+    import compound_dictionary
+    import tracing
+
+    install_lock_timing()
+    logging.disable(logging.WARNING) # Per-request log lines from every session would bury the report
+    compound_dictionary.COMPOUND_DICTIONARY_FILE = os.path.join(REPO_ROOT, "data", "compounds.tsv")
+    gemini_server = fixtures.start_stub_gemini_server(model_latency, model_jitter)
+    chemical_server = fixtures.start_stub_chemical_server()
+
+    results = {"lock": threading.Lock(), "steps": {}, "flow_seconds": [], "failures": []}
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root) # The app creates data/*.db relative to the working directory
+        tracing.TRACE_FILE = os.path.join(data_root, "data", "traces.jsonl")
+        sampler = RssSampler()
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            with concurrent_app_tests(), ThreadPoolExecutor(max_workers=users, thread_name_prefix="user") as executor:
+                for user in range(users):
+                    start_delay = ramp_up * user / users
+                    executor.submit(run_user, user, flows, start_delay, timeout, think_time, results)
+        finally:
+            wall_seconds = time.perf_counter() - started
+            sampler.stop()
+            os.chdir(working_dir)
+            gemini_server.shutdown()
+            chemical_server.shutdown()
+
+    completed = len(results["flow_seconds"])
+    script_runs = sum(len(timings) for timings in results["steps"].values())
+    return {
+        "config": {
+            "users": users, "flows_per_user": flows, "ramp_up_seconds": ramp_up,
+            "model_latency_seconds": model_latency, "model_jitter_seconds": model_jitter,
+            "think_time_seconds": think_time,
+        },
+        "wall_seconds": round(wall_seconds, 2),
+        "flows_completed": completed,
+        "flows_failed": len(results["failures"]),
+        "failures": results["failures"][:20],
+        "throughput": {
+            "flows_per_minute": round(completed / wall_seconds * 60, 2),
+            "script_runs_per_second": round(script_runs / wall_seconds, 2),
+        },
+        "flow": summarize_timings(results["flow_seconds"]) if completed else None,
+        "steps": {
+            name: summarize_timings(results["steps"][name])
+            for name, _ in FLOW_STEPS if results["steps"].get(name)
+        },
+        "rss_mb": {
+            "start": round(sampler.start_bytes / 2**20, 1),
+            "peak": round(sampler.peak_bytes / 2**20, 1),
+            "end": round(sampler.end_bytes / 2**20, 1),
+        },
+        "sqlite": {
+            "statements": lock_waits.statements,
+            "lock_waits": lock_waits.waits,
+            "lock_wait_total_ms": round(lock_waits.wait_seconds * 1000, 1),
+            "lock_wait_max_ms": round(lock_waits.max_wait_seconds * 1000, 1),
+        },
+    }
+
+
+def print_report(report):
+    config = report["config"]
+    print(f"{config['users']} users x {config['flows_per_user']} flows, model latency "
+          f"{config['model_latency_seconds']}s (+{config['model_jitter_seconds']}s jitter), {report['wall_seconds']}s wall time")
+    print(f"Flows: {report['flows_completed']} completed, {report['flows_failed']} failed")
+    print(f"Throughput: {report['throughput']['flows_per_minute']} flows/min, "
+          f"{report['throughput']['script_runs_per_second']} script runs/s")
+    header = "".join(f"{f'p{p}':>10}" for p in PERCENTILES)
+    print(f"\n{'step':<22}{header}{'max':>10}{'count':>8}   (ms)")
+    rows = list(report["steps"].items()) + ([("whole flow", report["flow"])] if report["flow"] else [])
+    for name, summary in rows:
+        values = "".join(f"{summary[f'p{p}_ms']:>10.1f}" for p in PERCENTILES)
+        print(f"{name:<22}{values}{summary['max_ms']:>10.1f}{summary['count']:>8}")
+    rss = report["rss_mb"]
+    print(f"\nRSS: {rss['start']} MB at start, {rss['peak']} MB peak, {rss['end']} MB at end")
+    sqlite_stats = report["sqlite"]
+    print(f"SQLite: {sqlite_stats['statements']} statements, {sqlite_stats['lock_waits']} waited for a lock "
+          f"({sqlite_stats['lock_wait_total_ms']} ms total, {sqlite_stats['lock_wait_max_ms']} ms longest)")
+    for failure in report["failures"]:
+        print(f"  failed: {failure}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the app with simulated concurrent users.")
+    parser.add_argument("-u", "--users", type=int, default=10, help="concurrent simulated users (default: 10)")
+    parser.add_argument("-f", "--flows", type=int, default=1, help="full flows each user runs (default: 1)")
+    parser.add_argument("--ramp-up", type=float, default=0.0, help="seconds over which users start (default: all at once)")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="seconds each stub Gemini call takes (default: 1.0)")
+    parser.add_argument("--model-jitter", type=float, default=0.5, help="extra random seconds per Gemini call, up to this (default: 0.5)")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between a user's flows in seconds (default: 0)")
+    parser.add_argument("--timeout", type=float, default=120, help="seconds a single script run may take (default: 120)")
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    args = parser.parse_args(argv)
+
+    report = run_load_test(args.users, args.flows, args.ramp_up, args.model_latency, args.model_jitter,
+                           args.think_time, args.timeout)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["flows_failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
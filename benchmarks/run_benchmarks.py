@@ -0,0 +1,304 @@
+# benchmarks/run_benchmarks.py
+"""
+Microbenchmarks for the hot paths outside the model calls.
+
+Usage (from the repository root):
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --baseline results.json --tolerance 0.10
+    python benchmarks/run_benchmarks.py --quick --filter prompts.
+
+Covers PDF text extraction (10/100/500 pages), combining uploaded papers, every prompt
+formatter, loading the search history (1k/100k rows), chemical lookups against a local stub of
+PubChem/Cactus/Wikidata, and DOCX/PDF export. All inputs are generated deterministically in a
+temporary directory, so no API key or network access is needed.
+
+Results are written as JSON ({"meta": ..., "results": {name: timings}}). With --baseline,
+each benchmark's median is compared with the same benchmark in an earlier results file and the
+run exits with status 1 if any is slower by more than the tolerance.
+"""
+import argparse
+import datetime
+import fnmatch
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import fixtures
+
+DEFAULT_TOLERANCE = 0.10 # A median more than 10% slower than the baseline counts as a regression
+
+
+class Benchmark:
+    """
+    A named measurement. setup() runs once, untimed, and returns the zero-argument callable
+    that is timed. Heavy benchmarks are skipped with --quick.
+    """
+    def __init__(self, name, setup, repeat=20, heavy=False):
+        self.name = name
+        self.setup = setup
+        self.repeat = repeat
+        self.heavy = heavy
+
+
+# --- Benchmark definitions ---
+
+def _pdf_extract(pages):
+    def setup():
+        from pdf_processor import extract_text_from_pdf
+        document = fixtures.pdf_document(pages)
+        return lambda: extract_text_from_pdf(document)
+    return setup
+
+
+def _combined_uploaded_text(count, chars_per_paper):
+    def setup():
+        import streamlit as st
+        from pdf_processor import get_combined_uploaded_text
+        # Session state works outside a script run ("bare mode"); its warnings are muted with the rest
+        st.session_state.uploaded_papers_data = fixtures.uploaded_papers(count, chars_per_paper)
+        return get_combined_uploaded_text
+    return setup
+
+
+def _prompt(formatter_name):
+    def setup():
+        import prompts
+        inputs = fixtures.prompt_inputs()
+        formatter = getattr(prompts, formatter_name)
+        calls = {
+            "format_research_ideas_prompt": lambda: formatter(
+                inputs["topic"], inputs["goal"], inputs["data"], uploaded_text_context=inputs["uploaded_text"]),
+            "format_refine_idea_prompt": lambda: formatter(
+                inputs["idea"], inputs["feedback"], inputs["topic"], inputs["goal"], inputs["data"],
+                uploaded_text_context=inputs["uploaded_text"]),
+            "format_refine_ideas_batch_prompt": lambda: formatter(
+                inputs["ideas"], inputs["feedback"], inputs["topic"], inputs["goal"], inputs["data"],
+                uploaded_text_context=inputs["uploaded_text"]),
+            "format_literature_summary_prompt": lambda: formatter(
+                inputs["idea"], uploaded_text_context=inputs["uploaded_text"]),
+            "format_properties_prediction_prompt": lambda: formatter(inputs["idea"]),
+            "format_final_response_prompt": lambda: formatter(
+                inputs["idea"], inputs["literature_summary"], inputs["properties"]),
+            "format_follow_up_question_prompt": lambda: formatter(
+                inputs["idea"], inputs["literature_summary"], inputs["properties"], inputs["question"],
+                uploaded_text_context=inputs["uploaded_text"]),
+            "format_follow_up_chat_instruction": lambda: formatter(
+                inputs["idea"], inputs["literature_summary"], inputs["properties"],
+                uploaded_text_context=inputs["uploaded_text"]),
+            "format_follow_up_chat_turns": lambda: formatter(
+                [{"role": "user", "parts": [{"text": inputs["question"]}]},
+                 {"role": "model", "parts": [{"text": inputs["transcript"]}]}],
+                inputs["question"], conversation_summary=inputs["conversation_summary"]),
+            "format_chat_compaction_prompt": lambda: formatter(inputs["conversation_summary"], inputs["transcript"]),
+            "format_search_queries_prompt": lambda: formatter(
+                inputs["idea"], inputs["literature_summary"], uploaded_text_context=inputs["uploaded_text"]),
+        }
+        return calls[formatter_name]
+    return setup
+
+
+PROMPT_FORMATTERS = (
+    "format_research_ideas_prompt",
+    "format_refine_idea_prompt",
+    "format_refine_ideas_batch_prompt",
+    "format_literature_summary_prompt",
+    "format_properties_prediction_prompt",
+    "format_final_response_prompt",
+    "format_follow_up_question_prompt",
+    "format_follow_up_chat_instruction",
+    "format_follow_up_chat_turns",
+    "format_chat_compaction_prompt",
+    "format_search_queries_prompt",
+)
+
+
+def _load_search_history(rows, data_dir):
+    def setup():
+        import database
+        database_file = os.path.join(data_dir, f"search_history_{rows}.db")
+        if not os.path.exists(database_file):
+            fixtures.populate_search_history(database_file, rows)
+        database.DATABASE_FILE = database_file
+        return database.load_search_history
+    return setup
+
+
+def _chemical_lookup(mode, data_dir):
+    """
+    mode is "cold_hit" (unseen name PubChem knows), "cold_miss" (unseen name no resolver knows,
+    so every fallback runs) or "cached" (the same name again, answered from the cache).
+    """
+    def setup():
+        import chemical_cache
+        from chemical_lookup import fetch_chemical_info
+
+        chemical_cache.CACHE_DATABASE_FILE = os.path.join(data_dir, f"chemical_cache_{mode}.db")
+        chemical_cache.init_chemical_cache()
+        fixtures.start_stub_chemical_server()
+        counter = itertools.count()
+        if mode == "cold_hit":
+            return lambda: fetch_chemical_info(f"stubamine {next(counter)}")
+        if mode == "cold_miss":
+            return lambda: fetch_chemical_info(f"unknownium {next(counter)}")
+        fetch_chemical_info("stubamine 9999")
+        return lambda: fetch_chemical_info("stubamine 9999")
+    return setup
+
+
+def _export(export_format, words):
+    def setup():
+        from exports import render_docx, render_pdf
+        renderer = {"docx": render_docx, "pdf": render_pdf}[export_format]
+        body = fixtures.prose(words)
+        # The renderers are called directly; export_document() would serve repeats from its cache
+        return lambda: renderer("Final Research Proposal Overview", body)
+    return setup
+
+
+def build_benchmarks(data_dir):
+    benchmarks = [
+        Benchmark("pdf.extract[10 pages]", _pdf_extract(10), repeat=10),
+        Benchmark("pdf.extract[100 pages]", _pdf_extract(100), repeat=5),
+        Benchmark("pdf.extract[500 pages]", _pdf_extract(500), repeat=3, heavy=True),
+        Benchmark("uploaded_text.combine[10 papers]", _combined_uploaded_text(10, 60000)),
+        Benchmark("uploaded_text.combine[200 papers]", _combined_uploaded_text(200, 60000)),
+    ]
+    benchmarks += [Benchmark(f"prompts.{name}", _prompt(name), repeat=50) for name in PROMPT_FORMATTERS]
+    benchmarks += [
+        Benchmark("history.load[1k rows]", _load_search_history(1000, data_dir)),
+        Benchmark("history.load[100k rows]", _load_search_history(100000, data_dir), repeat=3, heavy=True),
+        Benchmark("chemical.fetch[cold hit]", _chemical_lookup("cold_hit", data_dir)),
+        Benchmark("chemical.fetch[cold miss]", _chemical_lookup("cold_miss", data_dir)),
+        Benchmark("chemical.fetch[cached]", _chemical_lookup("cached", data_dir), repeat=50),
+        Benchmark("export.docx[proposal]", _export("docx", 2000), repeat=10),
+        Benchmark("export.pdf[proposal]", _export("pdf", 2000), repeat=10),
+    ]
+    return benchmarks
+
+
+# --- Running and comparing ---
+
+def measure(benchmark):
+    fn = benchmark.setup()
+    fn() # Warm-up: first-call imports and caches are not what is being measured
+    timings = []
+    for _ in range(benchmark.repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 3),
+        "min_ms": round(min(timings) * 1000, 3),
+        "max_ms": round(max(timings) * 1000, 3),
+        "runs": len(timings),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(patterns=None, quick=False):
+    """
+    Runs the selected benchmarks. Returns the results document.
+    """
+    import tracing
+
+    logging.disable(logging.WARNING) # Per-lookup log lines (misses are warnings) would swamp the report
+    results = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        # Spans are still recorded, as in the app, but not into the repository's data directory
+        tracing.TRACE_FILE = os.path.join(data_dir, "traces.jsonl")
+        import compound_dictionary
+        compound_dictionary.COMPOUND_DICTIONARY_FILE = os.path.join(REPO_ROOT, "data", "compounds.tsv")
+
+        for benchmark in build_benchmarks(data_dir):
+            if quick and benchmark.heavy:
+                continue
+            if patterns and not any(fnmatch.fnmatch(benchmark.name, f"*{pattern}*") for pattern in patterns):
+                continue
+            results[benchmark.name] = measure(benchmark)
+            summary = results[benchmark.name]
+            print(f"{benchmark.name:<55} median {summary['median_ms']:>10.3f} ms   "
+                  f"min {summary['min_ms']:>10.3f} ms   ({summary['runs']} runs)", flush=True)
+
+    return {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": quick,
+        },
+        "results": results,
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares medians with a baseline results document. Returns a list of
+    (name, baseline_ms, current_ms, change, verdict) for benchmarks present in both.
+    """
+    comparisons = []
+    for name, current in results["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous or not previous["median_ms"]:
+            continue
+        change = current["median_ms"] / previous["median_ms"] - 1
+        if change > tolerance:
+            verdict = "slower"
+        elif change < -tolerance:
+            verdict = "faster"
+        else:
+            verdict = "same"
+        comparisons.append((name, previous["median_ms"], current["median_ms"], change, verdict))
+    return comparisons
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the microbenchmark suite.")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with an earlier results file and fail on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed relative slowdown of a median before it counts as a regression (default: {DEFAULT_TOLERANCE})")
+    parser.add_argument("--filter", action="append", help="only run benchmarks whose name contains this (repeatable, wildcards allowed)")
+    parser.add_argument("--quick", action="store_true", help="skip the 500-page PDF and 100k-row history benchmarks")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.filter, args.quick)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if not args.baseline:
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    comparisons = compare_with_baseline(results, baseline, args.tolerance)
+    print(f"\nCompared with {args.baseline} (commit {baseline.get('meta', {}).get('commit')}):")
+    for name, previous_ms, current_ms, change, verdict in comparisons:
+        print(f"{name:<55} {previous_ms:>10.3f} -> {current_ms:>10.3f} ms   {change:>+7.1%}   {verdict}")
+    regressions = [comparison for comparison in comparisons if comparison[4] == "slower"]
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.tolerance:.0%}.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
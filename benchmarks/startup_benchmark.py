@@ -0,0 +1,119 @@
+# benchmarks/startup_benchmark.py
+"""
+Measures how long the app takes to start and to rerun.
+
+Usage (from the repository root):
+    python benchmarks/startup_benchmark.py --runs 5
+
+Reports the median and worst time of:
+  - cold import: importing the UI modules in a fresh interpreter (container cold start),
+  - first run: the first script run of app.py in a process, including one-time initialization,
+  - rerun: later script runs of the input and idea review steps (per-interaction overhead).
+No network access is needed; the databases are created in a temporary directory.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(REPO_ROOT, "app.py")
+
+COLD_IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); import ui_sections; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def measure_cold_import(runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_IMPORT_SNIPPET],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]))
+    return timings
+
+
+def _timed_run(app_test):
+    started = time.perf_counter()
+    app_test.run()
+    if app_test.exception:
+        raise RuntimeError(f"app raised: {app_test.exception[0].value}")
+    return time.perf_counter() - started
+
+
+def measure_script_runs(runs):
+    """
+    Returns (first_run, input_reruns, review_reruns) timings from Streamlit's AppTest.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    review_state = {
+        "stage": "review_ideas",
+        "ideas": ["Idea one", "Idea two", "Idea three"],
+        "idea_index": 0,
+    }
+
+    first_run, input_reruns, review_reruns = [], [], []
+    app_test = AppTest.from_file(APP_FILE, default_timeout=60)
+    first_run.append(_timed_run(app_test))
+    for _ in range(runs):
+        input_reruns.append(_timed_run(app_test))
+
+    app_test = AppTest.from_file(APP_FILE, default_timeout=60)
+    for key, value in review_state.items():
+        app_test.session_state[key] = value
+    _timed_run(app_test)
+    for _ in range(runs):
+        review_reruns.append(_timed_run(app_test))
+    return first_run, input_reruns, review_reruns
+
+
+def summarize(timings):
+    return {
+        "median_ms": round(statistics.median(timings) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1),
+        "runs": len(timings),
+    }
+
+
+def run_benchmark(runs):
+    sys.path.insert(0, REPO_ROOT)
+    results = {"cold_import": summarize(measure_cold_import(runs))}
+
+    working_dir = os.getcwd()
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root) # The app creates data/*.db relative to the working directory
+        try:
+            first_run, input_reruns, review_reruns = measure_script_runs(runs)
+        finally:
+            os.chdir(working_dir)
+    results["first_run"] = summarize(first_run)
+    results["rerun_input_details"] = summarize(input_reruns)
+    results["rerun_review_ideas"] = summarize(review_reruns)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app start-up and rerun times.")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="repetitions per measurement (default: 5)")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args.runs)
+    for name, summary in results.items():
+        print(f"{name:<22} median {summary['median_ms']:>8.1f} ms   max {summary['max_ms']:>8.1f} ms   ({summary['runs']} runs)")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
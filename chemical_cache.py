@@ -0,0 +1,226 @@
+# chemical_cache.py
+import atexit
+import sqlite3
+import os
+import re
+import threading
+import time
+import logging
+
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+CACHE_DATABASE_FILE = "data/chemical_cache.db" # Shared by all sessions, lives next to search_history.db
+
+# How long resolved identities stay valid. "Not found" answers expire much sooner so that
+# a compound that PubChem adds later (or a transient outage) does not stick for days.
+POSITIVE_TTL_SECONDS = 7 * 24 * 3600
+NEGATIVE_TTL_SECONDS = 1 * 3600
+
+# Hit/miss counters are kept in memory and added to the database at most this often, so cache
+# reads never take SQLite's write lock
+STATS_FLUSH_SECONDS = 60
+
+def normalize_query(name_or_cas):
+    """
+    Normalizes a user query so that trivially different spellings share one cache entry
+    ("  Acetone ", "acetone" and "ACETONE" all map to "acetone").
+    """
+    return " ".join(str(name_or_cas).split()).lower()
+
+_ELEMENT_SYMBOLS = (
+    "H He Li Be B C N O F Ne Na Mg Al Si P S Cl Ar K Ca Sc Ti V Cr Mn Fe Co Ni Cu Zn Ga Ge As Se Br Kr "
+    "Rb Sr Y Zr Nb Mo Tc Ru Rh Pd Ag Cd In Sn Sb Te I Xe Cs Ba La Ce Pr Nd Pm Sm Eu Gd Tb Dy Ho Er Tm Yb "
+    "Lu Hf Ta W Re Os Ir Pt Au Hg Tl Pb Bi Po At Rn Fr Ra Ac Th Pa U Np Pu Am Cm Bk Cf Es Fm Md No Lr"
+).split()
+# Names written as element symbols ("CO", "Co", "NO", "No", "NaOH") are formulas, where case matters.
+# Two-letter symbols are tried first so that "Co" is cobalt rather than C followed by "o".
+_FORMULA_PATTERN = re.compile(
+    r"^(?:(?:" + "|".join(sorted(_ELEMENT_SYMBOLS, key=len, reverse=True)) + r")\d*)+$"
+)
+
+def cache_key(name_or_cas):
+    """
+    Cache key of a query: its kind (see chemical_lookup.classify_chemical_query) and value.
+    Only plain names are case-folded and have their whitespace collapsed; SMILES, InChI,
+    InChIKeys and formulas are case-sensitive ("c1ccccc1" is benzene, "C1CCCCC1" cyclohexane)
+    and are kept exactly as typed.
+    """
+    from chemical_lookup import classify_chemical_query # chemical_lookup imports this module
+    kind, value = classify_chemical_query(name_or_cas)
+    if kind == "name" and not _FORMULA_PATTERN.match(value):
+        value = normalize_query(value)
+    return f"{kind}:{value}"
+
+_cache_initialized = False
+
+def _connect():
+    # The cache is also used outside the Streamlit app, so create the tables on first use
+    if not _cache_initialized:
+        init_chemical_cache()
+    return sqlite3.connect(CACHE_DATABASE_FILE, timeout=10)
+
+def init_chemical_cache():
+    """
+    Creates the chemical identity cache tables if they don't exist and deletes expired entries,
+    so the table doesn't keep every query ever made.
+    """
+    global _cache_initialized
+    os.makedirs(os.path.dirname(CACHE_DATABASE_FILE), exist_ok=True)
+
+    conn = sqlite3.connect(CACHE_DATABASE_FILE, timeout=10)
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chemical_identity (
+            query TEXT PRIMARY KEY,
+            cid INTEGER,
+            image_url TEXT,
+            source TEXT,
+            matched_name TEXT,
+            found INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+    # Wikidata answers used to point at the entity page, which is not an image; resolve them again
+    cursor.execute("DELETE FROM chemical_identity WHERE image_url LIKE 'https://www.wikidata.org/wiki/%'")
+    # Entries keyed by the lower-cased query alone mixed up case-sensitive identifiers; drop them
+    cursor.execute(
+        "DELETE FROM chemical_identity WHERE substr(query, 1, instr(query, ':') - 1) "
+        "NOT IN ('name', 'cas', 'inchi', 'inchikey', 'cid', 'smiles')"
+    )
+    cursor.execute("DELETE FROM chemical_identity WHERE expires_at < ?", (time.time(),))
+    if cursor.rowcount > 0:
+        logger.info(f"Purged {cursor.rowcount} expired chemical cache entries.")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chemical_cache_stats (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.commit()
+    conn.close()
+    _cache_initialized = True
+
+_pending_stats = {} # counter name -> increments not yet written
+_stats_lock = threading.Lock()
+_stats_flushed_at = time.monotonic()
+
+def _bump_stat(name):
+    with _stats_lock:
+        _pending_stats[name] = _pending_stats.get(name, 0) + 1
+        due = time.monotonic() - _stats_flushed_at >= STATS_FLUSH_SECONDS
+    if due:
+        flush_chemical_cache_stats()
+
+def flush_chemical_cache_stats():
+    """
+    Adds the hit/miss counts gathered in memory since the last flush to the database.
+    Runs every STATS_FLUSH_SECONDS from cache reads and once more at exit.
+    """
+    global _stats_flushed_at
+    with _stats_lock:
+        counts = dict(_pending_stats)
+        _pending_stats.clear()
+        _stats_flushed_at = time.monotonic()
+    if not counts:
+        return
+    try:
+        conn = _connect()
+        conn.executemany(
+            "INSERT INTO chemical_cache_stats (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            list(counts.items())
+        )
+        conn.commit()
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Could not save chemical cache stats: {e}")
+        with _stats_lock: # Keep them for the next flush
+            for name, count in counts.items():
+                _pending_stats[name] = _pending_stats.get(name, 0) + count
+
+atexit.register(flush_chemical_cache_stats)
+
+@traced("db.chemical_cache_get")
+def get_cached_chemical(name_or_cas):
+    """
+    Looks up a query in the cache.
+    Returns (hit, (cid, image_url, source, matched_name)). A negative entry is a hit whose
+    result tuple is all None, so callers can skip the remote resolvers entirely.
+    """
+    try:
+        conn = _connect()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Chemical cache unavailable: {e}")
+        return False, (None, None, None, None)
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT cid, image_url, source, matched_name, found, expires_at FROM chemical_identity WHERE query = ?",
+            (cache_key(name_or_cas),)
+        )
+        row = cursor.fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Chemical cache read failed: {e}")
+        return False, (None, None, None, None)
+    finally:
+        conn.close()
+
+    if row is None or row[5] < time.time():
+        _bump_stat("misses")
+        return False, (None, None, None, None)
+    _bump_stat("hits" if row[4] else "negative_hits")
+    if not row[4]:
+        return True, (None, None, None, None)
+    return True, (row[0], row[1], row[2], row[3])
+
+@traced("db.chemical_cache_save")
+def save_cached_chemical(name_or_cas, cid, image_url, source, matched_name):
+    """
+    Stores a resolver result. A result with neither a CID nor an image URL is stored as a
+    negative entry with the shorter TTL.
+    """
+    found = bool(cid or image_url)
+    ttl = POSITIVE_TTL_SECONDS if found else NEGATIVE_TTL_SECONDS
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR REPLACE INTO chemical_identity (query, cid, image_url, source, matched_name, found, expires_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (cache_key(name_or_cas), cid, image_url, source, matched_name, int(found), time.time() + ttl)
+        )
+        conn.commit()
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Chemical cache write failed: {e}")
+
+def get_chemical_cache_stats():
+    """
+    Returns hit/miss counters (including those not flushed yet), the overall hit rate and the
+    number of live entries.
+    """
+    stats = {"hits": 0, "negative_hits": 0, "misses": 0, "entries": 0, "negative_entries": 0}
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, value FROM chemical_cache_stats")
+        for name, value in cursor.fetchall():
+            stats[name] = value
+        cursor.execute(
+            "SELECT COUNT(*), COALESCE(SUM(1 - found), 0) FROM chemical_identity WHERE expires_at >= ?",
+            (time.time(),)
+        )
+        stats["entries"], stats["negative_entries"] = cursor.fetchone()
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Chemical cache stats unavailable: {e}")
+    with _stats_lock:
+        for name, count in _pending_stats.items():
+            stats[name] += count
+
+    lookups = stats["hits"] + stats["negative_hits"] + stats["misses"]
+    stats["hit_rate"] = (stats["hits"] + stats["negative_hits"]) / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,54 @@
+# chemical_entities.py
+import re
+
+from chemical_lookup import is_valid_cas
+from compound_dictionary import find_listed_compounds, lookup_compound
+
+# Upper bound on structures prefetched for one piece of AI output
+MAX_EXTRACTED_ENTITIES = 12
+
+_CAS_IN_TEXT_PATTERN = re.compile(r"(?<![\d-])\d{2,7}-\d{2}-\d(?![\d-])")
+# Systematic names with a locant prefix and a chemical suffix, e.g. "1,3-butadiene",
+# "2-methylpropan-1-ol" or "N,N-dimethylformamide". Requiring both keeps words like
+# "2-step" or "3-fold" out.
+_SYSTEMATIC_NAME_PATTERN = re.compile(
+    r"(?<![\w-])(?:\d+(?:,\d+)*|[NOS](?:,[NOS])*)-([a-z][\w,()\[\]-]*?"
+    r"(?:ane|ene|yne|ol|one|al|ide|ate|ine|amine|amide|ile|oxide|oic acid))(?![\w-])"
+)
+# The name after the locant must also contain a common stem, so "2-state" or "3-plate" aren't names
+_CHEMICAL_STEM_PATTERN = re.compile(
+    r"meth|eth|prop|but|pent|hex|hept|oct|non|dec|cycl|benz|phen|tolu|xyl|pyr|fur|thi|"
+    r"chlor|brom|fluor|iod|nitr|amin|amid|hydr|oxy|acet|form|vinyl|allyl|alk|anil|quin|"
+    r"az|imid|sulf|phosph|carb|glyc"
+)
+
+def extract_chemical_entities(text, limit=MAX_EXTRACTED_ENTITIES):
+    """
+    Extracts compound identifiers mentioned in AI output: CAS numbers with a valid check digit,
+    compounds from the offline dictionary and locant-prefixed systematic names.
+    Returns a de-duplicated list in order of appearance, at most `limit` long.
+    """
+    if not text:
+        return []
+
+    matches = []
+    for match in _CAS_IN_TEXT_PATTERN.finditer(text):
+        if is_valid_cas(match.group(0)):
+            matches.append((match.start(), match.group(0)))
+    for match in _SYSTEMATIC_NAME_PATTERN.finditer(text):
+        if _CHEMICAL_STEM_PATTERN.search(match.group(1)):
+            matches.append((match.start(), match.group(0)))
+    lowered = text.lower()
+    for name in find_listed_compounds(text):
+        matches.append((lowered.find(name), name))
+
+    entities = []
+    seen = set()
+    for _, entity in sorted(matches):
+        # A name and its CAS number often appear together; key listed compounds by CID
+        compound = lookup_compound(entity)
+        key = compound["cid"] if compound else entity.lower()
+        if key not in seen:
+            seen.add(key)
+            entities.append(entity)
+    return entities[:limit]
@@ -1,79 +1,261 @@
-import requests
-import urllib3
 import logging
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import quote
 
+from chemical_cache import get_cached_chemical, save_cached_chemical
+from compound_dictionary import lookup_compound
+from tracing import traced, propagate
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Disable SSL warnings in dev (not recommended in prod)
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the process-wide HTTP session with retry logic, creating it on first use so that
+    importing this module doesn't load requests.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            import urllib3
+            import requests
+            from requests.adapters import HTTPAdapter
+            from requests.packages.urllib3.util.retry import Retry
 
-# Use a session with retry logic
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
+            # Disable SSL warnings in dev (not recommended in prod)
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-session = requests.Session()
-retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
-adapter = HTTPAdapter(max_retries=retries)
-session.mount("https://", adapter)
-session.mount("http://", adapter)
+            session = requests.Session()
+            retries = Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+            adapter = HTTPAdapter(max_retries=retries)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
 
 # Define a global flag or pass it around if SSL verification should be skipped
 # For a quick fix, we'll modify the functions to always pass verify=False
 # This is NOT recommended for production environments.
 
-def fetch_pubchem_image(name_or_cas):
-    base_url = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+PUBCHEM_BASE_URL = "https://pubchem.ncbi.nlm.nih.gov/rest/pug"
+CACTUS_BASE_URL = "https://cactus.nci.nih.gov/chemical/structure"
+WIKIDATA_API_URL = "https://www.wikidata.org/w/api.php"
+# Commons redirects a file name to the file; a width makes it serve a PNG rendering of SVG drawings
+COMMONS_FILE_URL = "https://commons.wikimedia.org/wiki/Special:FilePath"
+WIKIDATA_STRUCTURE_IMAGE = "P117" # Wikidata's "chemical structure" property
+
+# PubChem allows at most 5 requests per second per client, so keep the fan-out small
+MAX_LOOKUP_WORKERS = 4
+# Number of CIDs sent in one property request (PubChem accepts long comma-separated lists)
+PUBCHEM_PROPERTY_BATCH_SIZE = 100
+
+_CAS_PATTERN = re.compile(r"^(\d{2,7})-(\d{2})-(\d)$")
+_INCHIKEY_PATTERN = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$")
+_CID_PATTERN = re.compile(r"^(?:CID[:\s]*)?(\d+)$", re.IGNORECASE)
+# Atoms, bonds, branches and ring closures of the SMILES grammar
+_SMILES_TOKEN_PATTERN = re.compile(r"\[[^\]]+\]|Br|Cl|[BCNOPSFI]|[bcnops]|[()=#\-+\\/:.~@*$]|%\d{2}|\d")
+_SMILES_ATOM_PATTERN = re.compile(r"\[[^\]]+\]|Br|Cl|[BCNOPSFI]|[bcnops]")
+# Bonds, branches, brackets, ring closures and aromatic atoms: what only SMILES has, not formulas or names
+_SMILES_SYNTAX_PATTERN = re.compile(r"[=#@/\\()\[\]]|\d|[bcnops]")
+# Strings of bare atoms up to this long ("CO", "NO", "ICl", "BOP") read as formulas or names first
+MAX_AMBIGUOUS_SMILES_LENGTH = 4
+
+class ResolverError(Exception):
+    """
+    Raised by a resolver that got no answer (timeout, connection or server error), as opposed
+    to a database answering that it doesn't know the compound. Such lookups are not cached.
+    """
+
+def is_valid_cas(cas):
+    """
+    Checks the format and check digit of a CAS registry number (e.g. "50-00-0").
+    """
+    match = _CAS_PATTERN.match(cas)
+    if not match:
+        return False
+    digits = match.group(1) + match.group(2)
+    checksum = sum(position * int(digit) for position, digit in enumerate(reversed(digits), start=1))
+    return checksum % 10 == int(match.group(3))
+
+def _looks_like_smiles(query):
+    """
+    True if the query is valid SMILES, which includes short atom strings such as "CO" that are
+    just as likely formulas or names.
+    """
+    if " " in query or not _SMILES_ATOM_PATTERN.search(query):
+        return False
+    tokens = _SMILES_TOKEN_PATTERN.findall(query)
+    if "".join(tokens) != query:
+        return False
+    # Formulas such as "CO2" or "CCl4" tokenize too, but leave a ring closure unpaired
+    ring_closures = [token for token in tokens if token.isdigit() or token.startswith("%")]
+    if any(ring_closures.count(label) % 2 for label in set(ring_closures)):
+        return False
+    # Aromatic (lowercase) atoms only occur in rings, which rules out element symbols like "Co"
+    if re.search(r"(?<!\[)[bcnops]", query) and not ring_closures:
+        return False
+    return query.count("(") == query.count(")")
+
+def _is_unambiguous_smiles(query):
+    return _looks_like_smiles(query) and bool(
+        _SMILES_SYNTAX_PATTERN.search(query) or len(query) > MAX_AMBIGUOUS_SMILES_LENGTH
+    )
+
+def classify_chemical_query(query):
+    """
+    Classifies a query locally so it can be routed to the right PubChem namespace.
+    Returns (kind, value) where kind is one of "cas", "invalid_cas", "inchi", "inchikey",
+    "cid", "smiles" or "name", and value is the cleaned-up identifier. Short strings that are
+    valid SMILES but read as formulas ("CO" is carbon monoxide, not methanol) are names;
+    _fetch_pubchem_cid tries them as SMILES only if PubChem knows no such name.
+    """
+    query = str(query).strip()
+    if _CAS_PATTERN.match(query):
+        return ("cas" if is_valid_cas(query) else "invalid_cas"), query
+    if query.startswith("InChI="):
+        return "inchi", query
+    if _INCHIKEY_PATTERN.match(query):
+        return "inchikey", query
+    cid_match = _CID_PATTERN.match(query)
+    if cid_match:
+        return "cid", int(cid_match.group(1))
+    if _is_unambiguous_smiles(query):
+        return "smiles", query
+    return "name", query
+
+def _cactus_image_url(name):
+    return f"{CACTUS_BASE_URL}/{quote(name)}/image"
+
+def _query_pubchem_cids(kind, value):
+    """
+    Returns the CIDs PubChem lists for an identifier in one namespace, [] if it knows none.
+    """
+    # Pass verify=False directly to bypass SSL verification
+    if kind in ("smiles", "inchi"):
+        # SMILES and InChI contain '/', '#' and '=' so they go in the request body
+        cid_resp = get_session().post(f"{PUBCHEM_BASE_URL}/compound/{kind}/cids/JSON", data={kind: value}, timeout=10, verify=False)
+    else:
+        namespace = "inchikey" if kind == "inchikey" else "name" # CAS numbers are PubChem synonyms
+        cid_resp = get_session().get(f"{PUBCHEM_BASE_URL}/compound/{namespace}/{quote(value, safe='')}/cids/JSON", timeout=10, verify=False)
+    if cid_resp.status_code == 404: # PubChem's answer for an identifier it doesn't know
+        return []
+    cid_resp.raise_for_status()
+    return cid_resp.json().get("IdentifierList", {}).get("CID", [])
+
+@traced("resolver.pubchem_cid")
+def _fetch_pubchem_cid(name_or_cas):
+    """
+    Resolves a query to its first PubChem CID, or None if PubChem doesn't know it.
+    The query is classified first and sent to the matching namespace; bare CIDs need no request.
+    Raises ResolverError if PubChem could not be asked.
+    """
+    kind, value = classify_chemical_query(name_or_cas)
+    if kind == "cid":
+        return value
+    if kind == "invalid_cas":
+        logger.info(f"Rejected '{value}': CAS check digit does not match.")
+        return None
+
+    import requests # Already loaded by get_session(); needed for its exception types
+
     try:
-        # Pass verify=False directly to bypass SSL verification
-        cid_resp = session.get(f"{base_url}/compound/name/{name_or_cas}/cids/JSON", timeout=10, verify=False)
-        cid_resp.raise_for_status()
+        cids = _query_pubchem_cids(kind, value)
+        if not cids and kind == "name" and _looks_like_smiles(value):
+            # Not a name PubChem knows, so read the atom string as SMILES after all
+            cids = _query_pubchem_cids("smiles", value)
     except requests.exceptions.HTTPError as http_err:
         logger.warning(f"PubChem returned HTTP error: {http_err}")
-        return None, None, None, None
+        raise ResolverError(f"PubChem: {http_err}") from http_err
     except Exception as e:
         logger.error(f"PubChem CID fetch failed: {e}")
-        return None, None, None, None
+        raise ResolverError(f"PubChem: {e}") from e
 
-    cids = cid_resp.json().get("IdentifierList", {}).get("CID", [])
     if not cids:
         logger.info("PubChem: No CID found.")
-        return None, None, None, None
-    cid = cids[0]
+        return None
+    return cids[0]
 
-    try:
-        # Pass verify=False directly to bypass SSL verification
-        name_resp = session.get(f"{base_url}/compound/cid/{cid}/property/IUPACName/JSON", timeout=10, verify=False)
-        name_resp.raise_for_status()
-        props = name_resp.json().get("PropertyTable", {}).get("Properties", [])
-        matched_name = props[0].get("IUPACName", name_or_cas) if props else name_or_cas
-    except Exception:
+@traced("resolver.pubchem_properties")
+def _fetch_pubchem_iupac_names(cids):
+    """
+    Fetches IUPAC names for many CIDs with one property request per batch.
+    Returns a dict {cid: iupac_name}; CIDs that could not be named are left out.
+    """
+    names = {}
+    cids = list(dict.fromkeys(cids))
+    for start in range(0, len(cids), PUBCHEM_PROPERTY_BATCH_SIZE):
+        batch = cids[start:start + PUBCHEM_PROPERTY_BATCH_SIZE]
+        try:
+            # POST keeps long CID lists out of the URL
+            resp = get_session().post(
+                f"{PUBCHEM_BASE_URL}/compound/cid/property/IUPACName/JSON",
+                data={"cid": ",".join(str(cid) for cid in batch)},
+                timeout=20,
+                verify=False
+            )
+            resp.raise_for_status()
+            for props in resp.json().get("PropertyTable", {}).get("Properties", []):
+                if props.get("IUPACName"):
+                    names[props["CID"]] = props["IUPACName"]
+        except Exception as e:
+            logger.warning(f"PubChem IUPACName batch fetch failed for {len(batch)} CIDs: {e}")
+    return names
+
+def _pubchem_result(name_or_cas, cid, iupac_names):
+    matched_name = iupac_names.get(cid)
+    if not matched_name:
+        if classify_chemical_query(name_or_cas)[0] == "cid":
+            # A bare CID that PubChem cannot name does not exist
+            return None, None, None, None
         matched_name = name_or_cas
+    return cid, _cactus_image_url(matched_name), "PubChem (Cactus)", matched_name
 
-    encoded_name = quote(matched_name)
-    image_url = f"https://cactus.nci.nih.gov/chemical/structure/{encoded_name}/image"
+@traced("resolver.local_dictionary")
+def fetch_local_dictionary(name_or_cas):
+    compound = lookup_compound(name_or_cas)
+    if not compound:
+        return None, None, None, None
+    matched_name = compound["iupac_name"]
+    return compound["cid"], _cactus_image_url(matched_name), "Local dictionary (Cactus)", matched_name
 
-    return cid, image_url, "PubChem (Cactus)", matched_name
+def fetch_pubchem_image(name_or_cas):
+    cid = _fetch_pubchem_cid(name_or_cas)
+    if not cid:
+        return None, None, None, None
+
+    return _pubchem_result(name_or_cas, cid, _fetch_pubchem_iupac_names([cid]))
 
+@traced("resolver.cactus")
 def fetch_cactus_image(name_or_cas):
-    encoded_name = quote(name_or_cas)
-    image_url = f"https://cactus.nci.nih.gov/chemical/structure/{encoded_name}/image"
+    image_url = _cactus_image_url(name_or_cas)
     try:
         # Pass verify=False directly to bypass SSL verification
-        resp = session.head(image_url, timeout=5, verify=False)
-        if resp.status_code == 200:
-            return None, image_url, "Cactus", name_or_cas
-        else:
-            logger.info(f"Cactus returned status {resp.status_code} for {name_or_cas}")
-            return None, None, None, None
+        resp = get_session().head(image_url, timeout=5, verify=False)
     except Exception as e:
         logger.error(f"Cactus request failed: {e}")
-        return None, None, None, None
+        raise ResolverError(f"Cactus: {e}") from e
+    if resp.status_code == 200:
+        return None, image_url, "Cactus", name_or_cas
+    if resp.status_code >= 500:
+        logger.warning(f"Cactus returned status {resp.status_code} for {name_or_cas}")
+        raise ResolverError(f"Cactus: HTTP {resp.status_code}")
+    logger.info(f"Cactus returned status {resp.status_code} for {name_or_cas}")
+    return None, None, None, None
 
+@traced("resolver.wikidata")
 def fetch_wikidata(name_or_cas):
-    search_url = "https://www.wikidata.org/w/api.php"
+    """
+    Finds the compound on Wikidata and returns its chemical structure drawing (P117) from
+    Wikimedia Commons. Entities without a structure drawing count as not found: the entity page
+    itself is not an image. Raises ResolverError if Wikidata could not be asked.
+    """
+    search_url = WIKIDATA_API_URL
     params = {
         "action": "wbsearchentities",
         "search": name_or_cas,
@@ -84,32 +266,169 @@ def fetch_wikidata(name_or_cas):
     }
     try:
         # Pass verify=False directly to bypass SSL verification
-        resp = session.get(search_url, params=params, timeout=10, verify=False)
+        resp = get_session().get(search_url, params=params, timeout=10, verify=False)
         resp.raise_for_status()
         results = resp.json().get("search", [])
-        if results:
-            entity = results[0]
-            matched_name = entity.get("label", name_or_cas)
-            wikidata_url = f"https://www.wikidata.org/wiki/{entity.get('id')}"
-            return None, wikidata_url, "Wikidata", matched_name
-        else:
+        if not results:
             logger.info("Wikidata: No search results.")
             return None, None, None, None
+        entity = results[0]
+        matched_name = entity.get("label", name_or_cas)
+
+        resp = get_session().get(
+            search_url,
+            params={"action": "wbgetentities", "ids": entity["id"], "props": "claims", "format": "json"},
+            timeout=10,
+            verify=False
+        )
+        resp.raise_for_status()
+        claims = resp.json().get("entities", {}).get(entity["id"], {}).get("claims", {})
+        structures = claims.get(WIKIDATA_STRUCTURE_IMAGE, [])
+        file_name = structures[0].get("mainsnak", {}).get("datavalue", {}).get("value") if structures else None
+        if not file_name:
+            logger.info(f"Wikidata: {entity['id']} has no chemical structure image.")
+            return None, None, None, None
+        image_url = f"{COMMONS_FILE_URL}/{quote(file_name.replace(' ', '_'))}?width=300"
+        return None, image_url, "Wikidata (Wikimedia Commons)", matched_name
     except Exception as e:
         logger.error(f"Wikidata fetch failed: {e}")
+        raise ResolverError(f"Wikidata: {e}") from e
+
+def _try_resolver(progress, step, resolver, name_or_cas, failures):
+    """
+    Runs one resolver, telling progress(step, status) that it started and whether it found the
+    compound. A resolver that fails counts as not found and its step is appended to `failures`.
+    progress may raise to abandon the lookup between resolvers.
+    """
+    if progress:
+        progress(step, "running")
+    try:
+        result = resolver(name_or_cas)
+    except ResolverError:
+        failures.append(step)
+        if progress:
+            progress(step, "failed")
+        return None, None, None, None
+    if progress:
+        progress(step, "found" if result[0] or result[1] else "not found")
+    return result
+
+@traced("chemical.lookup")
+def fetch_chemical_info(name_or_cas, progress=None):
+    """
+    Resolves a name or CAS number to (cid, image_url, source, matched_name).
+    Common compounds are answered from the offline dictionary, and other answers, including
+    "not found", are served from the persistent cache when possible.
+    progress, if given, is called with (step, status) as each resolver starts and finishes.
+    """
+    if classify_chemical_query(name_or_cas)[0] == "invalid_cas":
+        logger.info(f"Rejected '{name_or_cas}': CAS check digit does not match.")
         return None, None, None, None
 
-def fetch_chemical_info(name_or_cas):
-    cid, image_url, source, matched_name = fetch_pubchem_image(name_or_cas)
+    failures = []
+    local = _try_resolver(progress, "Local dictionary", fetch_local_dictionary, name_or_cas, failures)
+    if local[0]:
+        return local
+
+    hit, cached = get_cached_chemical(name_or_cas)
+    if hit:
+        logger.info(f"Chemical cache hit for '{name_or_cas}'.")
+        if progress:
+            progress("Cache", "found" if cached[0] or cached[1] else "not found")
+        return cached
+
+    result = _resolve_chemical_info(name_or_cas, progress, failures)
+    if result[0] or result[1] or not failures:
+        save_cached_chemical(name_or_cas, *result)
+    else:
+        # "Not found" is only cached when every resolver actually answered
+        logger.info(f"Not caching '{name_or_cas}': {', '.join(failures)} could not be reached.")
+    return result
+
+def _resolve_chemical_info(name_or_cas, progress, failures):
+    cid, image_url, source, matched_name = _try_resolver(progress, "PubChem", fetch_pubchem_image, name_or_cas, failures)
     if cid or image_url:
         return cid, image_url, source, matched_name
 
-    cid, image_url, source, matched_name = fetch_cactus_image(name_or_cas)
+    return _resolve_without_pubchem(name_or_cas, progress, failures)
+
+def _resolve_without_pubchem(name_or_cas, progress, failures):
+    """
+    Tries the resolvers after PubChem. Steps of resolvers that failed are appended to `failures`.
+    """
+    kind, _ = classify_chemical_query(name_or_cas)
+    if kind in ("invalid_cas", "cid"):
+        # Nothing else resolves a rejected CAS number or a PubChem CID
+        return None, None, None, None
+
+    cid, image_url, source, matched_name = _try_resolver(progress, "Cactus", fetch_cactus_image, name_or_cas, failures)
     if image_url:
         return cid, image_url, source, matched_name
 
-    cid, image_url, source, matched_name = fetch_wikidata(name_or_cas)
+    if kind not in ("name", "cas"):
+        # Wikidata's text search cannot match structure identifiers
+        return None, None, None, None
+
+    cid, image_url, source, matched_name = _try_resolver(progress, "Wikidata", fetch_wikidata, name_or_cas, failures)
     if image_url:
         return cid, image_url, source, matched_name
 
     return None, None, None, None
+
+def _fetch_pubchem_cid_or_fail(name_or_cas, failures):
+    try:
+        return _fetch_pubchem_cid(name_or_cas)
+    except ResolverError:
+        failures.append("PubChem")
+        return None
+
+@traced("chemical.lookup_many")
+def fetch_chemical_info_many(names, max_workers=MAX_LOOKUP_WORKERS):
+    """
+    Resolves many names or CAS numbers at once.
+    Cached answers are reused, CIDs are resolved concurrently, IUPAC names are fetched with
+    batched PubChem property requests, and misses fall back to Cactus/Wikidata concurrently.
+    Returns a dict {name: (cid, image_url, source, matched_name)} in input order (duplicates collapsed).
+    """
+    names = list(dict.fromkeys(n for n in names if n and str(n).strip()))
+    results = {}
+    pending = []
+    for name in names:
+        if classify_chemical_query(name)[0] == "invalid_cas":
+            results[name] = (None, None, None, None)
+            continue
+        local = fetch_local_dictionary(name)
+        if local[0]:
+            results[name] = local
+            continue
+        hit, cached = get_cached_chemical(name)
+        if hit:
+            results[name] = cached
+        else:
+            pending.append(name)
+
+    if pending:
+        failures = {name: [] for name in pending}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            fetch_cid = propagate(lambda name: _fetch_pubchem_cid_or_fail(name, failures[name]))
+            cids = dict(zip(pending, executor.map(fetch_cid, pending)))
+            iupac_names = _fetch_pubchem_iupac_names([cid for cid in cids.values() if cid])
+
+            misses = []
+            for name in pending:
+                result = _pubchem_result(name, cids[name], iupac_names) if cids[name] else (None, None, None, None)
+                if result[0]:
+                    results[name] = result
+                else:
+                    misses.append(name)
+
+            resolve = propagate(lambda name: _resolve_without_pubchem(name, None, failures[name]))
+            for name, result in zip(misses, executor.map(resolve, misses)):
+                results[name] = result
+
+        for name in pending:
+            # "Not found" is only cached when every resolver actually answered
+            if results[name][0] or results[name][1] or not failures[name]:
+                save_cached_chemical(name, *results[name])
+
+    return {name: results[name] for name in names}
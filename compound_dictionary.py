@@ -0,0 +1,126 @@
+# compound_dictionary.py
+import mmap
+import re
+import threading
+import logging
+
+from chemical_cache import normalize_query
+
+logger = logging.getLogger(__name__)
+
+COMPOUND_DICTIONARY_FILE = "data/compounds.tsv" # Shipped with the app, one compound per line
+
+# Minimum trigram (Dice) similarity for a "did you mean" suggestion
+SUGGESTION_MIN_SIMILARITY = 0.45
+
+_lock = threading.Lock()
+_dictionary = None # Loaded lazily: {"mmap": mmap, "exact": {key: offset}, "trigrams": {trigram: set(keys)}, "primary": set(names)}
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _load_dictionary():
+    """
+    Memory-maps the dictionary file and builds the exact-match and trigram indexes.
+    Only line offsets are kept in memory; rows are parsed from the mapping on demand.
+    """
+    global _dictionary
+    with _lock:
+        if _dictionary is not None:
+            return _dictionary
+
+        dictionary = {"mmap": None, "exact": {}, "trigrams": {}, "primary": set()}
+        try:
+            with open(COMPOUND_DICTIONARY_FILE, "rb") as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError) as e:
+            # A missing or empty file just disables the offline dictionary
+            logger.warning(f"Offline compound dictionary unavailable: {e}")
+            _dictionary = dictionary
+            return _dictionary
+
+        dictionary["mmap"] = mapped
+        offset = 0
+        for line in iter(mapped.readline, b""):
+            fields = line.decode("utf-8").rstrip("\r\n").split("\t")
+            if not line.startswith(b"#") and len(fields) == 4:
+                keys = [fields[2]] + fields[3].split(";")
+                dictionary["primary"].add(normalize_query(keys[1]))
+                for key in keys:
+                    key = normalize_query(key)
+                    if key:
+                        dictionary["exact"].setdefault(key, offset)
+                        for trigram in _trigrams(key):
+                            dictionary["trigrams"].setdefault(trigram, set()).add(key)
+            offset += len(line)
+
+        logger.info(f"Loaded {len(dictionary['exact'])} offline compound names from {COMPOUND_DICTIONARY_FILE}.")
+        _dictionary = dictionary
+        return _dictionary
+
+def _read_row(dictionary, offset):
+    mapped = dictionary["mmap"]
+    end = mapped.find(b"\n", offset)
+    line = mapped[offset:end if end != -1 else len(mapped)].decode("utf-8").rstrip("\r")
+    cid, iupac_name, cas, names = line.split("\t")
+    return {"cid": int(cid), "iupac_name": iupac_name, "cas": cas, "name": names.split(";")[0]}
+
+def lookup_compound(name_or_cas):
+    """
+    Looks up an exact (case- and whitespace-insensitive) name, synonym or CAS number.
+    Returns a dict with cid, iupac_name, cas and name, or None if the compound is not listed.
+    """
+    dictionary = _load_dictionary()
+    offset = dictionary["exact"].get(normalize_query(name_or_cas))
+    if offset is None:
+        return None
+    return _read_row(dictionary, offset)
+
+def suggest_compounds(name_or_cas, limit=3, min_similarity=SUGGESTION_MIN_SIMILARITY):
+    """
+    Suggests listed compound names that are close to a (possibly misspelled) query,
+    ranked by trigram similarity. Returns a list of display names.
+    """
+    dictionary = _load_dictionary()
+    query = normalize_query(name_or_cas)
+    if not query:
+        return []
+    query_trigrams = _trigrams(query)
+
+    candidates = set()
+    for trigram in query_trigrams:
+        candidates.update(dictionary["trigrams"].get(trigram, ()))
+
+    scored = []
+    for key in candidates:
+        key_trigrams = _trigrams(key)
+        similarity = 2 * len(query_trigrams & key_trigrams) / (len(query_trigrams) + len(key_trigrams))
+        if similarity >= min_similarity:
+            scored.append((similarity, key))
+
+    suggestions = []
+    for similarity, key in sorted(scored, key=lambda item: (-item[0], item[1])):
+        name = _read_row(dictionary, dictionary["exact"][key])["name"]
+        if name not in suggestions:
+            suggestions.append(name)
+        if len(suggestions) >= limit:
+            break
+    return suggestions
+
+def find_listed_compounds(text, max_words=3):
+    """
+    Finds the primary names of listed compounds that occur in free text (e.g. "acetic acid").
+    Synonyms are not matched here because short ones ("salt", "ether") are too ambiguous in prose.
+    Returns names in order of first appearance.
+    """
+    dictionary = _load_dictionary()
+    words = re.findall(r"[\w,\-()\[\]']+", text.lower())
+    found = []
+    for start in range(len(words)):
+        for length in range(max_words, 0, -1):
+            candidate = " ".join(words[start:start + length]).strip(",()")
+            if candidate in dictionary["primary"] and candidate not in found:
+                found.append(candidate)
+                break
+    return found
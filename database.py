@@ -2,6 +2,8 @@
 import sqlite3
 import os
 
+from tracing import traced
+
 DATABASE_FILE = "data/search_history.db" # Database file will be in a 'data' subfolder
 
 def init_db():
@@ -25,6 +27,7 @@ def init_db():
     conn.commit()
     conn.close()
 
+@traced("db.save_search_history")
 def save_search_history(topic, goal, data):
     """
     Saves a new search entry to the database.
@@ -38,6 +41,7 @@ def save_search_history(topic, goal, data):
     conn.commit()
     conn.close()
 
+@traced("db.load_search_history")
 def load_search_history():
     """
     Loads all search history entries from the database, ordered by timestamp descending.
@@ -60,6 +64,7 @@ def load_search_history():
         })
     return history
 
+@traced("db.delete_search_history_entry")
 def delete_search_history_entry(entry_id):
     """
     Deletes a specific search history entry by its ID.
@@ -70,6 +75,7 @@ def delete_search_history_entry(entry_id):
     conn.commit()
     conn.close()
 
+@traced("db.clear_all_search_history")
 def clear_all_search_history():
     """
     Deletes all entries from the search_history table.
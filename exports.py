@@ -0,0 +1,128 @@
+# exports.py
+"""
+Download formats for the literature summary and the final proposal.
+
+Export bytes are generated only when a download is requested and are cached by a hash of
+their content, so reruns with unchanged text reuse them instead of rebuilding the document.
+"""
+import io
+import hashlib
+import textwrap
+import threading
+from collections import OrderedDict
+
+EXPORT_FORMATS = {
+    # format: (label, file extension, MIME type)
+    "docx": ("DOCX", "docx", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    "md": ("Markdown", "md", "text/markdown"),
+    "pdf": ("PDF", "pdf", "application/pdf"),
+}
+
+EXPORT_CACHE_SIZE = 32 # Most recently requested exports kept in memory
+
+_cache_lock = threading.Lock()
+_export_cache = OrderedDict() # content hash -> bytes, least recently used first
+
+
+def render_docx(title, body):
+    from docx import Document # python-docx is only loaded when a DOCX is actually requested
+
+    doc = Document()
+    doc.add_heading(title, level=1)
+    for paragraph_text in body.split('\n'):
+        doc.add_paragraph(paragraph_text)
+    bio = io.BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+
+def render_markdown(title, body):
+    return f"# {title}\n\n{body}\n".encode("utf-8")
+
+
+# Plain PDF output with the standard Helvetica fonts, so no PDF library is needed
+_PAGE_WIDTH, _PAGE_HEIGHT, _MARGIN = 612, 792, 72 # US Letter, 1 inch margins
+_FONT_SIZE, _LEADING, _TITLE_SIZE = 11, 14, 16
+_CHARS_PER_LINE = 85 # Average Helvetica glyph width at 11pt across the text width
+
+def _pdf_text(text):
+    # The standard fonts only cover Latin-1; anything else is replaced
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return escaped.encode("latin-1", "replace")
+
+def _pdf_lines(body):
+    for paragraph_text in body.split('\n'):
+        yield from textwrap.wrap(paragraph_text, _CHARS_PER_LINE) or [""]
+
+def render_pdf(title, body):
+    """
+    Writes a simple multi-page PDF. Pages are emitted one at a time as the text is laid out.
+    """
+    out = io.BytesIO()
+    offsets = {}
+
+    def write_object(number, content):
+        offsets[number] = out.tell()
+        out.write(b"%d 0 obj\n" % number + content + b"\nendobj\n")
+
+    out.write(b"%PDF-1.4\n")
+    write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    write_object(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    write_object(4, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>")
+
+    page_numbers = []
+    lines_per_page = (_PAGE_HEIGHT - 2 * _MARGIN) // _LEADING
+    lines = list(_pdf_lines(body))
+    first_page_lines = lines_per_page - 2 # The title takes two lines on the first page
+    chunks = [lines[:first_page_lines]] + [
+        lines[i:i + lines_per_page] for i in range(first_page_lines, len(lines), lines_per_page)
+    ]
+    next_number = 5
+    for page_index, chunk in enumerate(chunks):
+        stream = [b"BT", b"%d TL" % _LEADING, b"%d %d Td" % (_MARGIN, _PAGE_HEIGHT - _MARGIN)]
+        if page_index == 0:
+            stream += [b"/F2 %d Tf" % _TITLE_SIZE, b"(" + _pdf_text(title) + b") Tj T* T*"]
+        stream.append(b"/F1 %d Tf" % _FONT_SIZE)
+        stream += [b"(" + _pdf_text(line) + b") Tj T*" for line in chunk]
+        stream.append(b"ET")
+        content = b"\n".join(stream)
+
+        write_object(next_number, b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        write_object(next_number + 1, (
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+            b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+        ) % (_PAGE_WIDTH, _PAGE_HEIGHT, next_number))
+        page_numbers.append(next_number + 1)
+        next_number += 2
+
+    kids = b" ".join(b"%d 0 R" % number for number in page_numbers)
+    write_object(2, b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % len(page_numbers))
+
+    xref_offset = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % next_number)
+    for number in range(1, next_number):
+        out.write(b"%010d 00000 n \n" % offsets[number])
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (next_number, xref_offset))
+    return out.getvalue()
+
+
+_RENDERERS = {"docx": render_docx, "md": render_markdown, "pdf": render_pdf}
+
+def export_document(export_format, title, body):
+    """
+    Returns the bytes of a document in one of EXPORT_FORMATS, reusing a cached copy when the
+    same title and body were exported before.
+    """
+    content_hash = hashlib.sha256(f"{export_format}\0{title}\0{body}".encode("utf-8")).hexdigest()
+    with _cache_lock:
+        if content_hash in _export_cache:
+            _export_cache.move_to_end(content_hash)
+            return _export_cache[content_hash]
+
+    data = _RENDERERS[export_format](title, body)
+
+    with _cache_lock:
+        _export_cache[content_hash] = data
+        while len(_export_cache) > EXPORT_CACHE_SIZE:
+            _export_cache.popitem(last=False)
+    return data
@@ -1,59 +1,155 @@
 # gemini_api.py
-import requests
+import os
 import json
-import streamlit as st # Used for st.error in query_model, but could be passed as a logger
+import logging
 
-# IMPORTANT: If you are running this code locally, you MUST replace "YOUR_GEMINI_API_KEY"
-# with your actual Google Cloud API Key.
+from reporting import report_error
+from prompts import estimate_tokens
+from tracing import traced, annotate
+from gemini_scheduler import acquire_model_call, settle_model_call, report_throttled
+
+logger = logging.getLogger(__name__)
+
+# IMPORTANT: If you are running this code locally, set the GEMINI_API_KEY environment variable
+# (or replace the default below with your actual Google Cloud API Key).
 # If running within a Canvas-like environment that injects the key, leave it as an empty string.
 # DO NOT COMMIT YOUR API KEY TO PUBLIC REPOSITORIES!
-API_KEY =  # Replace with your actual key if running locally
+API_KEY = os.environ.get("GEMINI_API_KEY", "") # Replace with your actual key if running locally
 
 # Gemini API endpoint for gemini-2.0-flash
 API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent"
 
+MAX_OUTPUT_TOKENS = 1000 # Increased token limit for more detailed responses
+
+# A long system instruction can be uploaded once to Gemini's context cache and referred to by name.
+# Gemini doesn't cache shorter content, so shorter instructions are just sent with each request.
+CONTEXT_CACHE_MIN_TOKENS = 4096
+CONTEXT_CACHE_TTL_SECONDS = 3600
+# Returned instead of the answer when Gemini no longer has the cached context a request refers to
+CONTEXT_CACHE_MISSING_ERROR = "⚠️ Error: The cached context has expired or is no longer available."
+
 def query_model(prompt):
     """
     Queries the Gemini API with the given prompt and returns the generated text.
     """
-    # Check if API_KEY is provided
-    if not API_KEY:
-        # In a real application, you might raise an exception or log this more robustly
-        st.error("⚠️ Error: API Key is missing. Please provide your Gemini API Key.")
-        return "⚠️ Error: API Key is missing. Please provide your Gemini API Key."
+    return query_model_candidates(prompt, candidate_count=1)[0]
 
+def query_model_candidates(prompt, candidate_count=1):
+    """
+    Queries the Gemini API for several independent candidates of the same prompt in one request.
+    Returns a list of generated texts; on failure the list holds a single error message.
+    """
     chat_history = []
     chat_history.append({ "role": "user", "parts": [{ "text": prompt }] })
+    return _generate(chat_history, candidate_count=candidate_count)
+
+def query_model_chat(contents, system_instruction=None, cached_context=None):
+    """
+    Continues a multi-turn conversation. `contents` is the history in Gemini's format
+    ([{"role": "user" | "model", "parts": [{"text": ...}]}, ...]) ending with the new user turn.
+    `cached_context` is a name from create_context_cache(), used instead of `system_instruction`.
+    Returns the generated text, or an error message string.
+    """
+    return _generate(contents, system_instruction=system_instruction, cached_context=cached_context)[0]
+
+@traced("gemini.create_context_cache")
+def create_context_cache(system_instruction, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS):
+    """
+    Uploads a system instruction to Gemini's context cache for `ttl_seconds`. Returns the cache
+    name to pass to query_model_chat(), or None if the instruction is too short to cache or the
+    upload failed; the caller then sends the instruction itself.
+    """
+    import requests # Deferred so importing this module stays cheap on app start
+
+    tokens = estimate_tokens(system_instruction)
+    if not API_KEY or tokens < CONTEXT_CACHE_MIN_TOKENS:
+        return None
+    base_url, model = API_URL.split("/models/")
+    payload = {
+        "model": f"models/{model.split(':')[0]}",
+        "systemInstruction": { "parts": [{ "text": system_instruction }] },
+        "ttl": f"{ttl_seconds}s",
+    }
+    annotate(prompt_tokens=tokens)
+    if acquire_model_call(tokens) is None:
+        return None
+    try:
+        response = requests.post(f"{base_url}/cachedContents?key={API_KEY}", headers={"Content-Type": "application/json"}, json=payload, timeout=30)
+        annotate(status=response.status_code)
+        response.raise_for_status()
+        return response.json()["name"]
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logger.warning(f"Could not cache the system instruction; sending it with each request instead: {e}")
+        return None
+    finally:
+        settle_model_call(tokens, tokens)
+
+@traced("gemini.generate")
+def _generate(contents, candidate_count=1, system_instruction=None, cached_context=None):
+    import requests # Deferred so importing this module stays cheap on app start
+
+    # Check if API_KEY is provided
+    if not API_KEY:
+        # In a real application, you might raise an exception or log this more robustly
+        report_error("⚠️ Error: API Key is missing. Please provide your Gemini API Key.")
+        return ["⚠️ Error: API Key is missing. Please provide your Gemini API Key."]
 
     payload = {
-        "contents": chat_history,
+        "contents": contents,
         "generationConfig": {
             "temperature": 0.7,
-            "maxOutputTokens": 1000 # Increased token limit for more detailed responses
+            "maxOutputTokens": MAX_OUTPUT_TOKENS
         }
     }
+    if candidate_count > 1:
+        payload["generationConfig"]["candidateCount"] = candidate_count
+    if cached_context:
+        payload["cachedContent"] = cached_context # Stands in for the system instruction, which isn't resent
+        system_instruction = None
+    elif system_instruction:
+        payload["systemInstruction"] = { "parts": [{ "text": system_instruction }] }
 
     # Construct the full API URL with the API key
     full_api_url = f"{API_URL}?key={API_KEY}"
+    prompt_text = (system_instruction or "") + "".join(part["text"] for turn in contents for part in turn["parts"])
+    prompt_tokens = estimate_tokens(prompt_text)
+    annotate(prompt_tokens=prompt_tokens, turns=len(contents), candidate_count=candidate_count)
+
+    # Wait for this process's share of the quota; the reservation is corrected once the response is in
+    reserved_tokens = prompt_tokens + MAX_OUTPUT_TOKENS * candidate_count
+    if acquire_model_call(reserved_tokens) is None:
+        return ["⚠️ Error: Too many requests are waiting for the Gemini API right now. Please try again in a minute."]
+    used_tokens = prompt_tokens
 
     try:
         response = requests.post(full_api_url, headers={"Content-Type": "application/json"}, json=payload)
+        annotate(status=response.status_code)
+        if response.status_code == 429:
+            report_throttled()
+        elif cached_context and response.status_code in (400, 403, 404) and "cachedcontent" in response.text.lower():
+            return [CONTEXT_CACHE_MISSING_ERROR] # e.g. "CachedContent not found (or permission denied)"
         response.raise_for_status()  # Raises an HTTPError for bad responses (4xx or 5xx)
 
         result = response.json()
 
-        if result.get("candidates") and len(result["candidates"]) > 0 and \
-           result["candidates"][0].get("content") and \
-           result["candidates"][0]["content"].get("parts") and \
-           len(result["candidates"][0]["content"]["parts"]) > 0:
-            generated_text = result["candidates"][0]["content"]["parts"][0]["text"]
-            return generated_text
+        generated_texts = [
+            candidate["content"]["parts"][0]["text"]
+            for candidate in result.get("candidates") or []
+            if candidate.get("content") and candidate["content"].get("parts")
+        ]
+        if generated_texts:
+            response_tokens = estimate_tokens("".join(generated_texts))
+            used_tokens += response_tokens
+            annotate(response_tokens=response_tokens)
+            return generated_texts
         else:
-            return f"⚠️ Error: API response successful but no generated text found. Response: {result}"
+            return [f"⚠️ Error: API response successful but no generated text found. Response: {result}"]
 
     except requests.exceptions.RequestException as e:
-        return f"⚠️ API Request Error: {e}. Please check your API key and network connection."
+        return [f"⚠️ API Request Error: {e}. Please check your API key and network connection."]
     except json.JSONDecodeError:
-        return "⚠️ Error: Could not decode JSON response from API. Invalid response format."
+        return ["⚠️ Error: Could not decode JSON response from API. Invalid response format."]
     except Exception as e:
-        return f"⚠️ An unexpected error occurred: {e}"
+        return [f"⚠️ An unexpected error occurred: {e}"]
+    finally:
+        settle_model_call(reserved_tokens, used_tokens)
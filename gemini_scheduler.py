@@ -0,0 +1,254 @@
+# gemini_scheduler.py
+"""
+Process-wide admission control for Gemini calls.
+
+Every model call in this process waits here for its turn before the request is sent:
+
+- Two token buckets keep the process under its per-minute quota, one counting requests and
+  one counting tokens (the prompt estimate plus the most the response may use).
+- Waiting calls are admitted by priority: interactive calls a user is waiting on first, then
+  background work started ahead of the user (speculative summaries), then batch runs.
+- Within a priority, sessions take turns, so one session's burst of refinements queues behind
+  its own earlier calls instead of in front of everyone else's.
+
+The priority of a call comes from the context it runs in (see request_priority()), and its
+session from the trace session, both of which follow work handed to thread pools via
+tracing.propagate().
+"""
+import contextvars
+import itertools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from tracing import get_trace_session, annotate
+
+logger = logging.getLogger(__name__)
+
+# Quota of the API key; set them a little below what the project is allowed
+REQUESTS_PER_MINUTE = int(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "60"))
+TOKENS_PER_MINUTE = int(os.environ.get("GEMINI_TOKENS_PER_MINUTE", "1000000"))
+
+# A call that cannot be admitted within this time fails instead of waiting forever
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_QUEUE_TIMEOUT_SECONDS", "300"))
+
+MAX_REMEMBERED_SESSIONS = 1000 # Sessions whose last admission is remembered for taking turns
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background", PRIORITY_BATCH: "batch"}
+
+_request_class = contextvars.ContextVar("model_request_class", default=None)
+
+
+@contextmanager
+def request_priority(priority):
+    """
+    Model calls made inside the block (and in work it hands to propagate()-wrapped callables)
+    are queued with this priority. Yields the request class, which raise_priority() can promote
+    later, e.g. when the user starts waiting on a speculative job.
+    """
+    request_class = {"priority": priority}
+    token = _request_class.set(request_class)
+    try:
+        yield request_class
+    finally:
+        _request_class.reset(token)
+
+
+class TokenBucket:
+    """
+    Holds up to `capacity` units and refills at capacity per minute.
+    Not thread-safe on its own; the scheduler calls it under its lock.
+    """
+    def __init__(self, per_minute, clock=time.monotonic):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.available = self.capacity
+        self._updated = clock()
+
+    def refill(self, now):
+        self.available = min(self.capacity, self.available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def seconds_until(self, amount):
+        missing = amount - self.available
+        return max(0.0, missing / self.rate) if self.rate else float("inf")
+
+
+class ModelCallScheduler:
+    def __init__(self, requests_per_minute, tokens_per_minute, clock=time.monotonic):
+        self._clock = clock # Replaced in tests; waits still block on the condition in real time
+        self._condition = threading.Condition()
+        self._request_bucket = TokenBucket(requests_per_minute, clock)
+        self._token_bucket = TokenBucket(tokens_per_minute, clock)
+        self._sequence = itertools.count()
+        self._waiting = [] # Waiting calls, in arrival order
+        self._last_admitted = {} # session -> sequence number of its last admission
+        self._admission_count = itertools.count(1)
+        self._stats = {
+            "admitted": {name: 0 for name in PRIORITY_NAMES.values()},
+            "timed_out": 0,
+            "throttled": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def _next_waiter(self):
+        """
+        Highest priority first; among those, the session admitted least recently; then arrival order.
+        """
+        return min(
+            self._waiting,
+            key=lambda waiter: (
+                waiter["request_class"]["priority"],
+                self._last_admitted.get(waiter["session"], 0),
+                waiter["sequence"],
+            ),
+            default=None
+        )
+
+    def acquire(self, tokens, timeout=None):
+        """
+        Waits until this call may be sent. Returns the seconds spent waiting, or None if the
+        call could not be admitted within the timeout.
+        """
+        request_class = _request_class.get() or {"priority": PRIORITY_INTERACTIVE}
+        started = self._clock()
+        waiter = {
+            "sequence": next(self._sequence),
+            "started": started,
+            "session": get_trace_session(),
+            "request_class": request_class,
+            "tokens": min(tokens, self._token_bucket.capacity), # A huge prompt must not wait forever
+        }
+        deadline = started + (QUEUE_TIMEOUT_SECONDS if timeout is None else timeout)
+
+        with self._condition:
+            self._waiting.append(waiter)
+            try:
+                while True:
+                    now = self._clock()
+                    self._request_bucket.refill(now)
+                    self._token_bucket.refill(now)
+                    if self._next_waiter() is waiter:
+                        delay = max(self._request_bucket.seconds_until(1),
+                                    self._token_bucket.seconds_until(waiter["tokens"]))
+                        if delay == 0:
+                            self._admit(waiter, now - started)
+                            return now - started
+                    else:
+                        delay = None # Woken when the calls ahead are admitted or reprioritized
+                    if now >= deadline:
+                        self._stats["timed_out"] += 1
+                        return None
+                    self._condition.wait(min(delay, deadline - now) if delay is not None else deadline - now)
+            finally:
+                if waiter in self._waiting:
+                    self._waiting.remove(waiter)
+                self._condition.notify_all() # The next waiter may be admissible now
+
+    def _admit(self, waiter, waited):
+        self._request_bucket.available -= 1
+        self._token_bucket.available -= waiter["tokens"]
+        self._last_admitted[waiter["session"]] = next(self._admission_count)
+        if len(self._last_admitted) > MAX_REMEMBERED_SESSIONS:
+            # Sessions with nothing queued lose their place; they simply count as not admitted lately
+            waiting_sessions = {other["session"] for other in self._waiting}
+            self._last_admitted = {
+                session: order for session, order in self._last_admitted.items() if session in waiting_sessions
+            }
+        self._stats["admitted"][PRIORITY_NAMES[waiter["request_class"]["priority"]]] += 1
+        self._stats["total_wait_seconds"] += waited
+        self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+
+    def settle(self, reserved_tokens, used_tokens):
+        """
+        Returns tokens reserved for a call but not used (the response was shorter than the
+        maximum), or charges the difference if it used more.
+        """
+        with self._condition:
+            reserved_tokens = min(reserved_tokens, self._token_bucket.capacity)
+            self._token_bucket.available = min(
+                self._token_bucket.capacity, self._token_bucket.available + reserved_tokens - used_tokens
+            )
+            self._condition.notify_all()
+
+    def throttled(self):
+        """
+        Called when Gemini answers 429: empties both buckets so waiting calls back off until
+        they refill.
+        """
+        with self._condition:
+            self._stats["throttled"] += 1
+            self._request_bucket.available = min(self._request_bucket.available, 0)
+            self._token_bucket.available = min(self._token_bucket.available, 0)
+        logger.warning("Gemini rate limit hit; holding queued calls until the quota refills.")
+
+    def raise_priority(self, request_class, priority=PRIORITY_INTERACTIVE):
+        with self._condition:
+            request_class["priority"] = min(request_class["priority"], priority)
+            self._condition.notify_all()
+
+    def metrics(self):
+        """
+        Returns queue depth and admission statistics as a dict.
+        """
+        with self._condition:
+            now = self._clock()
+            self._request_bucket.refill(now)
+            self._token_bucket.refill(now)
+            queued = {name: 0 for name in PRIORITY_NAMES.values()}
+            for waiter in self._waiting:
+                queued[PRIORITY_NAMES[waiter["request_class"]["priority"]]] += 1
+            admitted_total = sum(self._stats["admitted"].values())
+            return {
+                "queued": len(self._waiting),
+                "queued_by_priority": queued,
+                "queued_sessions": len({waiter["session"] for waiter in self._waiting}),
+                "oldest_wait_seconds": round(max((now - waiter["started"] for waiter in self._waiting), default=0.0), 2),
+                "admitted": dict(self._stats["admitted"]),
+                "timed_out": self._stats["timed_out"],
+                "throttled": self._stats["throttled"],
+                "mean_wait_seconds": round(self._stats["total_wait_seconds"] / admitted_total, 3) if admitted_total else 0.0,
+                "max_wait_seconds": round(self._stats["max_wait_seconds"], 3),
+                "requests_available": round(self._request_bucket.available, 2),
+                "tokens_available": int(self._token_bucket.available),
+            }
+
+
+_scheduler = ModelCallScheduler(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+
+
+def acquire_model_call(tokens):
+    """
+    Waits for admission of one Gemini call reserving `tokens`. Returns the seconds waited, or
+    None if the call timed out in the queue.
+    """
+    request_class = _request_class.get()
+    annotate(priority=PRIORITY_NAMES[request_class["priority"] if request_class else PRIORITY_INTERACTIVE])
+    waited = _scheduler.acquire(tokens)
+    annotate(queue_wait_ms=round(waited * 1000, 1) if waited is not None else "timed out")
+    return waited
+
+
+def settle_model_call(reserved_tokens, used_tokens):
+    _scheduler.settle(reserved_tokens, used_tokens)
+
+
+def report_throttled():
+    _scheduler.throttled()
+
+
+def raise_priority(request_class, priority=PRIORITY_INTERACTIVE):
+    """
+    Promotes calls of a request class (from request_priority()) that are queued or still to come.
+    """
+    _scheduler.raise_priority(request_class, priority)
+
+
+def get_scheduler_metrics():
+    return _scheduler.metrics()
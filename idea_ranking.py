@@ -0,0 +1,57 @@
+# idea_ranking.py
+import re
+import numpy as np
+
+# Ideas whose TF-IDF cosine similarity exceeds this are treated as the same idea
+DUPLICATE_SIMILARITY_THRESHOLD = 0.6
+
+_STOPWORDS = {
+    "the", "and", "for", "with", "from", "that", "this", "into", "using", "use", "their", "its",
+    "are", "can", "will", "such", "via", "based", "which", "these", "those", "than", "then",
+    "also", "new", "novel", "develop", "developing", "investigate", "study", "explore", "research",
+}
+
+def _tokenize(text):
+    # Crude plural folding ("catalysts" -> "catalyst") is enough to match reworded ideas
+    words = (word[:-1] if len(word) > 4 and word.endswith("s") and not word.endswith("ss") else word
+             for word in re.findall(r"[a-z0-9]{3,}", text.lower()))
+    return [word for word in words if word not in _STOPWORDS]
+
+def _tfidf_matrix(documents):
+    """
+    Builds an L2-normalised TF-IDF matrix (one row per document) with NumPy.
+    """
+    tokenized = [_tokenize(doc) for doc in documents]
+    vocabulary = {word: i for i, word in enumerate(sorted({w for tokens in tokenized for w in tokens}))}
+    counts = np.zeros((len(documents), max(len(vocabulary), 1)))
+    for row, tokens in enumerate(tokenized):
+        for word in tokens:
+            counts[row, vocabulary[word]] += 1
+
+    document_frequency = np.count_nonzero(counts, axis=0)
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+    tfidf = counts * idf
+    norms = np.linalg.norm(tfidf, axis=1, keepdims=True)
+    return tfidf / np.where(norms == 0, 1, norms)
+
+def rank_ideas(ideas, topic, goal, top_n=None, duplicate_threshold=DUPLICATE_SIMILARITY_THRESHOLD):
+    """
+    Collapses near-duplicate ideas and orders the rest by relevance to the topic and goal.
+    Relevance is the cosine similarity between each idea and the topic + goal text; when two
+    ideas are near duplicates, the more relevant one is kept. Returns at most top_n ideas.
+    """
+    ideas = [idea.strip() for idea in ideas if idea and idea.strip()]
+    if not ideas:
+        return []
+
+    matrix = _tfidf_matrix(ideas + [f"{topic} {goal}"])
+    idea_vectors, query_vector = matrix[:-1], matrix[-1]
+    relevance = idea_vectors @ query_vector
+    similarity = idea_vectors @ idea_vectors.T
+
+    kept = []
+    for index in np.argsort(-relevance, kind="stable"):
+        if all(similarity[index, other] < duplicate_threshold for other in kept):
+            kept.append(index)
+    ranked = [ideas[index] for index in kept]
+    return ranked[:top_n] if top_n else ranked
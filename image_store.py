@@ -0,0 +1,162 @@
+# image_store.py
+import sqlite3
+import os
+import time
+import hashlib
+import logging
+import tempfile
+
+from chemical_lookup import get_session
+from tracing import traced, annotate
+
+logger = logging.getLogger(__name__)
+
+IMAGE_STORE_DIR = "data/images" # Image files are named by the SHA-256 of their bytes
+IMAGE_INDEX_FILE = "data/image_store.db" # Maps source URLs to stored images and validators
+
+# Within this window a stored image is served without contacting the origin at all;
+# after it, the origin is asked with If-None-Match / If-Modified-Since.
+IMAGE_REVALIDATE_SECONDS = 24 * 3600
+
+_store_initialized = False
+
+def init_image_store():
+    """
+    Creates the image directory and the URL index table if they don't exist.
+    """
+    global _store_initialized
+    os.makedirs(IMAGE_STORE_DIR, exist_ok=True)
+
+    conn = sqlite3.connect(IMAGE_INDEX_FILE, timeout=10)
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS structure_images (
+            url TEXT PRIMARY KEY,
+            content_hash TEXT NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            checked_at REAL NOT NULL
+        )
+    """)
+    conn.commit()
+    conn.close()
+    _store_initialized = True
+
+def _connect():
+    if not _store_initialized:
+        init_image_store()
+    return sqlite3.connect(IMAGE_INDEX_FILE, timeout=10)
+
+def _image_path(content_hash):
+    return os.path.join(IMAGE_STORE_DIR, f"{content_hash}.png")
+
+# Leading bytes of the formats the structure services serve (PNG, GIF, JPEG, WebP)
+_IMAGE_SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a", b"\xff\xd8\xff")
+
+def is_image_bytes(data):
+    """
+    True if the bytes start like an image Streamlit can display.
+    """
+    if not data:
+        return False
+    return data.startswith(_IMAGE_SIGNATURES) or (data[:4] == b"RIFF" and data[8:12] == b"WEBP")
+
+def get_stored_image(content_hash):
+    """
+    Returns the bytes stored under a content hash, or None if they are missing or not an image
+    (stored before responses were checked).
+    """
+    try:
+        with open(_image_path(content_hash), "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    return data if is_image_bytes(data) else None
+
+def is_image_response(response):
+    """
+    True if an HTTP response carries an image. Servers answer unknown structures with HTML
+    error or search pages, which must not be stored or displayed as images.
+    """
+    return response.headers.get("Content-Type", "").split(";")[0].strip().lower().startswith("image/")
+
+def _store_image_bytes(image_bytes):
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    path = _image_path(content_hash)
+    if not os.path.exists(path):
+        # Write to a temporary file of its own first, so readers never see a partial file and
+        # threads storing the same image at once don't write into each other's
+        with tempfile.NamedTemporaryFile(dir=IMAGE_STORE_DIR, suffix=".tmp", delete=False) as f:
+            f.write(image_bytes)
+        os.replace(f.name, path)
+    return content_hash
+
+@traced("image_store.fetch")
+def fetch_structure_image(image_url):
+    """
+    Returns the image bytes for a structure URL, downloading them at most once.
+    Stored images are revalidated with the origin's ETag / Last-Modified validators after
+    IMAGE_REVALIDATE_SECONDS, and are still served if the origin cannot be reached.
+    Returns None if the image is neither stored nor downloadable.
+    """
+    try:
+        conn = _connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT content_hash, etag, last_modified, checked_at FROM structure_images WHERE url = ?",
+            (image_url,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Image store index unavailable: {e}")
+        row = None
+
+    stored_bytes = get_stored_image(row[0]) if row else None
+    if stored_bytes is not None and time.time() - row[3] < IMAGE_REVALIDATE_SECONDS:
+        annotate(outcome="stored")
+        return stored_bytes
+
+    headers = {}
+    if stored_bytes is not None:
+        if row[1]:
+            headers["If-None-Match"] = row[1]
+        if row[2]:
+            headers["If-Modified-Since"] = row[2]
+
+    try:
+        # Pass verify=False directly to bypass SSL verification, like the resolvers do
+        response = get_session().get(image_url, headers=headers, timeout=10, verify=False)
+        annotate(status=response.status_code)
+        if response.status_code == 304 and stored_bytes is not None:
+            content_hash, etag, last_modified = row[0], row[1], row[2]
+            image_bytes = stored_bytes
+            annotate(outcome="revalidated")
+        else:
+            response.raise_for_status()
+            if not is_image_response(response) or not is_image_bytes(response.content):
+                raise ValueError(f"not an image (Content-Type: {response.headers.get('Content-Type')})")
+            image_bytes = response.content
+            annotate(outcome="downloaded", bytes=len(image_bytes))
+            content_hash = _store_image_bytes(image_bytes)
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+    except Exception as e:
+        if stored_bytes is not None:
+            logger.info(f"Serving stored image for {image_url}; revalidation failed: {e}")
+            return stored_bytes
+        logger.warning(f"Could not download chemical image from {image_url}: {e}")
+        return None
+
+    try:
+        conn = _connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO structure_images (url, content_hash, etag, last_modified, checked_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (image_url, content_hash, etag, last_modified, time.time())
+        )
+        conn.commit()
+        conn.close()
+    except (sqlite3.Error, OSError) as e:
+        logger.warning(f"Image store index write failed: {e}")
+    return image_bytes
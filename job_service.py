@@ -0,0 +1,336 @@
+# job_service.py
+"""
+Local job service for long-running generations.
+
+Run it next to the app:
+    python job_service.py --port 8765 --workers 4
+
+and point the app at it with JOB_SERVICE_URL=http://127.0.0.1:8765. Jobs are queued in
+SQLite (data/jobs.db), executed by a worker pool and survive app reruns and browser refreshes.
+
+HTTP API (JSON):
+    POST /jobs                {"kind": ..., "params": {...}}  -> 202 {"id": ..., "status": "queued"}
+    GET  /jobs/<id>                                           -> job status, result or error
+    POST /jobs/<id>/cancel                                    -> job status after cancellation
+    GET  /health                                              -> {"status": "ok", "queued": n, "running": n, "model_queue": {...}}
+"""
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from tracing import span
+from gemini_scheduler import get_scheduler_metrics
+
+logger = logging.getLogger("job_service")
+
+JOBS_DATABASE_FILE = "data/jobs.db"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 4
+WORKER_POLL_SECONDS = 0.5 # How often idle workers look for queued jobs
+
+# Where the app finds the service; unset means the app runs generations inline
+JOB_SERVICE_URL = os.environ.get("JOB_SERVICE_URL", "")
+
+
+def _run_research_ideas(params):
+    from workflow import generate_research_ideas_from_ai
+    return generate_research_ideas_from_ai(
+        params["topic"], params["goal"], params["data"], uploaded_text_context=params.get("uploaded_text", "")
+    )
+
+def _run_literature_summary(params):
+    from workflow import generate_literature_summary_from_ai
+    return generate_literature_summary_from_ai(params["approved_idea"], uploaded_text_context=params.get("uploaded_text", ""))
+
+def _run_final_response(params):
+    from workflow import compile_final_response_from_ai
+    return compile_final_response_from_ai(params["approved_idea"], params["literature_summary"], params["properties"])
+
+# Job kinds the service accepts, mapped to functions taking the job's params dict
+JOB_KINDS = {
+    'research_ideas': _run_research_ideas,
+    'literature_summary': _run_literature_summary,
+    'final_response': _run_final_response,
+}
+
+
+# --- Queue (SQLite) ---
+
+def _connect():
+    return sqlite3.connect(JOBS_DATABASE_FILE, timeout=30)
+
+def init_job_db():
+    """
+    Creates the jobs table and re-queues jobs left running by a previous crash.
+    """
+    os.makedirs(os.path.dirname(JOBS_DATABASE_FILE), exist_ok=True)
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            error TEXT,
+            cancel_requested INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+    cursor.execute("UPDATE jobs SET status = 'queued', updated_at = ? WHERE status = 'running'", (time.time(),))
+    conn.commit()
+    conn.close()
+
+def submit_job(kind, params):
+    """
+    Queues a job. Returns its id. Raises ValueError for unknown kinds.
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind '{kind}'")
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    conn = _connect()
+    conn.execute(
+        "INSERT INTO jobs (id, kind, params, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+        (job_id, kind, json.dumps(params), now, now)
+    )
+    conn.commit()
+    conn.close()
+    return job_id
+
+def get_job(job_id):
+    """
+    Returns a job as a dict (id, kind, status, result, error, created_at, updated_at), or None.
+    """
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+        (job_id,)
+    )
+    row = cursor.fetchone()
+    conn.close()
+    if row is None:
+        return None
+    return {
+        "id": row[0],
+        "kind": row[1],
+        "status": row[2],
+        "result": json.loads(row[3]) if row[3] is not None else None,
+        "error": row[4],
+        "created_at": row[5],
+        "updated_at": row[6],
+    }
+
+def cancel_job(job_id):
+    """
+    Cancels a queued job immediately; a running job is marked and its result discarded when
+    the model call returns. Returns the updated job, or None if it doesn't exist.
+    """
+    conn = _connect()
+    now = time.time()
+    conn.execute("UPDATE jobs SET status = 'cancelled', updated_at = ? WHERE id = ? AND status = 'queued'", (now, job_id))
+    conn.execute("UPDATE jobs SET cancel_requested = 1, updated_at = ? WHERE id = ? AND status = 'running'", (now, job_id))
+    conn.commit()
+    conn.close()
+    return get_job(job_id)
+
+def count_jobs_by_status():
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+    counts = dict(cursor.fetchall())
+    conn.close()
+    return counts
+
+def _claim_next_job():
+    conn = _connect()
+    try:
+        # BEGIN IMMEDIATE takes the write lock up front so two workers never claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, kind, params FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1")
+        row = cursor.fetchone()
+        if row:
+            cursor.execute("UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), row[0]))
+        conn.commit()
+        return row
+    finally:
+        conn.close()
+
+def _finish_job(job_id, result=None, error=None):
+    conn = _connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,))
+    cancelled = cursor.fetchone()[0]
+    if cancelled:
+        status, result, error = "cancelled", None, None
+    else:
+        status = "failed" if error else "done"
+    cursor.execute(
+        "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+        (status, json.dumps(result) if result is not None else None, error, time.time(), job_id)
+    )
+    conn.commit()
+    conn.close()
+
+
+# --- Workers ---
+
+def _worker_loop(stop_event):
+    while not stop_event.is_set():
+        try:
+            claimed = _claim_next_job()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not claim a job: {e}")
+            claimed = None
+        if not claimed:
+            stop_event.wait(WORKER_POLL_SECONDS)
+            continue
+
+        job_id, kind, params = claimed
+        logger.info(f"Running {kind} job {job_id}")
+        try:
+            from workflow import is_stage_error
+            with span(f"job.{kind}", job_id=job_id):
+                result = JOB_KINDS[kind](json.loads(params))
+            if is_stage_error(result):
+                # The workflow reports failed model calls in its return value instead of raising
+                error = result if isinstance(result, str) else "the model returned no usable output"
+                logger.warning(f"Job {job_id} failed: {error}")
+                _finish_job(job_id, error=error)
+            else:
+                _finish_job(job_id, result=result)
+        except Exception as e:
+            logger.exception(f"Job {job_id} failed")
+            _finish_job(job_id, error=str(e))
+
+def start_workers(count=DEFAULT_WORKERS):
+    """
+    Starts worker threads that execute queued jobs. Returns an Event that stops them when set.
+    """
+    stop_event = threading.Event()
+    for i in range(count):
+        threading.Thread(target=_worker_loop, args=(stop_event,), name=f"job-worker-{i}", daemon=True).start()
+    return stop_event
+
+
+# --- HTTP API ---
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path_parts(self):
+        return [part for part in self.path.split("?")[0].split("/") if part]
+
+    def do_GET(self):
+        parts = self._path_parts()
+        if parts == ["health"]:
+            counts = count_jobs_by_status()
+            self._send_json(200, {
+                "status": "ok",
+                "queued": counts.get("queued", 0),
+                "running": counts.get("running", 0),
+                "model_queue": get_scheduler_metrics(), # Gemini admission queue of this service's workers
+            })
+        elif len(parts) == 2 and parts[0] == "jobs":
+            job = get_job(parts[1])
+            if job:
+                self._send_json(200, job)
+            else:
+                self._send_json(404, {"error": "job not found"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        parts = self._path_parts()
+        if parts == ["jobs"]:
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                job_id = submit_job(request.get("kind"), request.get("params") or {})
+            except (ValueError, TypeError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(202, {"id": job_id, "status": "queued"})
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            job = cancel_job(parts[1])
+            if job:
+                self._send_json(200, job)
+            else:
+                self._send_json(404, {"error": "job not found"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+# --- Client (used by the Streamlit app) ---
+
+class JobServiceError(Exception):
+    """Raised when the job service can't be reached or answers a request with an error."""
+
+def _call_service(method, path, missing_ok=False, **kwargs):
+    """
+    Sends a request to the job service and returns the decoded JSON body, or None for a 404
+    when missing_ok is set. Raises JobServiceError for connection and HTTP errors.
+    """
+    import requests
+    try:
+        response = requests.request(method, f"{JOB_SERVICE_URL}{path}", timeout=10, **kwargs)
+        if missing_ok and response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError) as e: # ValueError: body was not JSON
+        raise JobServiceError(f"{method} {path}: {e}") from e
+
+def submit_remote_job(kind, params):
+    return _call_service("POST", "/jobs", json={"kind": kind, "params": params})["id"]
+
+def fetch_remote_job(job_id):
+    return _call_service("GET", f"/jobs/{job_id}", missing_ok=True)
+
+def cancel_remote_job(job_id):
+    return _call_service("POST", f"/jobs/{job_id}/cancel")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the local job service for long-running generations.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help=f"concurrent jobs (default: {DEFAULT_WORKERS})")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    init_job_db()
+    stop_event = start_workers(args.workers)
+    server = ThreadingHTTPServer((args.host, args.port), JobRequestHandler)
+    logger.info(f"Job service listening on http://{args.host}:{args.port} with {args.workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_event.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
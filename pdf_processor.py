@@ -1,7 +1,8 @@
 # pdf_processor.py
-import PyPDF2
 import io
-import streamlit as st
+
+from reporting import report_error
+from tracing import span
 
 def extract_text_from_pdf(uploaded_file):
     """
@@ -11,30 +12,44 @@ def extract_text_from_pdf(uploaded_file):
     Returns:
         A string containing all extracted text from the PDF, or an error message.
     """
+    import PyPDF2 # Only loaded once a paper is actually uploaded
+
     try:
-        # PyPDF2 needs a byte stream, so we use BytesIO
-        pdf_file = io.BytesIO(uploaded_file.getvalue())
-        reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        for page_num in range(len(reader.pages)):
-            page = reader.pages[page_num]
-            text += page.extract_text() + "\n"
+        with span("pdf.extract", file=uploaded_file.name) as attributes:
+            # PyPDF2 needs a byte stream, so we use BytesIO
+            pdf_file = io.BytesIO(uploaded_file.getvalue())
+            reader = PyPDF2.PdfReader(pdf_file)
+            text = ""
+            for page_num in range(len(reader.pages)):
+                page = reader.pages[page_num]
+                text += page.extract_text() + "\n"
+            attributes.update(pages=len(reader.pages), chars=len(text))
         return text
     except Exception as e:
-        st.error(f"Error extracting text from PDF '{uploaded_file.name}': {e}")
+        report_error(f"Error extracting text from PDF '{uploaded_file.name}': {e}")
         return f"Error extracting text from PDF: {e}"
 
-def get_combined_uploaded_text():
+def combine_uploaded_papers(papers):
     """
-    Combines text from all uploaded papers stored in session state.
+    Combines the text of uploaded papers into one delimited string.
+    Args:
+        papers: A list of {'name': str, 'extracted_text': str} dicts.
     Returns:
         A single string containing all extracted text, or an empty string if none.
     """
     combined_text = ""
-    if st.session_state.uploaded_papers_data:
-        for paper_info in st.session_state.uploaded_papers_data:
-            combined_text += f"\n--- Start of Document: {paper_info['name']} ---\n"
-            combined_text += paper_info['extracted_text']
-            combined_text += f"\n--- End of Document: {paper_info['name']} ---\n"
+    for paper_info in papers or []:
+        combined_text += f"\n--- Start of Document: {paper_info['name']} ---\n"
+        combined_text += paper_info['extracted_text']
+        combined_text += f"\n--- End of Document: {paper_info['name']} ---\n"
     return combined_text
 
+def get_combined_uploaded_text():
+    """
+    Combines text from all uploaded papers stored in session state.
+    Returns:
+        A single string containing all extracted text, or an empty string if none.
+    """
+    import streamlit as st # Only the app has session state; the batch CLI passes text explicitly
+    return combine_uploaded_papers(st.session_state.uploaded_papers_data)
+
@@ -1,10 +1,119 @@
 # prompts.py
+import os
+import logging
+
+from reporting import report_warning
+from tracing import annotate
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the estimated size of every prompt. gemini-2.0-flash accepts far more, but huge
+# uploads are slow and eventually rejected; override with the PROMPT_TOKEN_BUDGET environment variable.
+PROMPT_TOKEN_BUDGET = int(os.environ.get("PROMPT_TOKEN_BUDGET", "100000"))
+
+# Part of the budget kept for the fixed instructions of each template
+INSTRUCTION_TOKEN_RESERVE = int(os.environ.get("PROMPT_INSTRUCTION_TOKENS", "1000"))
+
+# Section categories, in the order they are given budget that another category leaves unused
+PRIORITY_USER_INPUT = 0
+PRIORITY_STAGE_OUTPUT = 1
+PRIORITY_PAPER_CONTEXT = 2
+
+# Share of the rest of the budget each category is guaranteed when the prompt is over budget.
+# A category that needs less than its share leaves the remainder to the others.
+PROMPT_BUDGET_SHARES = {
+    PRIORITY_USER_INPUT: float(os.environ.get("PROMPT_USER_INPUT_SHARE", "0.2")),
+    PRIORITY_STAGE_OUTPUT: float(os.environ.get("PROMPT_STAGE_OUTPUT_SHARE", "0.4")),
+    PRIORITY_PAPER_CONTEXT: float(os.environ.get("PROMPT_PAPER_CONTEXT_SHARE", "0.4")),
+}
+
+CHARS_PER_TOKEN = 4 # Rough average for English and chemistry prose
+
+def estimate_tokens(text):
+    """
+    Fast local estimate of the number of model tokens in a piece of text.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN if text else 0
+
+def _truncate_to_tokens(text, max_tokens):
+    cut = text[:max(max_tokens, 0) * CHARS_PER_TOKEN]
+    if " " in cut[-200:]:
+        cut = cut[:cut.rindex(" ")] # Don't end mid-word
+    return f"{cut}\n[... truncated to fit the prompt size limit ...]"
+
+def _category_budgets(demands, available):
+    """
+    Splits `available` tokens between categories ({priority: tokens needed}). Each gets what it
+    needs up to its PROMPT_BUDGET_SHARES share; what is left over goes to categories that need
+    more, in priority order.
+    """
+    total_share = sum(PROMPT_BUDGET_SHARES.get(priority, 0) for priority in demands) or 1
+    grants = {
+        priority: min(demand, int(available * PROMPT_BUDGET_SHARES.get(priority, 0) / total_share))
+        for priority, demand in demands.items()
+    }
+    left = available - sum(grants.values())
+    for priority in sorted(demands):
+        extra = min(demands[priority] - grants[priority], max(left, 0))
+        grants[priority] += extra
+        left -= extra
+    return grants
+
+def fit_prompt_sections(prompt_name, sections, budget=None):
+    """
+    Fits the variable sections of a prompt into the token budget.
+    `sections` is a list of (label, text, priority) tuples, where the priority is the section's
+    category. The budget left after INSTRUCTION_TOKEN_RESERVE is split between the categories
+    (see _category_budgets()); within a category, sections are granted budget in the order given
+    and those that don't fit are truncated. Returns the section texts in the order given (None
+    and non-text values unchanged).
+    """
+    available = max((budget or PROMPT_TOKEN_BUDGET) - INSTRUCTION_TOKEN_RESERVE, 0)
+    fitted = [text for _, text, _ in sections]
+    demands = {}
+    for _, text, priority in sections:
+        if isinstance(text, str):
+            demands[priority] = demands.get(priority, 0) + estimate_tokens(text)
+    if sum(demands.values()) <= available:
+        return fitted
+
+    grants = _category_budgets(demands, available)
+    for index, (label, text, priority) in enumerate(sections):
+        if not isinstance(text, str):
+            continue
+        tokens = estimate_tokens(text)
+        if tokens > grants[priority]:
+            fitted[index] = _truncate_to_tokens(text, grants[priority])
+            report_warning(
+                f"The {label} was shortened from ~{tokens:,} to ~{grants[priority]:,} tokens "
+                f"to fit the {prompt_name} prompt."
+            )
+            tokens = grants[priority]
+        grants[priority] -= tokens
+    return fitted
+
+def _report_prompt_size(prompt_name, prompt_text, budget=None):
+    budget = budget or PROMPT_TOKEN_BUDGET
+    prompt_tokens = estimate_tokens(prompt_text)
+    logger.info(f"{prompt_name} prompt: ~{prompt_tokens:,} tokens (budget {budget:,}).")
+    annotate(prompt=prompt_name, prompt_tokens=prompt_tokens)
+    if prompt_tokens > budget:
+        # Fixed instructions longer than INSTRUCTION_TOKEN_RESERVE, or many short sections
+        report_warning(f"The {prompt_name} prompt is still ~{prompt_tokens:,} tokens, over its budget of {budget:,}.")
+    return prompt_text
+
 
 def format_research_ideas_prompt(topic, goal, data, uploaded_text_context=None):
     """
     Formats the user's input into a prompt for generating research ideas.
     Includes optional uploaded text context.
     """
+    topic, goal, data, uploaded_text_context = fit_prompt_sections("research ideas", [
+        ("research topic", topic, PRIORITY_USER_INPUT),
+        ("research goal", goal, PRIORITY_USER_INPUT),
+        ("existing data", data, PRIORITY_USER_INPUT),
+        ("uploaded paper context", uploaded_text_context, PRIORITY_PAPER_CONTEXT),
+    ])
     context_section = ""
     if uploaded_text_context:
         context_section = f"""
@@ -32,13 +141,21 @@ def format_research_ideas_prompt(topic, goal, data, uploaded_text_context=None):
     2. Idea two description.
     3. Idea three description.
     """
-    return prompt_text
+    return _report_prompt_size("research ideas", prompt_text)
 
 def format_refine_idea_prompt(original_idea, refinement_feedback, topic, goal, data, uploaded_text_context=None):
     """
     Formats a prompt for refining a specific research idea based on user feedback.
     Includes optional uploaded text context.
     """
+    original_idea, refinement_feedback, topic, goal, data, uploaded_text_context = fit_prompt_sections("idea refinement", [
+        ("idea to refine", original_idea, PRIORITY_STAGE_OUTPUT),
+        ("refinement feedback", refinement_feedback, PRIORITY_USER_INPUT),
+        ("research topic", topic, PRIORITY_USER_INPUT),
+        ("research goal", goal, PRIORITY_USER_INPUT),
+        ("existing data", data, PRIORITY_USER_INPUT),
+        ("uploaded paper context", uploaded_text_context, PRIORITY_PAPER_CONTEXT),
+    ])
     context_section = ""
     if uploaded_text_context:
         context_section = f"""
@@ -69,7 +186,56 @@ def format_refine_idea_prompt(original_idea, refinement_feedback, topic, goal, d
     Provide the refined idea as a single, detailed paragraph. Focus on incorporating the feedback
     while maintaining the scientific rigor and actionable nature of the idea.
     """
-    return prompt_text
+    return _report_prompt_size("idea refinement", prompt_text)
+
+
+def format_refine_ideas_batch_prompt(ideas, refinement_feedback, topic, goal, data, uploaded_text_context=None):
+    """
+    Formats a prompt for refining several research ideas with the same feedback in one request.
+    Includes optional uploaded text context.
+    """
+    refinement_feedback, topic, goal, data, uploaded_text_context, *ideas = fit_prompt_sections("batch idea refinement", [
+        ("refinement feedback", refinement_feedback, PRIORITY_USER_INPUT),
+        ("research topic", topic, PRIORITY_USER_INPUT),
+        ("research goal", goal, PRIORITY_USER_INPUT),
+        ("existing data", data, PRIORITY_USER_INPUT),
+        ("uploaded paper context", uploaded_text_context, PRIORITY_PAPER_CONTEXT),
+        *[(f"idea {i} to refine", idea, PRIORITY_STAGE_OUTPUT) for i, idea in enumerate(ideas, start=1)],
+    ])
+    context_section = ""
+    if uploaded_text_context:
+        context_section = f"""
+    --- Additional Context from Uploaded Papers ---
+    {uploaded_text_context}
+    --- End of Additional Context ---
+
+    Please carefully read and consider the information from the "Additional Context from Uploaded Papers"
+    when refining the ideas.
+    """
+
+    numbered_ideas = "\n".join(f"    {i}. {idea}" for i, idea in enumerate(ideas, start=1))
+
+    prompt_text = f"""
+    You are an AI research assistant specializing in chemistry.
+    A user wants to refine several previously generated research ideas with the same feedback.
+
+    Original Research Topic: {topic}
+    Original Research Goal: {goal}
+    Original Existing Data: {data}
+    {context_section}
+
+    Original Research Ideas to Refine:
+{numbered_ideas}
+
+    User's Refinement Feedback:
+    {refinement_feedback}
+
+    Please refine each of the "Original Research Ideas to Refine" based on the user's feedback.
+    Return exactly {len(ideas)} refined ideas as a numbered list in the same order, one per original idea.
+    Write each refined idea as a single, detailed paragraph on one line. Focus on incorporating the feedback
+    while maintaining the scientific rigor and actionable nature of each idea.
+    """
+    return _report_prompt_size("batch idea refinement", prompt_text)
 
 
 def format_literature_summary_prompt(research_idea, uploaded_text_context=None):
@@ -77,6 +243,10 @@ def format_literature_summary_prompt(research_idea, uploaded_text_context=None):
     Formats a prompt for generating a literature summary for a given research idea.
     Includes optional uploaded text context.
     """
+    research_idea, uploaded_text_context = fit_prompt_sections("literature summary", [
+        ("research idea", research_idea, PRIORITY_STAGE_OUTPUT),
+        ("uploaded paper context", uploaded_text_context, PRIORITY_PAPER_CONTEXT),
+    ])
     context_section = ""
     if uploaded_text_context:
         context_section = f"""
@@ -96,12 +266,15 @@ def format_literature_summary_prompt(research_idea, uploaded_text_context=None):
 
     Please provide a summary of approximately 200-300 words.
     """
-    return prompt_text
+    return _report_prompt_size("literature summary", prompt_text)
 
 def format_properties_prediction_prompt(research_idea):
     """
     Formats a prompt for predicting properties or suggesting experimental details for a research idea.
     """
+    [research_idea] = fit_prompt_sections("properties", [
+        ("research idea", research_idea, PRIORITY_STAGE_OUTPUT),
+    ])
     prompt_text = f"""
     For the following research idea, suggest potential chemical properties (e.g., CAS numbers of key compounds, predicted reactivity, stability)
     or outline a conceptual approach for performance prediction. If applicable, suggest new ligands or materials.
@@ -110,12 +283,17 @@ def format_properties_prediction_prompt(research_idea):
 
     Provide your response in a structured format, perhaps using bullet points or clear headings for different aspects.
     """
-    return prompt_text
+    return _report_prompt_size("properties", prompt_text)
 
 def format_final_response_prompt(idea, literature_summary, properties):
     """
     Formats a prompt to compile a final research proposal summary.
     """
+    idea, literature_summary, properties = fit_prompt_sections("final response", [
+        ("research idea", idea, PRIORITY_STAGE_OUTPUT),
+        ("literature summary", literature_summary, PRIORITY_STAGE_OUTPUT),
+        ("properties", properties, PRIORITY_STAGE_OUTPUT),
+    ])
     prompt_text = f"""
     Based on the following approved research idea, literature summary, and predicted properties,
     compile a concise final research proposal overview.
@@ -128,13 +306,20 @@ def format_final_response_prompt(idea, literature_summary, properties):
     covering the need, solution, differentiation, and benefit (NSDB).
     Also, suggest what kind of experimental details and analysis data in graphs would be relevant.
     """
-    return prompt_text
+    return _report_prompt_size("final response", prompt_text)
 
 def format_follow_up_question_prompt(approved_idea, literature_summary, properties, user_question, uploaded_text_context=None):
     """
     Formats a prompt for answering a follow-up question based on the current research context.
     Includes optional uploaded text context.
     """
+    user_question, approved_idea, literature_summary, properties, uploaded_text_context = fit_prompt_sections("follow-up question", [
+        ("question", user_question, PRIORITY_USER_INPUT),
+        ("research idea", approved_idea, PRIORITY_STAGE_OUTPUT),
+        ("literature summary", literature_summary, PRIORITY_STAGE_OUTPUT),
+        ("properties", properties, PRIORITY_STAGE_OUTPUT),
+        ("uploaded paper context", uploaded_text_context, PRIORITY_PAPER_CONTEXT),
+    ])
     context = f"""
     Current Research Context:
     Approved Research Idea: {approved_idea}
@@ -165,13 +350,105 @@ def format_follow_up_question_prompt(approved_idea, literature_summary, properti
     Please provide a concise and helpful answer to the user's question, drawing upon the provided context and general chemical knowledge.
     If the question is outside the scope of the provided context or general chemistry, please state that.
     """
-    return prompt_text
+    return _report_prompt_size("follow-up question", prompt_text)
+
+def format_follow_up_chat_instruction(approved_idea, literature_summary, properties, uploaded_text_context=None, budget=None):
+    """
+    Formats the system instruction for a multi-turn follow-up chat. The research context lives here
+    rather than in every question, and stays the same for the whole chat so it can be cached;
+    earlier turns are carried by format_follow_up_chat_turns().
+    Includes optional uploaded text context.
+    """
+    approved_idea, literature_summary, properties, uploaded_text_context = fit_prompt_sections("follow-up chat", [
+        ("research idea", approved_idea, PRIORITY_STAGE_OUTPUT),
+        ("literature summary", literature_summary, PRIORITY_STAGE_OUTPUT),
+        ("properties", properties, PRIORITY_STAGE_OUTPUT),
+        ("uploaded paper context", uploaded_text_context, PRIORITY_PAPER_CONTEXT),
+    ], budget)
+    context_section = ""
+    if uploaded_text_context:
+        context_section = f"""
+    --- Additional Context from Uploaded Papers ---
+    {uploaded_text_context}
+    --- End of Additional Context ---
+
+    Please prioritize information from the "Additional Context from Uploaded Papers" if relevant to the question.
+    """
+
+    instruction_text = f"""
+    You are an AI research assistant specializing in chemistry.
+    The user is asking follow-up questions regarding their ongoing research.
+
+    Current Research Context:
+    Approved Research Idea: {approved_idea}
+    Literature Summary: {literature_summary}
+    Predicted Properties/Approach: {properties}
+    {context_section}
+
+    Please provide concise and helpful answers, drawing upon the provided context, the conversation so far
+    and general chemical knowledge. If a question is outside the scope of the provided context or general
+    chemistry, please state that.
+    """
+    return _report_prompt_size("follow-up chat", instruction_text, budget)
+
+def format_follow_up_chat_turns(contents, user_question, conversation_summary="", budget=None):
+    """
+    Formats the turns sent with each follow-up chat request: the summary of compacted turns, the
+    recent history and the new question, fitted into `budget` tokens. The question is kept whole,
+    then the (short) summary and the newest turns; the oldest turns are shortened first.
+    """
+    history = list(reversed(contents)) # Newest first, so they are granted budget first
+    fitted = fit_prompt_sections("follow-up chat history", [
+        ("question", user_question, PRIORITY_USER_INPUT),
+        ("conversation summary", conversation_summary, PRIORITY_STAGE_OUTPUT),
+        *[("earlier chat turn", turn["parts"][0]["text"], PRIORITY_STAGE_OUTPUT) for turn in history],
+    ], budget)
+    user_question, conversation_summary = fitted[0], fitted[1]
+
+    turns = []
+    if conversation_summary:
+        turns.append({"role": "user", "parts": [{"text": f"Summary of our earlier conversation:\n{conversation_summary}"}]})
+        turns.append({"role": "model", "parts": [{"text": "Understood."}]})
+    turns.extend(
+        {"role": turn["role"], "parts": [{"text": text}]}
+        for turn, text in reversed(list(zip(history, fitted[2:])))
+    )
+    turns.append({"role": "user", "parts": [{"text": user_question}]})
+    return turns
+
+def format_chat_compaction_prompt(previous_summary, transcript):
+    """
+    Formats a prompt that folds older chat turns into the rolling conversation summary.
+    """
+    previous_summary, transcript = fit_prompt_sections("chat summary", [
+        ("conversation summary", previous_summary, PRIORITY_STAGE_OUTPUT),
+        ("conversation transcript", transcript, PRIORITY_STAGE_OUTPUT),
+    ])
+    prompt_text = f"""
+    You are summarizing a conversation between a chemistry researcher and an AI research assistant
+    so that it can be continued without the full transcript.
+
+    Existing Summary (may be empty):
+    {previous_summary}
+
+    Further Conversation:
+    {transcript}
+
+    Write an updated summary in at most 150 words. Keep the questions asked, the key facts, numbers,
+    compounds and conclusions from the answers, and any preferences the user stated.
+    """
+    return _report_prompt_size("chat summary", prompt_text)
 
 def format_search_queries_prompt(research_idea, literature_summary, uploaded_text_context=None):
     """
     Formats a prompt to suggest relevant search queries for external databases.
     Includes optional uploaded text context.
     """
+    research_idea, literature_summary, uploaded_text_context = fit_prompt_sections("search queries", [
+        ("research idea", research_idea, PRIORITY_STAGE_OUTPUT),
+        ("literature summary", literature_summary, PRIORITY_STAGE_OUTPUT),
+        ("uploaded paper context", uploaded_text_context, PRIORITY_PAPER_CONTEXT),
+    ])
     context_section = ""
     if uploaded_text_context:
         context_section = f"""
@@ -201,4 +478,4 @@ def format_search_queries_prompt(research_idea, literature_summary, uploaded_tex
     2. "post-synthetic modification amine functionalization"
     3. "zeolitic imidazolate frameworks gas separation"
     """
-    return prompt_text
+    return _report_prompt_size("search queries", prompt_text)
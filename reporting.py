@@ -0,0 +1,32 @@
+# reporting.py
+import logging
+
+logger = logging.getLogger("workflow")
+
+def _in_streamlit_script():
+    """
+    True when called from a Streamlit script run (not from the batch CLI or a worker thread).
+    """
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return False
+    return get_script_run_ctx(suppress_warning=True) is not None
+
+def report_error(message):
+    """
+    Logs an error and, inside the Streamlit app, also shows it with st.error.
+    """
+    logger.error(message)
+    if _in_streamlit_script():
+        import streamlit as st
+        st.error(message)
+
+def report_warning(message):
+    """
+    Logs a warning and, inside the Streamlit app, also shows it with st.warning.
+    """
+    logger.warning(message)
+    if _in_streamlit_script():
+        import streamlit as st
+        st.warning(message)
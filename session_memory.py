@@ -0,0 +1,412 @@
+# session_memory.py
+"""
+Approximate memory held by each browser session's state, and eviction of idle sessions' large
+objects to disk when all sessions together go over a ceiling.
+
+Every full script run calls begin_session_run() before it touches the session state and
+end_session_run() when it is done; the latter measures the session's keys. When the measured
+total exceeds SESSION_MEMORY_LIMIT_MB, a background thread moves the largest evictable values
+of sessions idle for at least SESSION_IDLE_SECONDS to data/evicted/<host>-<pid>/ and leaves an
+EvictedValue marker in their place, until the total is back under the ceiling. The next run or
+fragment rerun of that session (see restore_evicted_state()) loads them back before use.
+
+Sessions that are running are never evicted from, so a script never sees a marker.
+"""
+import atexit
+import json
+import logging
+import os
+import pickle
+import shutil
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from reporting import report_error
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+SESSION_MEMORY_LIMIT_MB = float(os.environ.get("SESSION_MEMORY_LIMIT_MB", "1024")) # All sessions together
+SESSION_IDLE_SECONDS = float(os.environ.get("SESSION_IDLE_SECONDS", "300")) # Only sessions idle this long are evicted from
+EVICTION_TARGET = 0.8 # Eviction stops at this fraction of the ceiling, so it doesn't run again on the next rerun
+MIN_EVICTABLE_BYTES = 64 * 1024 # Smaller values are not worth a file
+STALE_RUN_SECONDS = 3600 # A run that never finished (the browser went away mid-run) counts as idle after this
+# A session disconnected this long is gone (Streamlit keeps one for a reconnect for minutes, not hours)
+ENDED_SESSION_SECONDS = 3600
+
+# Port of the memory admin API (GET /sessions/memory, POST /sessions/memory/evict); unset means off
+MEMORY_ADMIN_PORT = os.environ.get("MEMORY_ADMIN_PORT", "")
+
+# Replicas may share data/, so each process evicts into its own directory: one subdirectory
+# per Streamlit session below it, one pickle per evicted key
+EVICTION_DIR = os.path.join("data", "evicted", f"{socket.gethostname()}-{os.getpid()}")
+
+# Large values that can be written out and read back. Search history is left alone: a button
+# callback reads it before the script run starts.
+EVICTABLE_KEYS = (
+    'uploaded_papers_data', 'chemical_image_bytes', 'follow_up_chat', 'ideas', 'approved_idea',
+    'literature_summary', 'properties', 'final_response', 'suggested_search_queries',
+)
+
+
+class EvictedValue:
+    """
+    Stands in a session state key whose value was moved to disk. `empty` is what the key gets
+    if the file cannot be read back.
+    """
+    def __init__(self, path, size, empty):
+        self.path = path
+        self.size = size
+        self.empty = empty
+
+    def __repr__(self):
+        return f"EvictedValue({self.path!r}, {self.size} bytes)"
+
+
+class _TrackedSession:
+    def __init__(self, session_id, state):
+        self.session_id = session_id
+        # The session state of the latest run. Each run wraps the same state in a new
+        # SafeSessionState, so the latest one is kept rather than a reference to the first.
+        self.state = state
+        self.disconnected_since = None
+        self.lock = threading.Lock() # Held while values are evicted or restored
+        self.running = False
+        self.run_started = 0.0
+        self.last_active = time.time()
+        self.workflow_session_id = None
+        self.stage = None
+        self.sizes = {} # key -> approximate bytes, as of the end of the last run
+        self.evicted = {} # key -> EvictedValue
+
+
+_sessions = {} # Streamlit session id -> _TrackedSession
+_sessions_lock = threading.Lock()
+_eviction_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-evictor")
+_eviction_pending = threading.Event()
+
+
+def approximate_size(value, _seen=None):
+    """
+    Bytes held by a value and everything it contains, counting shared objects once. Finished
+    futures count their result.
+    """
+    seen = set() if _seen is None else _seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    if isinstance(value, EvictedValue):
+        return sys.getsizeof(value)
+    size = sys.getsizeof(value, 0)
+    if isinstance(value, dict):
+        size += sum(approximate_size(key, seen) + approximate_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, seen) for item in value)
+    elif isinstance(value, Future):
+        if value.done() and not value.cancelled() and value.exception() is None:
+            size += approximate_size(value.result(), seen)
+    return size
+
+
+def _current_state():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_state if ctx is not None else None
+
+
+def _session_dir(session_id):
+    return os.path.join(EVICTION_DIR, session_id)
+
+
+def _restore(entry, state):
+    """
+    Loads the session's evicted values back into its state. Returns the keys whose files could
+    not be read; they are reset to an empty value. Caller holds entry.lock.
+    """
+    lost = []
+    for key, marker in list(entry.evicted.items()):
+        if key in state and state[key] is marker: # Unless the key was set again since
+            try:
+                with open(marker.path, "rb") as f:
+                    value = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError) as e:
+                logger.error(f"Could not restore '{key}' of session {entry.session_id} from {marker.path}: {e}")
+                lost.append(key)
+                value = marker.empty
+            state[key] = value
+        try:
+            os.remove(marker.path)
+        except OSError:
+            pass
+        del entry.evicted[key]
+    return lost
+
+
+def _report_lost_values(lost):
+    # Called from the script thread, outside entry.lock
+    if lost:
+        report_error(
+            f"⚠️ Error: some of this session's data could not be reloaded and was cleared "
+            f"({', '.join(key.replace('_', ' ') for key in lost)}). Please regenerate it."
+        )
+
+
+def begin_session_run(session_id):
+    """
+    Marks the session as running and loads back anything evicted while it was idle. Call it at
+    the top of every script run, before the session state is read.
+    """
+    state = _current_state()
+    if state is None:
+        return
+    with _sessions_lock:
+        entry = _sessions.get(session_id)
+        if entry is None:
+            entry = _sessions[session_id] = _TrackedSession(session_id, state)
+    lost = []
+    with entry.lock:
+        entry.state = state
+        entry.running = True
+        entry.run_started = entry.last_active = time.time()
+        if entry.evicted:
+            with span("session.restore_evicted", keys=len(entry.evicted)):
+                lost = _restore(entry, state)
+    _report_lost_values(lost)
+
+
+def restore_evicted_state():
+    """
+    Loads back this session's evicted values. For fragment reruns, which skip the top of the script.
+    """
+    ctx = get_script_run_ctx(suppress_warning=True)
+    if ctx is None:
+        return
+    with _sessions_lock:
+        entry = _sessions.get(ctx.session_id)
+    if entry is None:
+        return
+    lost = []
+    with entry.lock:
+        entry.state = ctx.session_state
+        entry.last_active = time.time()
+        if entry.evicted:
+            lost = _restore(entry, ctx.session_state)
+    _report_lost_values(lost)
+
+
+def end_session_run(session_id):
+    """
+    Measures the session's state at the end of a script run and, if all sessions together are
+    over the ceiling, starts evicting from idle ones in the background.
+    """
+    state = _current_state()
+    with _sessions_lock:
+        entry = _sessions.get(session_id)
+    if state is None or entry is None:
+        return
+    with span("session.measure_memory") as attributes:
+        sizes = {key: approximate_size(value) for key, value in state.filtered_state.items()}
+        attributes["bytes"] = sum(sizes.values())
+    with entry.lock:
+        entry.sizes = sizes
+        entry.workflow_session_id = state['workflow_session_id'] if 'workflow_session_id' in state else None
+        entry.stage = state['stage'] if 'stage' in state else None
+        entry.running = False
+        entry.last_active = time.time()
+
+    if total_session_bytes() > SESSION_MEMORY_LIMIT_MB * 1024 * 1024 and not _eviction_pending.is_set():
+        _eviction_pending.set()
+        _eviction_executor.submit(_evict_in_background)
+
+
+def _evict_in_background():
+    try:
+        evict_idle_sessions()
+    except Exception:
+        logger.exception("Session eviction failed")
+    finally:
+        _eviction_pending.clear()
+
+
+def _live_sessions():
+    """
+    Returns the tracked sessions that still exist, dropping (and deleting the files of) the rest.
+    """
+    now = time.time()
+    runtime = Runtime.instance() if Runtime.exists() else None
+    with _sessions_lock:
+        ended = []
+        for session_id, entry in _sessions.items():
+            if runtime is None or runtime.is_active_session(session_id):
+                entry.disconnected_since = None
+            elif entry.disconnected_since is None:
+                entry.disconnected_since = now
+            elif now - entry.disconnected_since >= ENDED_SESSION_SECONDS:
+                ended.append(session_id)
+        for session_id in ended:
+            del _sessions[session_id]
+        entries = list(_sessions.values())
+    for session_id in ended:
+        shutil.rmtree(_session_dir(session_id), ignore_errors=True)
+    return entries
+
+
+def total_session_bytes():
+    return sum(sum(entry.sizes.values()) for entry in _live_sessions())
+
+
+def _is_idle(entry, now, idle_seconds):
+    if entry.running:
+        return now - entry.run_started >= STALE_RUN_SECONDS
+    return now - entry.last_active >= idle_seconds
+
+
+def _evict_value(entry, state, key, size):
+    # Caller holds entry.lock
+    value = state[key]
+    os.makedirs(_session_dir(entry.session_id), exist_ok=True)
+    path = os.path.join(_session_dir(entry.session_id), f"{key}.pickle")
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    marker = EvictedValue(path, size, type(value)() if isinstance(value, (list, dict, str, bytes)) else None)
+    # Deleting first drops the value from both halves of Streamlit's session state, so it is freed now
+    # rather than at the session's next rerun
+    del state[key]
+    state[key] = marker
+    entry.evicted[key] = marker
+    entry.sizes[key] = approximate_size(marker)
+
+
+def evict_idle_sessions(target_bytes=None, idle_seconds=None):
+    """
+    Moves the largest evictable values of idle sessions to disk, longest-idle sessions first,
+    until the total is at most target_bytes (default: EVICTION_TARGET of the ceiling; 0 evicts
+    everything evictable). Returns {"evicted_bytes", "evicted_values", "total_bytes"}.
+    """
+    if target_bytes is None:
+        target_bytes = SESSION_MEMORY_LIMIT_MB * 1024 * 1024 * EVICTION_TARGET
+    idle_seconds = SESSION_IDLE_SECONDS if idle_seconds is None else idle_seconds
+    now = time.time()
+    entries = _live_sessions()
+    total = sum(sum(entry.sizes.values()) for entry in entries)
+
+    candidates = [
+        (entry.last_active, -size, entry, key)
+        for entry in entries if _is_idle(entry, now, idle_seconds)
+        for key, size in entry.sizes.items()
+        if key in EVICTABLE_KEYS and key not in entry.evicted and size >= MIN_EVICTABLE_BYTES
+    ]
+    candidates.sort(key=lambda candidate: candidate[:2])
+
+    evicted_bytes = evicted_values = 0
+    with span("session.evict", sessions=len(entries), total_bytes=total) as attributes:
+        for _, negative_size, entry, key in candidates:
+            if total <= target_bytes:
+                break
+            state = entry.state
+            with entry.lock:
+                # The session may have become active since the candidates were chosen
+                if not _is_idle(entry, time.time(), idle_seconds) or key not in state:
+                    continue
+                try:
+                    _evict_value(entry, state, key, -negative_size)
+                except Exception as e:
+                    logger.warning(f"Could not evict '{key}' of session {entry.session_id}: {e}")
+                    continue
+            total += negative_size
+            evicted_bytes -= negative_size
+            evicted_values += 1
+        attributes["evicted_bytes"] = evicted_bytes
+
+    if evicted_values:
+        logger.info(f"Evicted {evicted_values} values ({evicted_bytes / 1e6:.1f} MB) of idle sessions to {EVICTION_DIR}.")
+    if total > SESSION_MEMORY_LIMIT_MB * 1024 * 1024:
+        largest = max(entries, key=lambda entry: sum(entry.sizes.values()), default=None)
+        logger.warning(
+            f"Sessions hold {total / 1e6:.1f} MB, over the {SESSION_MEMORY_LIMIT_MB:.0f} MB ceiling, with nothing "
+            f"idle left to evict; the largest is {largest.session_id} ({sum(largest.sizes.values()) / 1e6:.1f} MB)."
+        )
+    return {"evicted_bytes": evicted_bytes, "evicted_values": evicted_values, "total_bytes": total}
+
+
+def get_memory_report():
+    """
+    Returns the approximate memory held by every live session, broken down by session state
+    key, largest sessions first.
+    """
+    now = time.time()
+    sessions = []
+    for entry in _live_sessions():
+        with entry.lock:
+            sizes = dict(entry.sizes)
+            evicted = {key: marker.size for key, marker in entry.evicted.items()}
+            sessions.append({
+                "session_id": entry.session_id,
+                "workflow_session_id": entry.workflow_session_id,
+                "stage": entry.stage,
+                "running": entry.running,
+                "idle_seconds": 0 if entry.running else round(now - entry.last_active, 1),
+                "total_bytes": sum(sizes.values()),
+                "keys": dict(sorted(sizes.items(), key=lambda item: -item[1])),
+                "evicted": evicted,
+            })
+    sessions.sort(key=lambda session: -session["total_bytes"])
+    return {
+        "limit_bytes": int(SESSION_MEMORY_LIMIT_MB * 1024 * 1024),
+        "total_bytes": sum(session["total_bytes"] for session in sessions),
+        "evicted_bytes": sum(sum(session["evicted"].values()) for session in sessions),
+        "sessions": sessions,
+    }
+
+
+# --- Admin API ---
+
+class MemoryAdminHandler(BaseHTTPRequestHandler):
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _path_parts(self):
+        return [part for part in self.path.split("?")[0].split("/") if part]
+
+    def do_GET(self):
+        if self._path_parts() == ["sessions", "memory"]:
+            self._send_json(200, get_memory_report())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self._path_parts() == ["sessions", "memory", "evict"]:
+            # Evicts everything evictable from idle sessions, regardless of the ceiling
+            self._send_json(200, evict_idle_sessions(target_bytes=0))
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def init_session_memory():
+    """
+    Clears this process's eviction directory (left over if an earlier process had the same pid),
+    removes it again at exit and starts the admin API if MEMORY_ADMIN_PORT is set. Other
+    processes' directories are left alone. Call it once per process.
+    """
+    shutil.rmtree(EVICTION_DIR, ignore_errors=True)
+    atexit.register(shutil.rmtree, EVICTION_DIR, ignore_errors=True)
+    if MEMORY_ADMIN_PORT:
+        server = ThreadingHTTPServer(("127.0.0.1", int(MEMORY_ADMIN_PORT)), MemoryAdminHandler)
+        threading.Thread(target=server.serve_forever, name="memory-admin", daemon=True).start()
+        logger.info(f"Session memory admin API on http://127.0.0.1:{MEMORY_ADMIN_PORT}/sessions/memory")
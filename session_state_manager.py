@@ -1,11 +1,37 @@
 # session_state_manager.py
+import hashlib
+import logging
+import uuid
 import streamlit as st
 
+from session_store import get_session_store, encode_session_state, decode_session_state
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# The URL carries the workflow session id, so a reload or a link opened on another replica resumes it
+SESSION_QUERY_PARAM = "sid"
+
+# Workflow state saved in checkpoints. Background jobs, futures and history loaded from the
+# database are left out; they are recreated on demand.
+PERSISTED_KEYS = (
+    'stage', 'idea_index', 'ideas', 'approved_idea', 'literature_summary', 'properties', 'final_response',
+    'stage_fingerprints', 'active_jobs', 'speculation_used', 'speculative_prefetch_enabled', 'speculate_next_idea',
+    'chemical_query_input', 'chemical_cid', 'chemical_image_url', 'chemical_source', 'chemical_matched_name',
+    'chemical_image_bytes', 'chemical_lookup_attempted', 'chemical_lookup_success',
+    'current_topic', 'current_goal', 'current_data', 'follow_up_chat', 'suggested_search_queries',
+    'uploaded_papers_data',
+)
+
 def initialize_session_state():
     """
     Initializes all necessary Streamlit session state variables.
     This function should be called once at the start of the app.
+    A new browser session whose URL names a checkpointed session resumes it first.
     """
+    if 'workflow_session_id' not in st.session_state:
+        _start_or_resume_session()
+
     if 'idea_index' not in st.session_state:
         st.session_state.idea_index = 0
     if 'ideas' not in st.session_state:
@@ -18,8 +44,22 @@ def initialize_session_state():
         st.session_state.properties = None
     if 'final_response' not in st.session_state:
         st.session_state.final_response = None
+    if 'stage_fingerprints' not in st.session_state:
+        st.session_state.stage_fingerprints = {} # Input fingerprints of generated stages, see workflow.PIPELINE_STAGES
     if 'stage' not in st.session_state:
         st.session_state.stage = 'input_details' # Initial stage for user input
+    if 'stage_jobs' not in st.session_state:
+        st.session_state.stage_jobs = {} # Background stage jobs, see stage_scheduler.py
+    if 'active_jobs' not in st.session_state:
+        st.session_state.active_jobs = {} # {job kind: {'id', 'fingerprint'[, 'failed']}} submitted to the job service
+    if 'speculative_jobs' not in st.session_state:
+        st.session_state.speculative_jobs = {} # {(stage, input fingerprint): {'future', 'request_class'}} started ahead of need
+    if 'speculation_used' not in st.session_state:
+        st.session_state.speculation_used = 0
+    if 'speculative_prefetch_enabled' not in st.session_state:
+        st.session_state.speculative_prefetch_enabled = False
+    if 'speculate_next_idea' not in st.session_state:
+        st.session_state.speculate_next_idea = False
 
     # Session states for chemical lookup
     if 'chemical_query_input' not in st.session_state:
@@ -38,6 +78,10 @@ def initialize_session_state():
         st.session_state.chemical_lookup_attempted = False
     if 'chemical_lookup_success' not in st.session_state:
         st.session_state.chemical_lookup_success = False
+    if 'chemical_lookup_job' not in st.session_state:
+        st.session_state.chemical_lookup_job = None # ChemicalLookupJob running in the background, see workflow.py
+    if 'structure_prefetch' not in st.session_state:
+        st.session_state.structure_prefetch = {} # {name: Future} for compounds found in the properties text
 
     # Session states for search history
     if 'search_history_data' not in st.session_state:
@@ -56,8 +100,8 @@ def initialize_session_state():
     # Session states for follow-up questions
     if 'follow_up_question' not in st.session_state:
         st.session_state.follow_up_question = ""
-    if 'follow_up_response' not in st.session_state:
-        st.session_state.follow_up_response = None
+    if 'follow_up_chat' not in st.session_state:
+        st.session_state.follow_up_chat = None # Created per approved idea by the follow-up chat section
 
     # Session state for AI-suggested search queries
     if 'suggested_search_queries' not in st.session_state:
@@ -66,3 +110,64 @@ def initialize_session_state():
     # New: Session states for uploaded research papers
     if 'uploaded_papers_data' not in st.session_state:
         st.session_state.uploaded_papers_data = [] # List of {'name': str, 'extracted_text': str}
+
+def _start_or_resume_session():
+    session_id = st.query_params.get(SESSION_QUERY_PARAM)
+    checkpoint = None
+    if session_id:
+        try:
+            checkpoint = get_session_store().load(session_id)
+        except Exception as e:
+            logger.warning(f"Could not load session {session_id}: {e}")
+
+    if checkpoint is not None:
+        state = decode_session_state(checkpoint)
+        for key, value in state.items():
+            st.session_state[key] = value
+        st.session_state.checkpoint_marker = _checkpoint_marker()
+        logger.info(f"Resumed session {session_id} at stage '{state.get('stage')}'.")
+    else:
+        session_id = uuid.uuid4().hex
+        st.query_params[SESSION_QUERY_PARAM] = session_id
+    st.session_state.workflow_session_id = session_id
+
+def _checkpoint_marker():
+    # Changes on every stage transition and whenever a stage result is recorded or the ideas change
+    position = (
+        st.session_state.get('stage'),
+        sorted((st.session_state.get('stage_fingerprints') or {}).items()),
+        st.session_state.get('idea_index'),
+        st.session_state.get('ideas'),
+    )
+    return hashlib.sha256(repr(position).encode("utf-8")).hexdigest()
+
+def checkpoint_session_state():
+    """
+    Saves the session's workflow state to the session store if the workflow moved on since the
+    last checkpoint. Call it at the end of every script run. Store failures are logged, not raised.
+    """
+    marker = _checkpoint_marker()
+    if st.session_state.get('checkpoint_marker') == marker:
+        return
+    if 'checkpoint_marker' not in st.session_state and not st.session_state.ideas:
+        # Nothing worth resuming yet; don't write a checkpoint for every page visit
+        st.session_state.checkpoint_marker = marker
+        return
+    state = {key: st.session_state[key] for key in PERSISTED_KEYS if key in st.session_state}
+    try:
+        with span("session.checkpoint", stage=state.get('stage')) as attributes:
+            checkpoint = encode_session_state(state)
+            attributes["bytes"] = len(checkpoint)
+            get_session_store().save(st.session_state.workflow_session_id, checkpoint, state.get('stage'))
+        st.session_state.checkpoint_marker = marker
+    except Exception as e:
+        logger.warning(f"Could not checkpoint session {st.session_state.workflow_session_id}: {e}")
+
+def start_new_session():
+    """
+    Clears the whole session state and drops the session id from the URL, so the next run
+    starts a fresh workflow session instead of resuming the checkpoint.
+    """
+    for key in list(st.session_state.keys()):
+        del st.session_state[key]
+    st.query_params.pop(SESSION_QUERY_PARAM, None)
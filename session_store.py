@@ -0,0 +1,142 @@
+# session_store.py
+"""
+Checkpoints of each session's workflow state, so that a session survives a server restart and
+can be resumed on any replica that shares the store.
+
+The backend is chosen with the SESSION_STORE environment variable:
+    sqlite (default)            data/sessions.db, for one host or replicas sharing a volume
+    package.module:ClassName    any SessionStore subclass, e.g. backed by Redis or Postgres;
+                                it is constructed with SESSION_STORE_URL as its only argument
+"""
+import abc
+import base64
+import importlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+SESSION_STORE = os.environ.get("SESSION_STORE", "sqlite")
+SESSION_STORE_URL = os.environ.get("SESSION_STORE_URL", "")
+
+SESSION_DATABASE_FILE = "data/sessions.db"
+SESSION_TTL_SECONDS = 30 * 24 * 3600 # Checkpoints not updated for this long are purged
+
+
+class SessionStore(abc.ABC):
+    """
+    Interface of a session store. Checkpoints are opaque text produced by encode_session_state().
+    Implementations must be safe to call from several threads.
+    """
+    @abc.abstractmethod
+    def save(self, session_id, checkpoint, stage):
+        ...
+
+    @abc.abstractmethod
+    def load(self, session_id):
+        """Returns the checkpoint text, or None if the session is unknown or its checkpoint expired."""
+
+    @abc.abstractmethod
+    def delete(self, session_id):
+        ...
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, database_file=SESSION_DATABASE_FILE):
+        self.database_file = database_file
+        os.makedirs(os.path.dirname(database_file) or ".", exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS session_checkpoints (
+                session_id TEXT PRIMARY KEY,
+                checkpoint TEXT NOT NULL,
+                stage TEXT,
+                updated_at REAL NOT NULL
+            )
+        """)
+        conn.execute("DELETE FROM session_checkpoints WHERE updated_at < ?", (time.time() - SESSION_TTL_SECONDS,))
+        conn.commit()
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.database_file, timeout=10)
+
+    @traced("db.save_session_checkpoint")
+    def save(self, session_id, checkpoint, stage):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO session_checkpoints (session_id, checkpoint, stage, updated_at) VALUES (?, ?, ?, ?)",
+            (session_id, checkpoint, stage, time.time())
+        )
+        conn.commit()
+        conn.close()
+
+    @traced("db.load_session_checkpoint")
+    def load(self, session_id):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT checkpoint FROM session_checkpoints WHERE session_id = ? AND updated_at >= ?",
+            (session_id, time.time() - SESSION_TTL_SECONDS)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+
+    def delete(self, session_id):
+        conn = self._connect()
+        conn.execute("DELETE FROM session_checkpoints WHERE session_id = ?", (session_id,))
+        conn.commit()
+        conn.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_session_store():
+    """
+    Returns the process-wide store configured by SESSION_STORE, creating it on first use.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            if SESSION_STORE == "sqlite":
+                _store = SQLiteSessionStore()
+            else:
+                module_name, _, class_name = SESSION_STORE.partition(":")
+                store_class = getattr(importlib.import_module(module_name), class_name)
+                _store = store_class(SESSION_STORE_URL)
+            logger.info(f"Session store: {type(_store).__name__}")
+        return _store
+
+def set_session_store(store):
+    """
+    Replaces the process-wide store, e.g. with one built in code rather than from SESSION_STORE.
+    """
+    global _store
+    with _store_lock:
+        _store = store
+
+
+# Checkpoints are JSON; bytes (structure images) are stored as base64
+def _encode_value(value):
+    if isinstance(value, bytes):
+        return {"__bytes__": base64.b64encode(value).decode("ascii")}
+    raise TypeError(f"{type(value).__name__} cannot be checkpointed")
+
+def _decode_value(obj):
+    if set(obj) == {"__bytes__"}:
+        return base64.b64decode(obj["__bytes__"])
+    return obj
+
+def encode_session_state(state):
+    return json.dumps(state, default=_encode_value, ensure_ascii=False)
+
+def decode_session_state(checkpoint):
+    return json.loads(checkpoint, object_hook=_decode_value)
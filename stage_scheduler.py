@@ -0,0 +1,115 @@
+# stage_scheduler.py
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+
+from tracing import propagate
+from gemini_scheduler import request_priority, raise_priority, PRIORITY_BACKGROUND
+
+# Shared by all sessions; each stage job is one Gemini call, so a few threads go a long way
+STAGE_WORKERS = 4
+
+# Speculative jobs (work started before the user asks for it) allowed per session
+SPECULATION_BUDGET_PER_SESSION = 6
+
+_executor = ThreadPoolExecutor(max_workers=STAGE_WORKERS, thread_name_prefix="workflow-stage")
+
+def _fingerprint(args):
+    return hashlib.sha256(repr(args).encode("utf-8")).hexdigest()
+
+def start_stage(stage_name, stage_fn, *args):
+    """
+    Starts a workflow stage in the background as soon as its inputs are known.
+    The job is remembered in session state under stage_name together with a fingerprint of
+    its inputs; starting the same stage with the same inputs again is a no-op.
+    Stage functions run outside the script thread, so they must receive everything they
+    need (e.g. uploaded text) as arguments rather than reading st.session_state.
+    """
+    fingerprint = _fingerprint(args)
+    job = st.session_state.stage_jobs.get(stage_name)
+    if job and job["fingerprint"] == fingerprint:
+        return job["future"]
+
+    # Promote a speculative job for exactly these inputs instead of starting another call
+    speculative = _promote_speculation(stage_name, fingerprint)
+    if speculative is not None:
+        future = speculative["future"]
+    else:
+        future = _executor.submit(propagate(stage_fn), *args) # Spans keep the session
+    st.session_state.stage_jobs[stage_name] = {"fingerprint": fingerprint, "future": future}
+    return future
+
+def get_stage_result(stage_name, stage_fn, *args):
+    """
+    Returns the result of a stage, waiting for its background job if one was started with the
+    same inputs, or running it right here otherwise. The job is forgotten once consumed.
+    """
+    fingerprint = _fingerprint(args)
+    job = st.session_state.stage_jobs.pop(stage_name, None)
+    if job and job["fingerprint"] == fingerprint:
+        return job["future"].result()
+    speculative = _promote_speculation(stage_name, fingerprint)
+    if speculative is not None:
+        return speculative["future"].result()
+    return stage_fn(*args)
+
+def _promote_speculation(stage_name, fingerprint):
+    """
+    Takes a speculative job out of the session's speculation once the user needs it, and moves
+    its model calls up to interactive priority. Returns the job, or None.
+    """
+    speculative = st.session_state.speculative_jobs.pop((stage_name, fingerprint), None)
+    if speculative is not None:
+        raise_priority(speculative["request_class"])
+    return speculative
+
+def has_stage_job(stage_name, *args):
+    """
+    True if a background or speculative job exists for the stage with exactly these inputs.
+    """
+    fingerprint = _fingerprint(args)
+    job = st.session_state.stage_jobs.get(stage_name)
+    if job and job["fingerprint"] == fingerprint:
+        return True
+    return (stage_name, fingerprint) in st.session_state.speculative_jobs
+
+def discard_stage(stage_name):
+    """
+    Forgets a stage's background job so that the next request regenerates it.
+    A job that is already running finishes, but its result is dropped.
+    """
+    job = st.session_state.stage_jobs.pop(stage_name, None)
+    if job:
+        job["future"].cancel() # Only succeeds if it has not started yet
+
+def speculate_stage(stage_name, stage_fn, *args):
+    """
+    Starts a stage the user has not asked for yet (e.g. the summary of the idea currently on
+    screen), as long as the session's speculation budget allows it. If the user later needs
+    the stage with the same inputs, start_stage/get_stage_result reuse the job; otherwise it
+    stays in the session's speculative jobs until discard_speculation() is called.
+    Returns True if a job exists for these inputs.
+    """
+    key = (stage_name, _fingerprint(args))
+    if key in st.session_state.speculative_jobs:
+        return True
+    job = st.session_state.stage_jobs.get(stage_name)
+    if job and job["fingerprint"] == key[1]:
+        return True
+    if st.session_state.speculation_used >= SPECULATION_BUDGET_PER_SESSION:
+        return False
+
+    st.session_state.speculation_used += 1
+    # Its model calls wait behind calls users are waiting on, until the user needs it too
+    with request_priority(PRIORITY_BACKGROUND) as request_class:
+        future = _executor.submit(propagate(stage_fn), *args)
+    st.session_state.speculative_jobs[key] = {"future": future, "request_class": request_class}
+    return True
+
+def discard_speculation():
+    """
+    Drops all speculative jobs of the session, e.g. when a new set of ideas is generated.
+    """
+    for job in st.session_state.speculative_jobs.values():
+        job["future"].cancel()
+    st.session_state.speculative_jobs = {}
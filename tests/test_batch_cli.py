@@ -0,0 +1,67 @@
+# test_batch_cli.py
+import json
+
+import pytest
+
+import batch_cli
+
+API_ERROR = "⚠️ API Request Error: 503 Server Error. Please check your API key and network connection."
+
+@pytest.fixture
+def topics(tmp_path):
+    path = tmp_path / "topics.csv"
+    path.write_text("id,topic,goal,data\nrow1,Catalysts,Break down PET,MOF screening\n", encoding="utf-8")
+    return str(path)
+
+@pytest.fixture
+def model(monkeypatch):
+    """Stubs the workflow stages; set model.summary to change what the summary stage returns."""
+    class Model:
+        summary = "A summary."
+        calls = []
+    def stub(name, result):
+        def run(*args, **kwargs):
+            Model.calls.append(name)
+            return result() if callable(result) else result
+        monkeypatch.setattr(batch_cli, name, run)
+    stub("generate_research_ideas_from_ai", ["Idea one", "Idea two"])
+    stub("generate_literature_summary_from_ai", lambda: Model.summary)
+    stub("generate_properties_from_ai", "Properties.")
+    stub("compile_final_response_from_ai", "Proposal.")
+    return Model
+
+def _records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def test_api_error_fails_the_row_and_is_retried_on_resume(tmp_path, topics, model):
+    output = str(tmp_path / "results.jsonl")
+    model.summary = API_ERROR
+    assert batch_cli.run_batch(topics, output, workers=1) == (0, 1, 0)
+    assert _records(output)[-1]["status"] == "failed"
+
+    model.summary = "A summary."
+    model.calls.clear()
+    assert batch_cli.run_batch(topics, output, workers=1) == (1, 0, 0)
+    record = _records(output)[-1]
+    assert record["status"] == "done" and record["literature_summary"] == "A summary."
+    assert "generate_research_ideas_from_ai" not in model.calls # Checkpointed by the first run
+
+def test_done_rows_holding_api_errors_are_run_again(tmp_path, topics, model):
+    output = tmp_path / "results.jsonl"
+    stale = {"id": "row1", "status": "done", "ideas": ["Idea one"], "literature_summary": API_ERROR,
+             "properties": "Properties.", "final_response": "Proposal."}
+    output.write_text(json.dumps(stale) + "\n", encoding="utf-8")
+    assert batch_cli.run_batch(topics, str(output), workers=1) == (1, 0, 0)
+    assert _records(output)[-1]["literature_summary"] == "A summary."
+
+@pytest.mark.parametrize("output", [
+    API_ERROR,
+    "⚠️ Error: API Key is missing. Please provide your Gemini API Key.",
+    "⚠️ An unexpected error occurred: boom",
+    "Error generating summary.",
+    "",
+    [],
+])
+def test_failed_stage_outputs_are_errors(output):
+    assert batch_cli.is_stage_error(output)
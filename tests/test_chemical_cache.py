@@ -0,0 +1,69 @@
+# test_chemical_cache.py
+import sqlite3
+
+import pytest
+
+import chemical_cache
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """A fresh cache database with a controllable clock."""
+    class Clock:
+        now = 1_000_000.0
+    monkeypatch.setattr(chemical_cache, "CACHE_DATABASE_FILE", str(tmp_path / "chemical_cache.db"))
+    monkeypatch.setattr(chemical_cache, "_cache_initialized", False)
+    monkeypatch.setattr(chemical_cache.time, "time", lambda: Clock.now)
+    monkeypatch.setattr(chemical_cache, "_pending_stats", {})
+    return Clock
+
+def test_found_entries_live_for_the_positive_ttl(cache):
+    chemical_cache.save_cached_chemical("acetone", 180, "https://example/acetone.png", "PubChem", "propan-2-one")
+    cache.now += chemical_cache.POSITIVE_TTL_SECONDS - 1
+    assert chemical_cache.get_cached_chemical("acetone") == (True, (180, "https://example/acetone.png", "PubChem", "propan-2-one"))
+    cache.now += 2
+    assert chemical_cache.get_cached_chemical("acetone") == (False, (None, None, None, None))
+
+def test_not_found_entries_are_hits_until_the_negative_ttl(cache):
+    chemical_cache.save_cached_chemical("unobtainium", None, None, None, None)
+    assert chemical_cache.get_cached_chemical("unobtainium") == (True, (None, None, None, None))
+    cache.now += chemical_cache.NEGATIVE_TTL_SECONDS + 1
+    assert chemical_cache.get_cached_chemical("unobtainium") == (False, (None, None, None, None))
+
+def test_expired_entries_are_purged_at_start_up(cache):
+    chemical_cache.save_cached_chemical("unobtainium", None, None, None, None)
+    chemical_cache.save_cached_chemical("acetone", 180, "https://example/acetone.png", "PubChem", "propan-2-one")
+    cache.now += chemical_cache.NEGATIVE_TTL_SECONDS + 1
+    chemical_cache.init_chemical_cache()
+    conn = sqlite3.connect(chemical_cache.CACHE_DATABASE_FILE)
+    assert conn.execute("SELECT query FROM chemical_identity").fetchall() == [("name:acetone",)]
+    conn.close()
+
+def test_names_share_an_entry_across_case_and_whitespace(cache):
+    chemical_cache.save_cached_chemical("  Acetone ", 180, "https://example/acetone.png", "PubChem", "propan-2-one")
+    assert chemical_cache.get_cached_chemical("ACETONE")[0]
+    assert chemical_cache.get_cached_chemical("acetone")[0]
+
+@pytest.mark.parametrize("stored, other", [
+    ("C1CCCCC1", "c1ccccc1"), # cyclohexane, benzene
+    ("CO", "Co"), # carbon monoxide, cobalt
+    ("NO", "No"), # nitric oxide, nobelium
+    ("InChI=1S/CH4/h1H4", "inchi=1s/ch4/h1h4"),
+])
+def test_case_sensitive_identifiers_do_not_collide(cache, stored, other):
+    chemical_cache.save_cached_chemical(stored, 1, "https://example/1.png", "PubChem", stored)
+    assert chemical_cache.get_cached_chemical(stored)[0]
+    assert chemical_cache.get_cached_chemical(other) == (False, (None, None, None, None))
+
+def test_stats_are_counted_in_memory_and_flushed(cache):
+    chemical_cache.save_cached_chemical("acetone", 180, "https://example/acetone.png", "PubChem", "propan-2-one")
+    chemical_cache.get_cached_chemical("acetone")
+    chemical_cache.get_cached_chemical("ethanol")
+    conn = sqlite3.connect(chemical_cache.CACHE_DATABASE_FILE)
+    assert conn.execute("SELECT COUNT(*) FROM chemical_cache_stats").fetchone() == (0,) # Reads wrote nothing
+    stats = chemical_cache.get_chemical_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (1, 1, 0.5)
+
+    chemical_cache.flush_chemical_cache_stats()
+    assert dict(conn.execute("SELECT name, value FROM chemical_cache_stats").fetchall()) == {"hits": 1, "misses": 1}
+    assert chemical_cache.get_chemical_cache_stats()["hits"] == 1 # Not counted twice
+    conn.close()
@@ -0,0 +1,25 @@
+# test_chemical_entities.py
+import pytest
+
+from chemical_entities import extract_chemical_entities
+
+@pytest.mark.parametrize("name", [
+    "1,3-butadiene", "2-methylpropan-1-ol", "N,N-dimethylformamide", "4-nitrophenol", "1-octanol",
+    "2-chloroethane", "1,2-dibromoethane", "3-pentanone",
+])
+def test_systematic_names_are_extracted(name):
+    assert extract_chemical_entities(f"We then added {name} to the flask.") == [name]
+
+@pytest.mark.parametrize("text", [
+    "a 2-state model, a 3-plate assay, a 2-line approach",
+    "a 3-fold increase after a 2-step synthesis",
+    "a 2-dimensional material with a 4-tone palette and 2-site binding",
+])
+def test_numbered_words_are_not_names(text):
+    assert extract_chemical_entities(text) == []
+
+def test_a_listed_compound_and_its_cas_number_count_once():
+    assert extract_chemical_entities("Acetone (67-64-1) and 1,3-butadiene") == ["acetone", "1,3-butadiene"]
+
+def test_cas_numbers_need_a_valid_check_digit():
+    assert extract_chemical_entities("Samples 1310-73-2 and 1310-73-3") == ["1310-73-2"]
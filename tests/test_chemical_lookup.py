@@ -0,0 +1,93 @@
+# test_chemical_lookup.py
+import pytest
+
+import chemical_lookup
+from chemical_lookup import classify_chemical_query
+
+@pytest.mark.parametrize("query", ["CO", "NO", "CN", "N", "S", "P", "I", "ICl", "BOP", "CCO", "HCl", "SO2", "NaOH", "aspirin"])
+def test_formulas_and_short_atom_strings_are_names(query):
+    assert classify_chemical_query(query) == ("name", query)
+
+@pytest.mark.parametrize("query", ["c1ccccc1", "C=O", "CC(=O)O", "O=C=O", "[Na+].[Cl-]", "CCCCCC"])
+def test_smiles_syntax_or_long_atom_strings_are_smiles(query):
+    assert classify_chemical_query(query) == ("smiles", query)
+
+def test_other_identifiers_are_unaffected():
+    assert classify_chemical_query("50-00-0") == ("cas", "50-00-0")
+    assert classify_chemical_query("CID 702") == ("cid", 702)
+
+class _StubResponse:
+    def __init__(self, cids):
+        self.status_code = 200 if cids else 404
+        self._cids = cids
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"IdentifierList": {"CID": self._cids}}
+
+class _StubSession:
+    def __init__(self, names, smiles):
+        self.names, self.smiles, self.calls = names, smiles, []
+
+    def get(self, url, **kwargs):
+        self.calls.append(("name", url))
+        name = url.split("/compound/name/")[1].split("/")[0]
+        return _StubResponse(self.names.get(name, []))
+
+    def post(self, url, data=None, **kwargs):
+        self.calls.append(("smiles", data["smiles"]))
+        return _StubResponse(self.smiles.get(data["smiles"], []))
+
+def _use_session(monkeypatch, session):
+    monkeypatch.setattr(chemical_lookup, "get_session", lambda: session)
+    return session
+
+def test_ambiguous_query_resolves_as_name_first(monkeypatch):
+    session = _use_session(monkeypatch, _StubSession(names={"CO": [281]}, smiles={"CO": [887]}))
+    assert chemical_lookup._fetch_pubchem_cid("CO") == 281 # carbon monoxide, not methanol
+    assert [kind for kind, _ in session.calls] == ["name"]
+
+def test_ambiguous_query_falls_back_to_smiles(monkeypatch):
+    session = _use_session(monkeypatch, _StubSession(names={}, smiles={"CCO": [702]}))
+    assert chemical_lookup._fetch_pubchem_cid("CCO") == 702
+    assert [kind for kind, _ in session.calls] == ["name", "smiles"]
+
+def test_plain_names_never_try_smiles(monkeypatch):
+    session = _use_session(monkeypatch, _StubSession(names={}, smiles={}))
+    assert chemical_lookup._fetch_pubchem_cid("NaOH") is None
+    assert [kind for kind, _ in session.calls] == ["name"]
+
+def test_not_found_is_cached_only_when_every_resolver_answered(monkeypatch):
+    saved = []
+    monkeypatch.setattr(chemical_lookup, "get_cached_chemical", lambda query: (False, (None, None, None, None)))
+    monkeypatch.setattr(chemical_lookup, "save_cached_chemical", lambda query, *result: saved.append(query))
+    monkeypatch.setattr(chemical_lookup, "fetch_pubchem_image", lambda query: (None, None, None, None))
+    monkeypatch.setattr(chemical_lookup, "fetch_cactus_image", lambda query: (None, None, None, None))
+
+    def timed_out(query):
+        raise chemical_lookup.ResolverError("Wikidata: read timed out")
+    monkeypatch.setattr(chemical_lookup, "fetch_wikidata", timed_out)
+    assert chemical_lookup.fetch_chemical_info("unobtainium") == (None, None, None, None)
+    assert saved == []
+
+    monkeypatch.setattr(chemical_lookup, "fetch_wikidata", lambda query: (None, None, None, None))
+    chemical_lookup.fetch_chemical_info("unobtainium")
+    assert saved == ["unobtainium"]
+
+def test_pubchem_server_errors_are_resolver_errors(monkeypatch):
+    import requests
+
+    class _ErrorResponse:
+        status_code = 503
+        def raise_for_status(self):
+            raise requests.exceptions.HTTPError("503 Server Error")
+
+    class _Session:
+        def get(self, url, **kwargs):
+            return _ErrorResponse()
+
+    _use_session(monkeypatch, _Session())
+    with pytest.raises(chemical_lookup.ResolverError):
+        chemical_lookup._fetch_pubchem_cid("aspirin")
@@ -0,0 +1,79 @@
+# test_follow_up_chat.py
+import pytest
+
+import workflow
+from prompts import format_follow_up_chat_turns
+
+PAPER = "Polymer degradation by metal-organic frameworks. " * 2000 # Long enough to be cached
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """Records the requests ask_follow_up_chat makes instead of calling Gemini."""
+    class Gemini:
+        caches, requests = [], []
+        errors = [] # Returned instead of the next answers
+    def create_context_cache(instruction):
+        Gemini.caches.append(instruction)
+        return f"cachedContents/{len(Gemini.caches)}"
+    def query_model_chat(contents, system_instruction=None, cached_context=None):
+        Gemini.requests.append({"contents": contents, "system_instruction": system_instruction, "cached_context": cached_context})
+        return Gemini.errors.pop(0) if Gemini.errors else f"Answer {len(Gemini.requests)}"
+    monkeypatch.setattr(workflow, "create_context_cache", create_context_cache)
+    monkeypatch.setattr(workflow, "query_model_chat", query_model_chat)
+    monkeypatch.setattr(workflow, "report_error", lambda message: None)
+    return Gemini
+
+def _ask(chat, question, paper=PAPER):
+    return workflow.ask_follow_up_chat(chat, "Idea", "Summary", "Properties", question, uploaded_text_context=paper)
+
+def test_context_is_uploaded_once_and_referenced_by_name(gemini):
+    chat = workflow.new_follow_up_chat("Idea")
+    assert _ask(chat, "First?") == "Answer 1"
+    assert _ask(chat, "Second?") == "Answer 2"
+    assert len(gemini.caches) == 1 and PAPER.strip() in gemini.caches[0]
+    assert [request["cached_context"] for request in gemini.requests] == ["cachedContents/1"] * 2
+    assert all(PAPER not in str(request["contents"]) for request in gemini.requests)
+    assert [turn["parts"][0]["text"] for turn in gemini.requests[1]["contents"]] == ["First?", "Answer 1", "Second?"]
+
+def test_changed_context_is_uploaded_again(gemini):
+    chat = workflow.new_follow_up_chat("Idea")
+    _ask(chat, "First?")
+    _ask(chat, "Second?", paper=PAPER + "A new paper.")
+    assert len(gemini.caches) == 2
+
+def test_expired_cache_is_resent_with_the_request(gemini):
+    chat = workflow.new_follow_up_chat("Idea")
+    gemini.errors.append(workflow.CONTEXT_CACHE_MISSING_ERROR)
+    assert _ask(chat, "First?") == "Answer 2"
+    assert gemini.requests[1]["cached_context"] is None and PAPER.strip() in gemini.requests[1]["system_instruction"]
+    _ask(chat, "Second?")
+    assert len(gemini.caches) == 2 # Uploaded again on the next turn
+
+def test_other_errors_are_not_retried_without_the_cache(gemini):
+    chat = workflow.new_follow_up_chat("Idea")
+    gemini.errors.append("⚠️ API Request Error: 429 Client Error: Too Many Requests. Please check your API key and network connection.")
+    assert _ask(chat, "First?") == "Error answering question."
+    assert len(gemini.requests) == 1
+    assert chat["context_cache"] == "cachedContents/1" and chat["contents"] == []
+
+def test_compaction_keeps_a_summary_that_mentions_a_warning(monkeypatch):
+    chat = workflow.new_follow_up_chat("Idea")
+    chat["contents"] = [{"role": role, "parts": [{"text": "text"}]} for role in ["user", "model"] * (workflow.CHAT_RECENT_EXCHANGES + 1)]
+    monkeypatch.setattr(workflow, "query_model", lambda prompt: "The user asked about hazards (⚠️ flammable).")
+    workflow._compact_follow_up_chat(chat)
+    assert chat["summary"] == "The user asked about hazards (⚠️ flammable)."
+    assert len(chat["contents"]) == 2 * workflow.CHAT_RECENT_EXCHANGES
+
+def test_chat_turns_are_fitted_into_their_budget():
+    history = [
+        {"role": "user", "parts": [{"text": "old question " * 400}]},
+        {"role": "model", "parts": [{"text": "old answer " * 400}]},
+        {"role": "user", "parts": [{"text": "Recent question?"}]},
+        {"role": "model", "parts": [{"text": "Recent answer."}]},
+    ]
+    turns = format_follow_up_chat_turns(history, "New question?", "Earlier we discussed PET.", budget=1500)
+    texts = [turn["parts"][0]["text"] for turn in turns]
+    assert [turn["role"] for turn in turns] == ["user", "model", "user", "model", "user", "model", "user"]
+    assert texts[0].endswith("Earlier we discussed PET.")
+    assert texts[-3:] == ["Recent question?", "Recent answer.", "New question?"]
+    assert "truncated" in texts[3] # The oldest turn is shortened first
@@ -0,0 +1,108 @@
+# test_gemini_scheduler.py
+import threading
+import time
+
+import pytest
+
+from gemini_scheduler import (
+    ModelCallScheduler, TokenBucket, request_priority,
+    PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_BATCH,
+)
+from tracing import set_trace_session
+
+class Clock:
+    """Monotonic clock the test advances by hand."""
+    def __init__(self):
+        self.now = 1000.0
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+def test_token_bucket_refills_at_its_rate_up_to_capacity(clock):
+    bucket = TokenBucket(120, clock) # 2 per second
+    bucket.available = 0
+    assert bucket.seconds_until(10) == 5
+    clock.now += 3
+    bucket.refill(clock())
+    assert bucket.available == 6 and bucket.seconds_until(10) == 2
+    clock.now += 3600
+    bucket.refill(clock())
+    assert bucket.available == 120
+
+def test_calls_wait_for_the_token_bucket_to_refill(clock):
+    scheduler = ModelCallScheduler(1000, 600, clock) # 10 tokens per second
+    assert scheduler.acquire(600, timeout=0) == 0
+    assert scheduler.acquire(300, timeout=0) is None
+    clock.now += 29
+    assert scheduler.acquire(300, timeout=0) is None
+    clock.now += 1
+    assert scheduler.acquire(300, timeout=0) == 0
+    scheduler.settle(300, 100) # The unused 200 tokens come back
+    assert scheduler.acquire(200, timeout=0) == 0
+    assert scheduler.metrics()["timed_out"] == 2
+
+def test_throttling_empties_the_buckets(clock):
+    scheduler = ModelCallScheduler(60, 1000, clock)
+    scheduler.throttled()
+    assert scheduler.acquire(1, timeout=0) is None
+    clock.now += 1
+    assert scheduler.acquire(1, timeout=0) == 0
+
+def _admission_order(scheduler, clock, calls):
+    """
+    Queues `calls` ((name, session, priority), in that arrival order) behind an empty request
+    bucket, then lets one request in at a time. Returns the names in the order admitted.
+    """
+    admitted = []
+    def call(name, session, priority):
+        set_trace_session(session)
+        with request_priority(priority):
+            assert scheduler.acquire(1, timeout=3600) is not None
+        admitted.append(name)
+
+    threads = []
+    for name, session, priority in calls:
+        thread = threading.Thread(target=call, args=(name, session, priority), daemon=True)
+        thread.start()
+        threads.append(thread)
+        _wait_for(lambda: scheduler.metrics()["queued"] == len(threads))
+    for count in range(1, len(calls) + 1):
+        clock.now += 60 # One request refills
+        scheduler.settle(0, 0) # Wakes the waiters to look at the clock again
+        _wait_for(lambda: len(admitted) == count)
+    for thread in threads:
+        thread.join(timeout=5)
+    return admitted
+
+def _wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+def test_waiting_calls_are_admitted_by_priority(clock):
+    scheduler = ModelCallScheduler(1, 1_000_000, clock)
+    assert scheduler.acquire(1, timeout=0) == 0 # Empties the request bucket
+    order = _admission_order(scheduler, clock, [
+        ("batch", "a", PRIORITY_BATCH),
+        ("background", "b", PRIORITY_BACKGROUND),
+        ("interactive", "c", PRIORITY_INTERACTIVE),
+    ])
+    assert order == ["interactive", "background", "batch"]
+    assert scheduler.metrics()["admitted"] == {"interactive": 2, "background": 1, "batch": 1}
+
+def test_sessions_take_turns_within_a_priority(clock):
+    scheduler = ModelCallScheduler(1, 1_000_000, clock)
+    assert scheduler.acquire(1, timeout=0) == 0
+    order = _admission_order(scheduler, clock, [
+        ("a1", "a", PRIORITY_INTERACTIVE),
+        ("a2", "a", PRIORITY_INTERACTIVE),
+        ("a3", "a", PRIORITY_INTERACTIVE),
+        ("b1", "b", PRIORITY_INTERACTIVE),
+        ("c1", "c", PRIORITY_INTERACTIVE),
+    ])
+    # Session a's burst doesn't hold back the sessions that arrived after it
+    assert order == ["a1", "b1", "c1", "a2", "a3"]
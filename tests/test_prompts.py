@@ -0,0 +1,71 @@
+# test_prompts.py
+import pytest
+
+import prompts
+from prompts import PRIORITY_USER_INPUT, PRIORITY_STAGE_OUTPUT, PRIORITY_PAPER_CONTEXT
+
+@pytest.fixture
+def warnings(monkeypatch):
+    """Even shares and no instruction reserve, so budgets are easy to work out; collects the warnings."""
+    monkeypatch.setattr(prompts, "INSTRUCTION_TOKEN_RESERVE", 0)
+    monkeypatch.setattr(prompts, "PROMPT_BUDGET_SHARES", {
+        PRIORITY_USER_INPUT: 0.2, PRIORITY_STAGE_OUTPUT: 0.4, PRIORITY_PAPER_CONTEXT: 0.4,
+    })
+    collected = []
+    monkeypatch.setattr(prompts, "report_warning", collected.append)
+    return collected
+
+def text(tokens):
+    return "x" * (tokens * prompts.CHARS_PER_TOKEN)
+
+def tokens(fitted):
+    """Tokens kept from each section, leaving out the truncation marker."""
+    return [prompts.estimate_tokens(section.split("\n[... truncated")[0]) for section in fitted]
+
+def test_sections_within_budget_are_unchanged(warnings):
+    sections = [("input", text(10), PRIORITY_USER_INPUT), ("paper", text(10), PRIORITY_PAPER_CONTEXT), ("none", None, PRIORITY_STAGE_OUTPUT)]
+    assert prompts.fit_prompt_sections("test", sections, budget=100) == [text(10), text(10), None]
+    assert warnings == []
+
+def test_each_category_keeps_its_share(warnings):
+    fitted = prompts.fit_prompt_sections("test", [
+        ("input", text(500), PRIORITY_USER_INPUT),
+        ("summary", text(500), PRIORITY_STAGE_OUTPUT),
+        ("paper", text(500), PRIORITY_PAPER_CONTEXT),
+    ], budget=1000)
+    # A long user input no longer starves the earlier outputs and the paper text
+    assert tokens(fitted) == [200, 400, 400]
+    assert len(warnings) == 3
+
+def test_unused_share_goes_to_categories_in_priority_order(warnings):
+    fitted = prompts.fit_prompt_sections("test", [
+        ("input", text(100), PRIORITY_USER_INPUT),
+        ("summary", text(700), PRIORITY_STAGE_OUTPUT),
+        ("paper", text(700), PRIORITY_PAPER_CONTEXT),
+    ], budget=1000)
+    # The 100 tokens the user input leaves unused go to the earlier outputs before the paper text
+    assert tokens(fitted) == [100, 500, 400]
+    assert [w.split(" was")[0] for w in warnings] == ["The summary", "The paper"]
+
+def test_paper_context_is_shortened_before_stage_outputs_it_does_not_need(warnings):
+    fitted = prompts.fit_prompt_sections("test", [
+        ("summary", text(100), PRIORITY_STAGE_OUTPUT),
+        ("paper", text(2000), PRIORITY_PAPER_CONTEXT),
+    ], budget=1000)
+    assert tokens(fitted) == [100, 900]
+
+def test_sections_in_a_category_are_granted_budget_in_order(warnings):
+    fitted = prompts.fit_prompt_sections("test", [
+        ("newest turn", text(300), PRIORITY_STAGE_OUTPUT),
+        ("older turn", text(300), PRIORITY_STAGE_OUTPUT),
+        ("oldest turn", text(300), PRIORITY_STAGE_OUTPUT),
+    ], budget=500)
+    assert tokens(fitted) == [300, 200, 0]
+
+def test_batch_refinement_shortens_the_ideas_and_warns_when_still_over_budget(warnings, monkeypatch):
+    monkeypatch.setattr(prompts, "PROMPT_TOKEN_BUDGET", 1000)
+    prompt = prompts.format_refine_ideas_batch_prompt([text(2000), text(2000)], "more detail", "topic", "goal", "data")
+    assert text(2000) not in prompt
+    assert any(w.startswith("The idea 2 to refine was shortened") for w in warnings)
+    # The fixed instructions alone take some tokens, so with no reserve the prompt ends up over budget
+    assert any("over its budget" in w for w in warnings)
@@ -0,0 +1,52 @@
+# test_session_store.py
+import pytest
+
+import session_store
+from session_store import SessionStore, SQLiteSessionStore, encode_session_state, decode_session_state
+
+@pytest.fixture
+def clock(monkeypatch):
+    class Clock:
+        now = 1_000_000.0
+    monkeypatch.setattr(session_store.time, "time", lambda: Clock.now)
+    return Clock
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return SQLiteSessionStore(str(tmp_path / "sessions.db"))
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+    class Incomplete(SessionStore):
+        def save(self, session_id, checkpoint, stage):
+            pass
+    with pytest.raises(TypeError):
+        Incomplete()
+
+def test_checkpoint_round_trip_keeps_bytes(store):
+    state = {"stage": "properties_prediction", "ideas": ["Idea 1", "Idea 2"], "images": {"acetone": b"\x89PNG\r\n\x00\xff"}}
+    store.save("session-1", encode_session_state(state), state["stage"])
+    assert decode_session_state(store.load("session-1")) == state
+    assert store.load("session-2") is None
+
+def test_save_replaces_and_delete_removes(store):
+    store.save("session-1", encode_session_state({"stage": "input_details"}), "input_details")
+    store.save("session-1", encode_session_state({"stage": "review_ideas"}), "review_ideas")
+    assert decode_session_state(store.load("session-1")) == {"stage": "review_ideas"}
+    store.delete("session-1")
+    assert store.load("session-1") is None
+
+def test_checkpoints_expire_after_the_ttl(store, clock):
+    store.save("old", encode_session_state({}), None)
+    clock.now += session_store.SESSION_TTL_SECONDS - 1
+    store.save("recent", encode_session_state({}), None)
+    assert store.load("old") == "{}"
+    clock.now += 2
+    assert store.load("old") is None
+    assert store.load("recent") == "{}"
+    # Reopening the store purges the expired rows
+    SQLiteSessionStore(store.database_file)
+    conn = store._connect()
+    assert [row[0] for row in conn.execute("SELECT session_id FROM session_checkpoints")] == ["recent"]
+    conn.close()
@@ -0,0 +1,193 @@
+# tracing.py
+"""
+Lightweight timed spans for finding out where a slow step spends its time.
+
+    with span("pdf.extract", file=name) as attributes:
+        ...
+        attributes["pages"] = page_count
+
+Spans nest through a context variable, so a Gemini call made inside a workflow stage becomes a
+child of that stage. Work handed to a thread pool keeps its parent when the callable is wrapped
+with propagate(). Finished traces are appended to TRACE_FILE (one span per line), which is rotated
+once it reaches TRACE_FILE_MAX_MB, and the most recent ones are kept in memory per session for
+the performance panel.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+TRACE_FILE = os.environ.get("TRACE_FILE", "data/traces.jsonl") # Empty keeps traces in memory only
+TRACING_ENABLED = os.environ.get("TRACING_ENABLED", "1") != "0"
+# Like logging's RotatingFileHandler: a full file becomes TRACE_FILE.1, the previous .1 becomes .2 and so on
+TRACE_FILE_MAX_MB = float(os.environ.get("TRACE_FILE_MAX_MB", "50"))
+TRACE_FILE_BACKUPS = int(os.environ.get("TRACE_FILE_BACKUPS", "3"))
+
+TRACES_PER_SESSION = 20 # Recent traces kept in memory for each session
+MAX_TRACED_SESSIONS = 100 # Sessions whose traces are kept; the least recently active are dropped
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_trace_session = contextvars.ContextVar("trace_session", default=None)
+
+_lock = threading.Lock()
+_open_spans = {} # trace_id -> number of spans still running
+_pending_spans = {} # trace_id -> finished spans not yet written
+_recent_traces = OrderedDict() # session -> OrderedDict(trace_id -> [span, ...])
+
+
+def set_trace_session(session_id):
+    """
+    Attributes spans started from now on in this context (and threads it propagates to) to a session.
+    """
+    _trace_session.set(session_id)
+
+
+def get_trace_session():
+    """
+    Returns the session spans in this context are attributed to, or None outside a session.
+    """
+    return _trace_session.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """
+    Times the enclosed block as a span. Yields the span's attribute dict, which the block may add to.
+    """
+    if not TRACING_ENABLED:
+        yield {}
+        return
+
+    parent = _current_span.get()
+    record = {
+        "trace_id": parent["trace_id"] if parent else uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex[:16],
+        "parent_id": parent["span_id"] if parent else None,
+        "name": name,
+        "session": _trace_session.get(),
+        "thread": threading.current_thread().name,
+        "start": time.time(),
+        "attributes": dict(attributes),
+    }
+    with _lock:
+        _open_spans[record["trace_id"]] = _open_spans.get(record["trace_id"], 0) + 1
+
+    token = _current_span.set(record)
+    started = time.perf_counter()
+    try:
+        yield record["attributes"]
+    except Exception as e: # Not BaseException: Streamlit's st.rerun() and st.stop() are not failures
+        record["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        _current_span.reset(token)
+        _finish_span(record)
+
+
+def traced(name, **attributes):
+    """
+    Decorator form of span() for whole functions.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name, **attributes):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**attributes):
+    """
+    Adds attributes to the innermost running span, if any.
+    """
+    record = _current_span.get()
+    if record is not None:
+        record["attributes"].update(attributes)
+
+
+def propagate(fn):
+    """
+    Wraps a callable so that, when run on another thread, its spans are children of the span
+    that is current here and keep this context's session.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run_in_context(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so every call gets its own copy
+        return context.copy().run(fn, *args, **kwargs)
+    return run_in_context
+
+
+def _finish_span(record):
+    trace_id = record["trace_id"]
+    with _lock:
+        _pending_spans.setdefault(trace_id, []).append(record)
+        _open_spans[trace_id] -= 1
+        if _open_spans[trace_id] > 0:
+            return
+        # Spans started later from background work of this trace are written as a later batch
+        del _open_spans[trace_id]
+        finished = _pending_spans.pop(trace_id)
+        _remember(finished)
+    _export(finished)
+
+
+def _remember(spans):
+    session = spans[0]["session"]
+    traces = _recent_traces.pop(session, None) or OrderedDict()
+    _recent_traces[session] = traces
+    traces.setdefault(spans[0]["trace_id"], []).extend(spans)
+    traces.move_to_end(spans[0]["trace_id"])
+    while len(traces) > TRACES_PER_SESSION:
+        traces.popitem(last=False)
+    while len(_recent_traces) > MAX_TRACED_SESSIONS:
+        _recent_traces.popitem(last=False)
+
+
+def _rotate_trace_file():
+    # Caller holds _lock
+    for index in range(TRACE_FILE_BACKUPS - 1, 0, -1):
+        if os.path.exists(f"{TRACE_FILE}.{index}"):
+            os.replace(f"{TRACE_FILE}.{index}", f"{TRACE_FILE}.{index + 1}")
+    if TRACE_FILE_BACKUPS > 0:
+        os.replace(TRACE_FILE, f"{TRACE_FILE}.1")
+    else:
+        os.remove(TRACE_FILE)
+
+
+def _export(spans):
+    if not TRACE_FILE:
+        return
+    try:
+        os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in spans)
+        with _lock:
+            try:
+                if os.path.getsize(TRACE_FILE) + len(lines) > TRACE_FILE_MAX_MB * 1024 * 1024:
+                    _rotate_trace_file()
+            except FileNotFoundError:
+                pass
+            with open(TRACE_FILE, "a", encoding="utf-8") as f:
+                f.write(lines)
+    except OSError as e:
+        logger.warning(f"Could not write traces to {TRACE_FILE}: {e}")
+
+
+def get_recent_traces(session_id, limit=TRACES_PER_SESSION):
+    """
+    Returns the session's most recent traces, newest first, each a list of spans ordered by start.
+    """
+    with _lock:
+        traces = list((_recent_traces.get(session_id) or {}).values())
+    return [sorted(spans, key=lambda record: record["start"]) for spans in reversed(traces[-limit:])]
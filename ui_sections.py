@@ -1,23 +1,184 @@
 # ui_sections.py
 import streamlit as st
 from urllib.parse import quote # For encoding URLs in chemical lookup
-import re # For parsing ideas
-import io # For handling file downloads (BytesIO)
-from docx import Document # New import for DOCX generation
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+from exports import EXPORT_FORMATS, export_document
 
 # Import functions from other modules that UI sections need
 from workflow import (
     generate_research_ideas_from_ai,
     refine_single_idea_from_ai,
-    answer_follow_up_question_from_ai,
+    refine_ideas_batch_from_ai,
+    new_follow_up_chat,
+    ask_follow_up_chat,
     suggest_search_queries_from_ai,
     generate_literature_summary_from_ai,
-    generate_properties_from_ai,
-    compile_final_response_from_ai,
-    perform_chemical_lookup
+    start_chemical_lookup,
+    ChemicalLookupCancelled,
+    prefetch_chemical_structures,
+    PIPELINE_STAGES,
+    stage_inputs,
+    is_stage_current,
+    record_stage_result,
+    invalidate_stage
 )
 from database import load_search_history, save_search_history, delete_search_history_entry, clear_all_search_history
 from pdf_processor import extract_text_from_pdf, get_combined_uploaded_text
+from image_store import is_image_bytes
+from chemical_cache import get_chemical_cache_stats
+from compound_dictionary import suggest_compounds
+from chemical_entities import extract_chemical_entities
+from job_service import JOB_SERVICE_URL, JOB_KINDS, JobServiceError, submit_remote_job, fetch_remote_job, cancel_remote_job
+from reporting import report_error, report_warning
+from tracing import get_recent_traces, TRACES_PER_SESSION
+from gemini_scheduler import get_scheduler_metrics
+from session_state_manager import start_new_session
+from session_memory import restore_evicted_state, get_memory_report, evict_idle_sessions
+from stage_scheduler import (
+    start_stage,
+    get_stage_result,
+    discard_stage,
+    has_stage_job,
+    speculate_stage,
+    discard_speculation,
+    SPECULATION_BUDGET_PER_SESSION
+)
+
+logger = logging.getLogger(__name__)
+
+JOB_POLL_SECONDS = 1.0 # How often a page waiting on the job service checks back
+LOOKUP_POLL_SECONDS = 0.5 # How often the lookup panel refreshes while a chemical lookup runs
+
+# The performance panel is shown with PERFORMANCE_PANEL=1 or by opening the app with ?debug=traces
+PERFORMANCE_PANEL_ENABLED = os.environ.get("PERFORMANCE_PANEL") == "1"
+# The memory panel lists every session on the server, so it needs MEMORY_PANEL=1 and ?debug=memory
+MEMORY_PANEL_ENABLED = os.environ.get("MEMORY_PANEL") == "1"
+
+
+def _session_fragment(fn, run_every=None):
+    """
+    st.fragment for panels that read session state. Fragment reruns skip the top of the script,
+    so values evicted while the session was idle are brought back here.
+    """
+    @functools.wraps(fn)
+    def run_fragment(*args, **kwargs):
+        restore_evicted_state()
+        return fn(*args, **kwargs)
+    return st.fragment(run_fragment, run_every=run_every)
+
+
+def _ensure_stage(stage_name, spinner_text):
+    """
+    Makes sure a pipeline stage's result matches its current inputs, reusing a background job
+    when one was started for them. Returns True if the stage had to be (re)computed.
+    """
+    if is_stage_current(stage_name, st.session_state):
+        return False
+    inputs = stage_inputs(stage_name, st.session_state)
+    if JOB_SERVICE_URL and stage_name in JOB_KINDS and not has_stage_job(stage_name, *inputs):
+        params = dict(zip(PIPELINE_STAGES[stage_name]['inputs'], inputs))
+        result = _await_job(stage_name, params, spinner_text, cancel_stage=_PREVIOUS_STAGE[stage_name])
+    else:
+        with st.spinner(spinner_text):
+            result = get_stage_result(stage_name, PIPELINE_STAGES[stage_name]['run'], *inputs)
+    record_stage_result(stage_name, st.session_state, result, inputs)
+    return True
+
+
+# Where "Cancel" on a pending job sends the user, since staying would just resubmit it
+_PREVIOUS_STAGE = {
+    'research_ideas': 'input_details',
+    'literature_summary': 'review_ideas',
+    'final_response': 'properties_prediction',
+}
+
+
+def _forget_job(kind):
+    st.session_state.active_jobs.pop(kind, None)
+    st.query_params.pop(f"job_{kind}", None)
+
+
+def _await_job(kind, params, status_text, cancel_stage):
+    """
+    Runs a generation through the job service instead of blocking this script run.
+    The job is submitted once; its id is also kept in the URL so a browser refresh picks the
+    same job up again. Returns the job's result once it is done. While it is pending, a status
+    panel polls it every JOB_POLL_SECONDS without rerunning the page, and the rest of this
+    script run is skipped. If the service can't be reached, the generation runs inline instead.
+    A job that failed or was cancelled is kept, so later reruns show the error and a Retry
+    button (and return None) instead of submitting it again.
+    """
+    fingerprint = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8")).hexdigest()
+    job = st.session_state.active_jobs.get(kind)
+    if job is None and st.query_params.get(f"job_{kind}"):
+        job = {'id': st.query_params[f"job_{kind}"], 'fingerprint': fingerprint}
+    if job and job.get('failed') and job['fingerprint'] == fingerprint:
+        st.error(job['failed'])
+        _job_retry_button(kind)
+        return None
+    try:
+        if job is None or job['fingerprint'] != fingerprint:
+            job = {'id': submit_remote_job(kind, params), 'fingerprint': fingerprint}
+        st.session_state.active_jobs[kind] = job
+        st.query_params[f"job_{kind}"] = job['id']
+        status = fetch_remote_job(job['id'])
+    except JobServiceError as e:
+        _forget_job(kind)
+        report_warning(f"⚠️ Job service unavailable ({e}); generating here instead.")
+        with st.spinner(status_text):
+            return JOB_KINDS[kind](params)
+
+    if status and status['status'] in ('queued', 'running'):
+        _session_fragment(_job_status_panel, run_every=JOB_POLL_SECONDS)(kind, job['id'], status_text, cancel_stage)
+        st.stop() # The rest of the page needs the result; the panel reruns the page once it is in
+
+    if status and status['status'] == 'done':
+        _forget_job(kind)
+        return status['result']
+    reason = (status.get('error') or f"job {status['status']}") if status else "job not found"
+    job['failed'] = f"⚠️ Error: background job failed: {reason}"
+    report_error(job['failed'])
+    _job_retry_button(kind)
+    return None
+
+
+def _job_retry_button(kind):
+    if st.button("🔄 Retry", key=f"retry_job_{kind}"):
+        _forget_job(kind)
+        st.session_state.active_jobs[kind] = None # Submitted again by the rerun
+        st.rerun()
+
+
+def _job_status_panel(kind, job_id, status_text, cancel_stage):
+    """Body of the pending-job panel; see _await_job()."""
+    try:
+        status = fetch_remote_job(job_id)
+    except JobServiceError:
+        status = None
+    if not status or status['status'] not in ('queued', 'running'):
+        st.rerun() # Done, failed or unreachable: the full run collects the result or reports it
+
+    st.info(f"⏳ {status_text} (job {status['status']}; you can keep using the page)")
+    if st.button("✖️ Cancel", key=f"cancel_job_{kind}"):
+        try:
+            cancel_remote_job(job_id)
+        except JobServiceError as e:
+            report_warning(f"⚠️ Could not cancel job {job_id}: {e}")
+        _forget_job(kind)
+        st.session_state.stage = cancel_stage
+        st.rerun()
+
+
+def _set_generated_ideas(ideas):
+    st.session_state.ideas = ideas
+    st.session_state.idea_index = 0
+    if st.session_state.ideas:
+        st.session_state.stage = 'review_ideas'
 
 
 def render_input_details_stage():
@@ -116,16 +277,17 @@ def render_input_details_stage():
             if not topic or not goal or not data:
                 st.warning("Please fill in all fields to generate research ideas.")
             else:
-                with st.spinner("Generating ideas... This might take a moment."):
-                    # Store current inputs in session state for refinement context
-                    st.session_state.current_topic = topic
-                    st.session_state.current_goal = goal
-                    st.session_state.current_data = data
-                    save_search_history(topic, goal, data)
-                    st.session_state.ideas = generate_research_ideas_from_ai(topic, goal, data)
-                    st.session_state.idea_index = 0
-                    if st.session_state.ideas:
-                        st.session_state.stage = 'review_ideas'
+                # Store current inputs in session state for refinement context
+                st.session_state.current_topic = topic
+                st.session_state.current_goal = goal
+                st.session_state.current_data = data
+                save_search_history(topic, goal, data)
+                discard_speculation() # Summaries prepared for the previous ideas are no longer needed
+                if JOB_SERVICE_URL:
+                    st.session_state.active_jobs['research_ideas'] = None # Submitted below, then polled on later reruns
+                else:
+                    with st.spinner("Generating ideas... This might take a moment."):
+                        _set_generated_ideas(generate_research_ideas_from_ai(topic, goal, data))
                     st.rerun()
     with col_buttons[1]:
         if st.session_state.search_history_data:
@@ -134,21 +296,82 @@ def render_input_details_stage():
                 st.success("All search history cleared!")
                 st.rerun()
 
+    if 'research_ideas' in st.session_state.active_jobs or st.query_params.get("job_research_ideas"):
+        ideas = _await_job(
+            'research_ideas',
+            {
+                'topic': st.session_state.current_topic,
+                'goal': st.session_state.current_goal,
+                'data': st.session_state.current_data,
+                'uploaded_text': get_combined_uploaded_text(),
+            },
+            "Generating ideas...",
+            cancel_stage=_PREVIOUS_STAGE['research_ideas']
+        )
+        if ideas is not None: # None: the job failed and its error and Retry button are shown
+            _set_generated_ideas(ideas)
+            st.rerun()
+
     if st.session_state.search_history_data:
-        st.markdown("---")
-        st.subheader("Manage Individual History Entries")
-        for entry in st.session_state.search_history_data:
-            col_entry_display, col_entry_delete = st.columns([0.8, 0.2])
-            with col_entry_display:
-                st.markdown(f"**{entry['timestamp']}** - {entry['topic']}")
-                with st.expander("Details"):
-                    st.write(f"**Goal:** {entry['goal']}")
-                    st.write(f"**Data:** {entry['data']}")
-            with col_entry_delete:
-                if st.button("Delete", key=f"delete_history_{entry['id']}"):
-                    delete_search_history_entry(entry['id'])
-                    st.success(f"Entry '{entry['topic']}' deleted.")
-                    st.rerun()
+        _render_history_management()
+
+
+@_session_fragment
+def _render_history_management():
+    """
+    Lists saved searches with a delete button each. Deleting only reruns this panel;
+    the history dropdown above picks the change up on the next full rerun.
+    """
+    st.markdown("---")
+    st.subheader("Manage Individual History Entries")
+    for entry in st.session_state.search_history_data:
+        col_entry_display, col_entry_delete = st.columns([0.8, 0.2])
+        with col_entry_display:
+            st.markdown(f"**{entry['timestamp']}** - {entry['topic']}")
+            with st.expander("Details"):
+                st.write(f"**Goal:** {entry['goal']}")
+                st.write(f"**Data:** {entry['data']}")
+        with col_entry_delete:
+            st.button("Delete", key=f"delete_history_{entry['id']}", on_click=_delete_history_entry, args=(entry['id'],))
+
+
+def _delete_history_entry(entry_id):
+    """Button callback: deletes a saved search before the history panel reruns."""
+    delete_search_history_entry(entry_id)
+    st.session_state.search_history_data = [
+        entry for entry in st.session_state.search_history_data if entry['id'] != entry_id
+    ]
+
+
+def _speculate_literature_summaries():
+    """
+    Optionally prepares literature summaries for the idea on screen (and the next one) in the
+    background, so approving an idea doesn't wait for the summary.
+    """
+    with st.expander("⚡ Background preparation"):
+        st.session_state.speculative_prefetch_enabled = st.checkbox(
+            "Prepare the literature summary while I review this idea",
+            value=st.session_state.speculative_prefetch_enabled,
+            key="speculative_prefetch_checkbox"
+        )
+        st.session_state.speculate_next_idea = st.checkbox(
+            "Also prepare the next idea's summary",
+            value=st.session_state.speculate_next_idea,
+            disabled=not st.session_state.speculative_prefetch_enabled,
+            key="speculate_next_idea_checkbox"
+        )
+        st.caption(
+            f"Uses up to {SPECULATION_BUDGET_PER_SESSION} extra AI calls per session "
+            f"({st.session_state.speculation_used} used)."
+        )
+
+    if not st.session_state.speculative_prefetch_enabled:
+        return
+    count = 2 if st.session_state.speculate_next_idea else 1
+    upcoming = st.session_state.ideas[st.session_state.idea_index:st.session_state.idea_index + count]
+    uploaded_text_context = get_combined_uploaded_text()
+    for upcoming_idea in upcoming:
+        speculate_stage('literature_summary', generate_literature_summary_from_ai, upcoming_idea, uploaded_text_context)
 
 
 def render_review_ideas_stage():
@@ -159,13 +382,25 @@ def render_review_ideas_stage():
         idea = st.session_state.ideas[st.session_state.idea_index]
         st.markdown(f"**Idea:** {idea}")
 
+        _speculate_literature_summaries()
+
         st.markdown("---")
         st.subheader("Refine This Idea?")
         refinement_feedback = st.text_area(
             "Provide feedback to refine this idea (e.g., 'Make it more specific to polymers', 'Suggest alternative synthesis methods'):",
             key="refinement_feedback"
         )
-        if st.button("🔄 Refine Current Idea"):
+        remaining_count = len(st.session_state.ideas) - st.session_state.idea_index
+        refine_col1, refine_col2 = st.columns(2)
+        with refine_col1:
+            refine_current = st.button("🔄 Refine Current Idea")
+        with refine_col2:
+            refine_remaining = st.button(
+                f"🔁 Refine All {remaining_count} Remaining Ideas",
+                disabled=remaining_count < 2,
+                help="Applies the same feedback to this idea and every idea after it in one request."
+            )
+        if refine_current:
             if refinement_feedback.strip():
                 with st.spinner("Refining idea..."):
                     refined_idea = refine_single_idea_from_ai(
@@ -180,12 +415,35 @@ def render_review_ideas_stage():
                     st.rerun()
             else:
                 st.warning("Please enter feedback to refine the idea.")
+        if refine_remaining:
+            if refinement_feedback.strip():
+                with st.spinner(f"Refining {remaining_count} ideas..."):
+                    refined_ideas = refine_ideas_batch_from_ai(
+                        st.session_state.ideas[st.session_state.idea_index:],
+                        refinement_feedback=refinement_feedback,
+                        topic=st.session_state.current_topic,
+                        goal=st.session_state.current_goal,
+                        data=st.session_state.current_data
+                    )
+                    # Merge in place so reviewed ideas and the current position are kept
+                    st.session_state.ideas[st.session_state.idea_index:] = refined_ideas
+                    st.success(f"{len(refined_ideas)} ideas refined!")
+                    st.rerun()
+            else:
+                st.warning("Please enter feedback to refine the ideas.")
         st.markdown("---")
 
         col1, col2 = st.columns(2)
         with col1:
             if st.button("👍 Approve Idea"):
                 st.session_state.approved_idea = idea
+                # Summary and properties only depend on the idea, so start both right away;
+                # the properties are ready by the time the summary has been reviewed
+                for stage_name in ('literature_summary', 'properties'):
+                    if JOB_SERVICE_URL and stage_name in JOB_KINDS:
+                        continue # Submitted to the job service when its page renders
+                    if not is_stage_current(stage_name, st.session_state):
+                        start_stage(stage_name, PIPELINE_STAGES[stage_name]['run'], *stage_inputs(stage_name, st.session_state))
                 st.session_state.stage = 'literature_summary'
                 st.rerun()
         with col2:
@@ -200,14 +458,79 @@ def render_review_ideas_stage():
         st.session_state.stage = 'input_details'
 
 
+def _render_export_buttons(label, title, body, file_stem):
+    """
+    Renders one download button per export format. The file is only built when its button
+    is clicked, and identical content is served from the export cache.
+    """
+    columns = st.columns(len(EXPORT_FORMATS))
+    for column, (export_format, (format_label, extension, mime)) in zip(columns, EXPORT_FORMATS.items()):
+        with column:
+            st.download_button(
+                label=f"Download {label} as {format_label}",
+                data=lambda export_format=export_format: export_document(export_format, title, body),
+                file_name=f"{file_stem}.{extension}",
+                mime=mime,
+                key=f"download_{file_stem}_{export_format}"
+            )
+
+
+@_session_fragment
+def _render_follow_up_chat(key_suffix):
+    """
+    Renders the follow-up chat. One conversation is kept per approved idea and carried
+    across the summary and properties steps. Asking a question only reruns this panel.
+    """
+    chat = st.session_state.follow_up_chat
+    if chat is None or chat["approved_idea"] != st.session_state.approved_idea:
+        chat = st.session_state.follow_up_chat = new_follow_up_chat(st.session_state.approved_idea)
+
+    st.markdown("---")
+    st.subheader("Ask a Follow-up Question (AI)")
+    # Filled in last, so a question asked in this run already shows with its answer
+    conversation = st.container()
+
+    # The form empties the input box once a question has been sent
+    with st.form(key=f"follow_up_form_{key_suffix}", clear_on_submit=True):
+        st.session_state.follow_up_question = st.text_input(
+            "Your question:",
+            value=st.session_state.follow_up_question,
+            key=f"follow_up_question_input_{key_suffix}"
+        )
+        asked = st.form_submit_button("Ask AI")
+    if asked:
+        if st.session_state.follow_up_question.strip():
+            with st.spinner("Getting AI's answer..."):
+                ask_follow_up_chat(
+                    chat,
+                    st.session_state.approved_idea,
+                    st.session_state.literature_summary,
+                    st.session_state.properties, # None until the properties step has run
+                    st.session_state.follow_up_question
+                )
+            st.session_state.follow_up_question = ""
+        else:
+            st.warning("Please enter a question.")
+    if chat["contents"] and st.button("Clear Conversation", key=f"clear_chat_{key_suffix}_button"):
+        chat = st.session_state.follow_up_chat = new_follow_up_chat(st.session_state.approved_idea)
+
+    with conversation:
+        if chat["summary"]:
+            with st.expander("Earlier conversation (summarized)"):
+                st.write(chat["summary"])
+        for turn in chat["contents"]:
+            if turn["role"] == "user":
+                st.markdown(f"**You:** {turn['parts'][0]['text']}")
+            else:
+                st.info(turn["parts"][0]["text"])
+
+
 def render_literature_summary_stage():
     """Renders the UI for Step 3: Generate Literature Summary."""
     st.subheader("Step 3: Generate Literature Summary")
     st.markdown(f"**Approved Idea:** {st.session_state.approved_idea}")
 
-    if st.session_state.literature_summary is None:
-        with st.spinner("Generating literature summary..."):
-            st.session_state.literature_summary = generate_literature_summary_from_ai(st.session_state.approved_idea)
+    _ensure_stage('literature_summary', "Generating literature summary...")
 
     st.markdown("---")
     st.markdown("**Generated Literature Summary:**")
@@ -218,22 +541,7 @@ def render_literature_summary_stage():
             height=300,
             key="literature_summary_output"
         )
-        # Download as DOCX button
-        doc = Document()
-        doc.add_heading("Literature Summary", level=1)
-        doc.add_paragraph(st.session_state.literature_summary)
-        
-        bio = io.BytesIO()
-        doc.save(bio)
-        bio.seek(0)
-        
-        st.download_button(
-            label="Download Summary as DOCX",
-            data=bio.getvalue(),
-            file_name="literature_summary.docx",
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            key="download_literature_docx"
-        )
+        _render_export_buttons("Summary", "Literature Summary", st.session_state.literature_summary, "literature_summary")
     else:
         st.error(st.session_state.literature_summary if st.session_state.literature_summary else "No summary generated.")
     st.markdown("---")
@@ -244,12 +552,12 @@ def render_literature_summary_stage():
             st.session_state.stage = 'properties_prediction'
             # Reset follow-up question/response and search queries when moving to next stage
             st.session_state.follow_up_question = ""
-            st.session_state.follow_up_response = None
             st.session_state.suggested_search_queries = [] # Reset
             st.rerun()
     with col2:
         if st.button("👎 Disapprove & Re-evaluate Idea"):
-            st.session_state.literature_summary = None
+            # Stages computed for this idea go stale automatically once another idea is approved
+            discard_stage('properties') # Prefetched for the idea that was just rejected
             st.session_state.stage = 'review_ideas'
             st.session_state.idea_index += 1
             if st.session_state.idea_index >= len(st.session_state.ideas):
@@ -257,45 +565,28 @@ def render_literature_summary_stage():
                 st.session_state.stage = 'input_details'
             # Reset follow-up question/response and search queries
             st.session_state.follow_up_question = ""
-            st.session_state.follow_up_response = None
             st.session_state.suggested_search_queries = [] # Reset
             st.rerun()
 
     # --- AI-Driven Follow-up Questions Section ---
-    st.markdown("---")
-    st.subheader("Ask a Follow-up Question (AI)")
-    st.session_state.follow_up_question = st.text_input(
-        "Your question:",
-        value=st.session_state.follow_up_question,
-        key="follow_up_question_input_lit_summary"
-    )
-    if st.button("Ask AI", key="ask_ai_lit_summary_button"):
-        if st.session_state.follow_up_question.strip():
-            with st.spinner("Getting AI's answer..."):
-                st.session_state.follow_up_response = answer_follow_up_question_from_ai(
-                    st.session_state.approved_idea,
-                    st.session_state.literature_summary,
-                    st.session_state.properties, # Pass properties even if not yet generated, it will be None
-                    st.session_state.follow_up_question
-                )
-            st.rerun() # Rerun to display the response
-        else:
-            st.warning("Please enter a question.")
-
-    if st.session_state.follow_up_response:
-        st.markdown("**AI's Answer:**")
-        st.info(st.session_state.follow_up_response)
+    _render_follow_up_chat("lit_summary")
 
     # --- AI-Suggested Search Queries Section ---
+    _render_suggested_queries("suggest_queries_button")
+
+
+@_session_fragment
+def _render_suggested_queries(button_key):
+    """Suggests database search queries for the approved idea. Only reruns this panel."""
     st.markdown("---")
     st.subheader("AI-Suggested Search Queries")
-    if st.button("Suggest Search Queries", key="suggest_queries_button"):
+    if st.button("Suggest Search Queries", key=button_key):
         with st.spinner("Generating search queries..."):
+            # The literature summary is passed even if it's from a previous stage
             st.session_state.suggested_search_queries = suggest_search_queries_from_ai(
                 st.session_state.approved_idea,
                 st.session_state.literature_summary
             )
-        st.rerun() # Rerun to display the queries
 
     if st.session_state.suggested_search_queries:
         st.markdown("Here are some queries you might find useful:")
@@ -309,20 +600,137 @@ def render_literature_summary_stage():
             st.markdown(f"- **{query}** ([PubMed]({pubmed_url}) | [Scopus]({scopus_url}) | [Google Scholar]({google_scholar_url}))")
 
 
-def render_properties_prediction_stage():
-    """Renders the UI for Step 4: Predict Properties / Experimental Approach."""
-    st.subheader("Step 4: Predict Properties / Experimental Approach")
-    st.markdown(f"**Approved Idea:** {st.session_state.approved_idea}")
-
-    if st.session_state.properties is None:
-        with st.spinner("Generating property predictions..."):
-            st.session_state.properties = generate_properties_from_ai(st.session_state.approved_idea)
-
-    st.markdown("---")
-    st.markdown("**Generated Properties/Approach (AI):**")
-    st.markdown(st.session_state.properties)
-    st.markdown("---")
-
+def _start_chemical_lookup(query):
+    """Starts looking up a chemical in the background, replacing any lookup still running."""
+    if st.session_state.chemical_lookup_job is not None:
+        st.session_state.chemical_lookup_job.cancel()
+    st.session_state.chemical_lookup_attempted = False # The previous result is hidden while this one runs
+    st.session_state.chemical_lookup_job = start_chemical_lookup(query)
+
+
+def _collect_chemical_lookup():
+    """
+    Stores the outcome of a finished background lookup in session state for display.
+    Returns True while the lookup is still running.
+    """
+    job = st.session_state.chemical_lookup_job
+    if job is None:
+        return False
+    if job.timed_out():
+        job.cancel()
+    elif not job.done():
+        return True
+    st.session_state.chemical_lookup_job = None
+
+    try:
+        cid, image_url, source, matched_name, image_bytes = job.result()
+    except ChemicalLookupCancelled:
+        # Lookups cancelled from the panel are dropped from session state, so this one timed out
+        st.session_state.chemical_lookup_notice = (
+            f"⏱️ Looking up '{job.query}' took longer than {job.deadline_seconds:.0f} seconds and was stopped."
+        )
+        return False
+    except Exception as e:
+        st.session_state.chemical_lookup_notice = f"⚠️ Error: chemical lookup failed: {e}"
+        return False
+
+    st.session_state.chemical_lookup_attempted = True # Mark that an attempt was made
+    st.session_state.chemical_cid = cid
+    st.session_state.chemical_image_url = image_url
+    st.session_state.chemical_source = source
+    st.session_state.chemical_matched_name = matched_name
+    st.session_state.chemical_image_bytes = image_bytes
+    st.session_state.chemical_lookup_success = bool(image_url)
+    return False
+
+
+_STEP_ICONS = {"running": "⏳", "found": "✅", "not found": "➖", "failed": "⚠️"}
+
+def _render_chemical_lookup_progress(job):
+    """Shows which resolvers a running lookup has tried, with a button to cancel it."""
+    st.info(f"⏳ Looking up '{job.query}'... ({job.seconds_left():.0f}s left; you can keep using the page)")
+    for step, status in job.steps():
+        st.caption(f"{_STEP_ICONS.get(status, '')} {step}: {status}")
+    if st.button("✖️ Cancel Lookup", key="cancel_chemical_lookup"):
+        job.cancel()
+        st.session_state.chemical_lookup_job = None
+        st.rerun() # A full rerun stops the panel's polling
+
+
+def _look_up_suggested_chemical(suggestion):
+    """Button callback for a "did you mean" suggestion: replaces the query and queues its lookup."""
+    st.session_state.chemical_query_input = suggestion
+    # Drop the widget's own state so the text box is re-created showing the suggestion
+    st.session_state.pop("chemical_lookup_input", None)
+    # Looked up in the panel body: a callback inside a fragment must not display anything
+    st.session_state.pending_chemical_lookup = suggestion
+
+
+def _show_structure_image(image_bytes, image_url, caption, **kwargs):
+    """
+    Shows a structure image, preferring the stored bytes. Returns False (showing nothing) if it
+    cannot be displayed, so one bad image never aborts the page.
+    """
+    image = image_bytes if is_image_bytes(image_bytes) else image_url
+    if not image:
+        return False
+    try:
+        st.image(image, caption=caption, **kwargs)
+    except Exception as e:
+        logger.warning(f"Could not display structure image for {caption}: {e}")
+        return False
+    return True
+
+
+@_session_fragment
+def _render_structure_gallery():
+    """Shows the structures of compounds detected in the properties text as they resolve."""
+    st.subheader("Compounds Mentioned")
+    entries = []
+    seen_cids = set()
+    pending = False
+    for name, future in st.session_state.structure_prefetch.items():
+        if not future.done():
+            pending = True
+            entries.append((name, None))
+            continue
+        try:
+            cid, image_url, source, matched_name, image_bytes = future.result()
+        except Exception:
+            continue
+        # Only downloaded images are shown here; a URL the image store rejected is not an image
+        if image_url and is_image_bytes(image_bytes) and (cid is None or cid not in seen_cids):
+            seen_cids.add(cid)
+            entries.append((name, (cid, image_url, source, matched_name, image_bytes)))
+
+    gallery_cols = st.columns(3)
+    for i, (name, result) in enumerate(entries):
+        with gallery_cols[i % 3]:
+            if result is None:
+                st.caption(f"⏳ Resolving {name}...")
+                continue
+            cid, image_url, source, matched_name, image_bytes = result
+            caption = f"{name} (CID {cid})" if cid else name
+            if not _show_structure_image(image_bytes, None, caption):
+                st.caption(f"⚠️ {caption}: structure image could not be shown.")
+
+    if pending:
+        st.button("🔄 Refresh Structures", key="refresh_structure_gallery") # A click reruns just the gallery
+    elif not entries:
+        st.caption("No structures could be resolved for the compounds mentioned above.")
+
+
+def _render_chemical_lookup():
+    """
+    Chemical structure lookup panel. Lookups run in the background; while one is running the
+    panel refreshes itself every LOOKUP_POLL_SECONDS, without rerunning the rest of the page.
+    """
+    polling = _collect_chemical_lookup()
+    _session_fragment(_chemical_lookup_panel, run_every=LOOKUP_POLL_SECONDS if polling else None)()
+
+
+def _chemical_lookup_panel():
+    """Body of the lookup panel; see _render_chemical_lookup()."""
     st.subheader("Chemical Structure Lookup")
     st.session_state.chemical_query_input = st.text_input(
         "Enter Chemical Name or CAS Number:",
@@ -336,40 +744,30 @@ def render_properties_prediction_stage():
     if 'chemical_lookup_success' not in st.session_state:
         st.session_state.chemical_lookup_success = False
 
-    if st.button("🔎 Look Up Chemical Structure"):
-        st.session_state.chemical_lookup_attempted = True # Mark that an attempt was made
-        st.session_state.chemical_lookup_success = False # Assume failure until proven otherwise
-        
-        # Clear previous lookup results before a new attempt
-        st.session_state.chemical_cid = None
-        st.session_state.chemical_image_url = None
-        st.session_state.chemical_source = None
-        st.session_state.chemical_matched_name = None
-        st.session_state.chemical_image_bytes = None
-
+    if st.button("🔎 Look Up Chemical Structure") or st.session_state.pop('pending_chemical_lookup', None):
         if st.session_state.chemical_query_input:
-            with st.spinner(f"Looking up '{st.session_state.chemical_query_input}'..."):
-                cid, image_url, source, matched_name, image_bytes = perform_chemical_lookup(st.session_state.chemical_query_input)
-                
-                st.session_state.chemical_cid = cid
-                st.session_state.chemical_image_url = image_url
-                st.session_state.chemical_source = source
-                st.session_state.chemical_matched_name = matched_name
-                st.session_state.chemical_image_bytes = image_bytes
-
-                if image_url:
-                    st.session_state.chemical_lookup_success = True
-                # No st.rerun() here, allow the rest of the script to execute and display messages
+            _start_chemical_lookup(st.session_state.chemical_query_input)
+            st.rerun() # A full rerun registers the panel with polling
         else:
             st.warning("Please enter a chemical name or CAS number to look up.")
             st.session_state.chemical_lookup_attempted = False # No valid input, so no real attempt
 
+    job = st.session_state.chemical_lookup_job
+    if _collect_chemical_lookup():
+        _render_chemical_lookup_progress(job)
+        return
+    if job is not None:
+        st.rerun() # Finished while polling: a full rerun shows the result and stops the polling
+    if st.session_state.get('chemical_lookup_notice'):
+        st.warning(st.session_state.pop('chemical_lookup_notice'))
+
     # Display chemical lookup results or error/suggestion messages
     if st.session_state.chemical_lookup_attempted:
         if st.session_state.chemical_lookup_success:
             st.markdown("---")
             st.markdown("**Found Chemical Structure:**")
-            st.image(st.session_state.chemical_image_url, caption=f"{st.session_state.chemical_matched_name} (Source: {st.session_state.chemical_source})", use_column_width=True)
+            # Serve the stored bytes so the browser doesn't fetch the structure again
+            _show_structure_image(st.session_state.chemical_image_bytes, st.session_state.chemical_image_url, caption=f"{st.session_state.chemical_matched_name} (Source: {st.session_state.chemical_source})", use_column_width=True)
             if st.session_state.chemical_cid:
                 st.info(f"PubChem CID: {st.session_state.chemical_cid}")
             
@@ -386,7 +784,19 @@ def render_properties_prediction_stage():
         else:
             # Only show this warning/info if a lookup was attempted and failed
             st.warning("🔍 Compound not found in structured chemical databases.")
-            query_encoded = quote(st.session_state.chemical_query_input)
+            suggestions = suggest_compounds(st.session_state.chemical_query_input)
+            if suggestions:
+                st.markdown("**Did you mean:**")
+                suggestion_cols = st.columns(len(suggestions))
+                for col, suggestion in zip(suggestion_cols, suggestions):
+                    with col:
+                        st.button(
+                            suggestion,
+                            key=f"chemical_suggestion_{suggestion}",
+                            on_click=_look_up_suggested_chemical,
+                            args=(suggestion,)
+                        )
+            encoded_query = quote(st.session_state.chemical_query_input)
             pubchem_url = f"https://pubchem.ncbi.nlm.nih.gov/#query={encoded_query}"
             wikidata_url = f"https://www.wikidata.org/w/index.php?search={encoded_query}"
 
@@ -400,84 +810,66 @@ def render_properties_prediction_stage():
                 f"- 🔬 [Search on PubChem]({pubchem_url})\n"
                 f"- 🧠 [Search on Wikidata]({wikidata_url})"
             )
-    
+
+
+def render_properties_prediction_stage():
+    """Renders the UI for Step 4: Predict Properties / Experimental Approach."""
+    st.subheader("Step 4: Predict Properties / Experimental Approach")
+    st.markdown(f"**Approved Idea:** {st.session_state.approved_idea}")
+
+    if _ensure_stage('properties', "Generating property predictions..."):
+        # Resolve the compounds the AI mentioned in the background while the user reads
+        st.session_state.structure_prefetch = prefetch_chemical_structures(
+            extract_chemical_entities(st.session_state.properties)
+        )
+
+    st.markdown("---")
+    st.markdown("**Generated Properties/Approach (AI):**")
+    st.markdown(st.session_state.properties)
+    st.markdown("---")
+
+    if st.session_state.structure_prefetch:
+        _render_structure_gallery()
+        st.markdown("---")
+
+    _render_chemical_lookup()
+
     col1, col2 = st.columns(2)
     with col1:
         if st.button("👍 Approve Properties"):
             st.session_state.stage = 'final_compilation'
             # Reset follow-up question/response and search queries when moving to next stage
             st.session_state.follow_up_question = ""
-            st.session_state.follow_up_response = None
             st.session_state.suggested_search_queries = [] # Reset
             st.rerun()
     with col2:
         if st.button("👎 Disapprove & Re-evaluate Summary"):
-            st.session_state.properties = None
-            st.session_state.literature_summary = None
+            # Only the summary and what is built on it are regenerated; the properties are kept
+            for stage_name in invalidate_stage('literature_summary', st.session_state):
+                discard_stage(stage_name)
             st.session_state.stage = 'literature_summary'
             # Reset follow-up question/response and search queries
             st.session_state.follow_up_question = ""
-            st.session_state.follow_up_response = None
             st.session_state.suggested_search_queries = [] # Reset
             st.rerun()
 
     # --- AI-Driven Follow-up Questions Section ---
-    st.markdown("---")
-    st.subheader("Ask a Follow-up Question (AI)")
-    st.session_state.follow_up_question = st.text_input(
-        "Your question:",
-        value=st.session_state.follow_up_question,
-        key="follow_up_question_input_props_pred"
-    )
-    if st.button("Ask AI", key="ask_ai_props_pred_button"):
-        if st.session_state.follow_up_question.strip():
-            with st.spinner("Getting AI's answer..."):
-                st.session_state.follow_up_response = answer_follow_up_question_from_ai(
-                    st.session_state.approved_idea,
-                    st.session_state.literature_summary,
-                    st.session_state.properties,
-                    st.session_state.follow_up_question
-                )
-            st.rerun() # Rerun to display the response
-        else:
-            st.warning("Please enter a question.")
-
-    if st.session_state.follow_up_response:
-        st.markdown("**AI's Answer:**")
-        st.info(st.session_state.follow_up_response)
+    _render_follow_up_chat("props_pred")
 
     # --- AI-Suggested Search Queries Section ---
-    st.markdown("---")
-    st.subheader("AI-Suggested Search Queries")
-    if st.button("Suggest Search Queries", key="suggest_queries_button_props_pred"):
-        with st.spinner("Generating search queries..."):
-            st.session_state.suggested_search_queries = suggest_search_queries_from_ai(
-                st.session_state.approved_idea,
-                st.session_state.literature_summary # Pass literature summary even if it's from previous stage
-            )
-        st.rerun() # Rerun to display the queries
-
-    if st.session_state.suggested_search_queries:
-        st.markdown("Here are some queries you might find useful:")
-        for i, query in enumerate(st.session_state.suggested_search_queries):
-            # Encode query for URL
-            encoded_query = quote(query)
-            pubmed_url = f"https://pubmed.ncbi.nlm.nih.gov/?term={encoded_query}"
-            scopus_url = f"https://www.scopus.com/results/results.uri?sort=plf-f&src=s&st1={encoded_query}&sid=0a0123456789abcdef0123456789abcdef&sot=b&sdt=b&sl=0&s=TITLE-ABS-KEY%28{encoded_query}%29&origin=resultslist&zone=resultsList"
-            google_scholar_url = f"https://scholar.google.com/scholar?q={encoded_query}"
-
-            st.markdown(f"- **{query}** ([PubMed]({pubmed_url}) | [Scopus]({scopus_url}) | [Google Scholar]({google_scholar_url}))")
+    _render_suggested_queries("suggest_queries_button_props_pred")
 
 
 def render_final_compilation_stage():
     """Renders the UI for Step 5: Final Research Proposal Overview."""
     st.subheader("Step 5: Final Research Proposal Overview")
+    _collect_chemical_lookup() # A lookup still running when the properties were approved shows up here
     st.markdown(f"**Approved Idea:** {st.session_state.approved_idea}")
     st.markdown(f"**Literature Summary:** {st.session_state.literature_summary}")
     st.markdown(f"**Properties/Approach:** {st.session_state.properties}")
     if st.session_state.chemical_image_url:
         st.markdown(f"**Looked Up Chemical:** {st.session_state.chemical_matched_name} (Source: {st.session_state.chemical_source})")
-        st.image(st.session_state.chemical_image_url, caption=f"Structure of {st.session_state.chemical_matched_name}", use_column_width=True)
+        _show_structure_image(st.session_state.chemical_image_bytes, st.session_state.chemical_image_url, caption=f"Structure of {st.session_state.chemical_matched_name}", use_column_width=True)
         # Download image button in final stage too
         if st.session_state.chemical_image_bytes:
             st.download_button(
@@ -489,13 +881,7 @@ def render_final_compilation_stage():
             )
 
 
-    if st.session_state.final_response is None:
-        with st.spinner("Compiling final response..."):
-            st.session_state.final_response = compile_final_response_from_ai(
-                st.session_state.approved_idea,
-                st.session_state.literature_summary,
-                st.session_state.properties
-            )
+    _ensure_stage('final_response', "Compiling final response...")
 
     st.markdown("---")
     st.markdown("**Final Research Proposal Overview:**")
@@ -515,24 +901,7 @@ def render_final_compilation_stage():
             height=500,
             key="final_proposal_output"
         )
-        # Download as DOCX button for final proposal
-        doc = Document()
-        doc.add_heading("Final Research Proposal Overview", level=1)
-        # Add the full content to the document, splitting by newlines for better formatting
-        for paragraph_text in full_content_to_copy.split('\n'):
-            doc.add_paragraph(paragraph_text)
-
-        bio = io.BytesIO()
-        doc.save(bio)
-        bio.seek(0)
-        
-        st.download_button(
-            label="Download Proposal as DOCX",
-            data=bio.getvalue(),
-            file_name="research_proposal.docx",
-            mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            key="download_proposal_docx"
-        )
+        _render_export_buttons("Proposal", "Final Research Proposal Overview", full_content_to_copy, "research_proposal")
     else:
         st.error(st.session_state.final_response if st.session_state.final_response else "No final proposal generated.")
     st.markdown("---")
@@ -540,6 +909,100 @@ def render_final_compilation_stage():
     col1, col2 = st.columns(2)
     with col1:
         if st.button("Start New Research"):
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+            start_new_session()
             st.rerun()
+
+
+def _waterfall_rows(spans):
+    depths = {}
+    trace_start = spans[0]["start"]
+    rows = []
+    for index, record in enumerate(spans):
+        depth = depths.get(record["parent_id"], -1) + 1
+        depths[record["span_id"]] = depth
+        start_ms = (record["start"] - trace_start) * 1000
+        rows.append({
+            "span": f"{index:02d} {'· ' * depth}{record['name']}",
+            "start_ms": round(start_ms, 1),
+            "end_ms": round(start_ms + record["duration_ms"], 1),
+            "duration_ms": record["duration_ms"],
+            "thread": record["thread"],
+            "details": ", ".join(f"{key}={value}" for key, value in record["attributes"].items())
+                       + (f" ERROR {record['error']}" if record.get("error") else ""),
+        })
+    return rows
+
+
+def render_performance_panel(session_id):
+    """
+    Shows a waterfall of this session's most recent traced runs (workflow stages, model calls,
+    PDF extraction, chemical resolvers and database operations), and the state of the
+    process-wide Gemini queue.
+    """
+    if not (PERFORMANCE_PANEL_ENABLED or st.query_params.get("debug") == "traces"):
+        return
+    import altair as alt # Bundled with Streamlit; only needed for this panel
+
+    with st.expander(f"⏱️ Performance traces (last {TRACES_PER_SESSION} runs)"):
+        queue = get_scheduler_metrics()
+        queued = ", ".join(f"{count} {name}" for name, count in queue["queued_by_priority"].items())
+        st.caption(
+            f"Gemini queue: {queue['queued']} waiting ({queued}) from {queue['queued_sessions']} sessions, "
+            f"oldest {queue['oldest_wait_seconds']}s · mean wait {queue['mean_wait_seconds']}s, "
+            f"max {queue['max_wait_seconds']}s · {queue['requests_available']:.0f} requests and "
+            f"{queue['tokens_available']:,} tokens of quota left · {queue['throttled']} rate-limit responses"
+        )
+        cache = get_chemical_cache_stats()
+        st.caption(
+            f"Chemical cache: {cache['entries']:,} entries ({cache['negative_entries']:,} not found) · "
+            f"hit rate {cache['hit_rate']:.0%} over {cache['hits'] + cache['negative_hits'] + cache['misses']:,} lookups"
+        )
+        traces = get_recent_traces(session_id)
+        if not traces:
+            st.caption("Nothing traced in this session yet.")
+            return
+        for spans in traces:
+            root = spans[0]
+            total_ms = max(record["start"] * 1000 + record["duration_ms"] for record in spans) - root["start"] * 1000
+            st.markdown(f"**{root['name']}** · {total_ms:,.0f} ms · {time.strftime('%H:%M:%S', time.localtime(root['start']))}")
+            rows = _waterfall_rows(spans)
+            chart = alt.Chart(alt.Data(values=rows)).mark_bar().encode(
+                x=alt.X("start_ms:Q", title="ms since start"),
+                x2="end_ms:Q",
+                y=alt.Y("span:N", sort=None, title=None),
+                color=alt.Color("thread:N", legend=None),
+                tooltip=["span:N", "duration_ms:Q", "thread:N", "details:N"],
+            ).properties(height=22 * len(rows) + 30)
+            st.altair_chart(chart)
+
+
+def render_memory_panel():
+    """
+    Admin view of the approximate memory held by each session on this server, by session
+    state key, with a button that evicts idle sessions' large values to disk.
+    """
+    if not (MEMORY_PANEL_ENABLED and st.query_params.get("debug") == "memory"):
+        return
+
+    with st.expander("🧠 Session memory"):
+        if st.button("Evict idle sessions now", key="memory_panel_evict"):
+            result = evict_idle_sessions(target_bytes=0)
+            st.caption(f"Evicted {result['evicted_values']} values ({result['evicted_bytes'] / 1e6:.1f} MB).")
+        report = get_memory_report()
+        st.caption(
+            f"{len(report['sessions'])} sessions hold {report['total_bytes'] / 1e6:.1f} MB of "
+            f"{report['limit_bytes'] / 1e6:.0f} MB · {report['evicted_bytes'] / 1e6:.1f} MB evicted to disk"
+        )
+        rows = []
+        for session in report['sessions']:
+            largest = list(session['keys'].items())[:3]
+            rows.append({
+                "session": session['session_id'][:8],
+                "workflow session": (session['workflow_session_id'] or "")[:8],
+                "stage": session['stage'],
+                "idle (s)": "running" if session['running'] else session['idle_seconds'],
+                "MB": round(session['total_bytes'] / 1e6, 2),
+                "largest keys": ", ".join(f"{key} {size / 1e6:.2f} MB" for key, size in largest),
+                "evicted": ", ".join(f"{key} {size / 1e6:.2f} MB" for key, size in session['evicted'].items()),
+            })
+        st.dataframe(rows, hide_index=True)
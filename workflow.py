@@ -1,138 +1,521 @@
 # workflow.py
 import re
-import streamlit as st
-import requests
-import io
+import os
+import threading
+import time
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, Future
 
 # Import functions from other modules
-from gemini_api import query_model
+from gemini_api import query_model, query_model_candidates, query_model_chat, create_context_cache, CONTEXT_CACHE_TTL_SECONDS, CONTEXT_CACHE_MISSING_ERROR
 from prompts import (
     format_research_ideas_prompt,
     format_literature_summary_prompt,
     format_properties_prediction_prompt,
     format_final_response_prompt,
     format_refine_idea_prompt,
+    format_refine_ideas_batch_prompt,
     format_follow_up_question_prompt,
-    format_search_queries_prompt
+    format_follow_up_chat_instruction,
+    format_follow_up_chat_turns,
+    format_chat_compaction_prompt,
+    format_search_queries_prompt,
+    estimate_tokens,
+    PROMPT_TOKEN_BUDGET
 )
-from chemical_lookup import fetch_chemical_info
-from pdf_processor import get_combined_uploaded_text # New import
+from chemical_lookup import fetch_chemical_info, fetch_chemical_info_many, MAX_LOOKUP_WORKERS
+from pdf_processor import get_combined_uploaded_text, combine_uploaded_papers
+from image_store import fetch_structure_image
+from chemical_cache import cache_key
+from reporting import report_error, report_warning
+from tracing import traced, propagate
 
-def generate_research_ideas_from_ai(topic, goal, data):
+# Shared by all sessions: background structure lookups never exceed this many threads
+_prefetch_executor = ThreadPoolExecutor(max_workers=MAX_LOOKUP_WORKERS, thread_name_prefix="structure-prefetch")
+_prefetch_lock = threading.Lock()
+_prefetch_inflight = {} # normalized name -> Future of its pending lookup
+# Lookups started from the lookup panel; separate from the prefetch so a user's lookup never queues behind it
+_lookup_executor = ThreadPoolExecutor(max_workers=MAX_LOOKUP_WORKERS, thread_name_prefix="chemical-lookup")
+
+# A lookup from the lookup panel is given up after this long, whatever the resolvers are doing
+CHEMICAL_LOOKUP_DEADLINE_SECONDS = float(os.environ.get("CHEMICAL_LOOKUP_DEADLINE_SECONDS", "30"))
+
+IDEA_CANDIDATE_COUNT = 3 # Independent idea lists sampled in one model request
+MAX_RANKED_IDEAS = 7 # Matches the 3-7 ideas the prompt asks for
+MAX_REFINE_WORKERS = 4 # Concurrent single-idea requests when a batch refinement can't be parsed
+
+# Follow-up chat history is compacted into a rolling summary once it grows past this many
+# (estimated) tokens; the most recent exchanges are always sent verbatim.
+CHAT_HISTORY_TOKEN_LIMIT = 2000
+CHAT_RECENT_EXCHANGES = 2
+# Part of PROMPT_TOKEN_BUDGET left to the summary, recent turns and question; the research context gets the rest
+CHAT_TURNS_TOKEN_BUDGET = 8000
+
+@traced("stage.research_ideas")
+def generate_research_ideas_from_ai(topic, goal, data, uploaded_text_context=None, candidate_count=IDEA_CANDIDATE_COUNT):
     """
     Calls the AI model to generate research ideas and parses them into a list.
-    Includes uploaded text context.
+    Several candidate lists are sampled in one request; their ideas are merged, near
+    duplicates collapsed and the rest ranked by relevance to the topic and goal.
+    Includes uploaded text context, read from session state unless it is passed in.
     """
-    uploaded_text_context = get_combined_uploaded_text()
+    if uploaded_text_context is None:
+        uploaded_text_context = get_combined_uploaded_text()
     prompt = format_research_ideas_prompt(topic, goal, data, uploaded_text_context)
-    raw_ideas_text = query_model(prompt)
+    raw_candidates = query_model_candidates(prompt, candidate_count)
 
-    if "⚠️ Error:" in raw_ideas_text:
-        st.error(raw_ideas_text)
+    if raw_candidates[0].startswith("⚠️"):
+        report_error(raw_candidates[0])
         return []
 
-    # Parse the numbered list into individual ideas
-    ideas_list = re.findall(r'^\d+\.\s*(.*)', raw_ideas_text, re.MULTILINE)
+    # Parse each candidate's numbered list into individual ideas
+    ideas_list = []
+    for raw_ideas_text in raw_candidates:
+        ideas_list.extend(re.findall(r'^\d+\.\s*(.*)', raw_ideas_text, re.MULTILINE))
     if not ideas_list:
-        st.warning("Could not parse ideas into a list. Displaying raw AI output.")
-        return [raw_ideas_text]
-    return ideas_list
+        report_warning("Could not parse ideas into a list. Displaying raw AI output.")
+        return [raw_candidates[0]]
+    from idea_ranking import rank_ideas # Loads NumPy, so only on first use
+    return rank_ideas(ideas_list, topic, goal, top_n=MAX_RANKED_IDEAS)
 
-def refine_single_idea_from_ai(original_idea, refinement_feedback, topic, goal, data):
+@traced("stage.refine_idea")
+def refine_single_idea_from_ai(original_idea, refinement_feedback, topic, goal, data, uploaded_text_context=None):
     """
     Calls the AI model to refine a single research idea based on feedback.
-    Includes uploaded text context.
+    Includes uploaded text context, read from session state unless it is passed in.
     """
-    uploaded_text_context = get_combined_uploaded_text()
+    if uploaded_text_context is None:
+        uploaded_text_context = get_combined_uploaded_text()
     prompt = format_refine_idea_prompt(original_idea, refinement_feedback, topic, goal, data, uploaded_text_context)
     refined_idea_text = query_model(prompt)
-    if "⚠️ Error:" in refined_idea_text:
-        st.error(refined_idea_text)
+    if refined_idea_text.startswith("⚠️"):
+        report_error(refined_idea_text)
         return original_idea # Return original if refinement fails
     return refined_idea_text
 
-def answer_follow_up_question_from_ai(approved_idea, literature_summary, properties, user_question):
+@traced("stage.refine_ideas_batch")
+def refine_ideas_batch_from_ai(ideas, refinement_feedback, topic, goal, data, uploaded_text_context=None):
+    """
+    Applies one piece of feedback to several ideas with a single structured request.
+    If the response doesn't contain one refined idea per input, falls back to refining the
+    ideas concurrently one by one. Returns the refined ideas in input order; an idea whose
+    refinement fails is returned unchanged.
+    """
+    if not ideas:
+        return []
+    if uploaded_text_context is None:
+        uploaded_text_context = get_combined_uploaded_text()
+    prompt = format_refine_ideas_batch_prompt(ideas, refinement_feedback, topic, goal, data, uploaded_text_context)
+    raw_refined_text = query_model(prompt)
+
+    if not raw_refined_text.startswith("⚠️"):
+        # Items may wrap over several lines, so split on the numbers rather than matching lines
+        refined_ideas = [item.strip() for item in re.split(r'^\s*\d+\.\s*', raw_refined_text, flags=re.MULTILINE)[1:]]
+        if len(refined_ideas) == len(ideas) and all(refined_ideas):
+            return refined_ideas
+        report_warning(f"Expected {len(ideas)} refined ideas but got {len(refined_ideas)}; refining them one by one.")
+
+    with ThreadPoolExecutor(max_workers=MAX_REFINE_WORKERS) as executor:
+        return list(executor.map(
+            propagate(lambda idea: refine_single_idea_from_ai(idea, refinement_feedback, topic, goal, data, uploaded_text_context)),
+            ideas
+        ))
+
+@traced("stage.follow_up_question")
+def answer_follow_up_question_from_ai(approved_idea, literature_summary, properties, user_question, uploaded_text_context=None):
     """
     Calls the AI model to answer a follow-up question based on the current context.
-    Includes uploaded text context.
+    Includes uploaded text context, read from session state unless it is passed in.
     """
-    uploaded_text_context = get_combined_uploaded_text()
+    if uploaded_text_context is None:
+        uploaded_text_context = get_combined_uploaded_text()
     prompt = format_follow_up_question_prompt(approved_idea, literature_summary, properties, user_question, uploaded_text_context)
     response = query_model(prompt)
-    if "⚠️ Error:" in response:
-        st.error(response)
+    if response.startswith("⚠️"):
+        report_error(response)
+        return "Error answering question."
+    return response
+
+def new_follow_up_chat(approved_idea=None):
+    """
+    Returns an empty follow-up chat: the history in Gemini's contents format, the rolling
+    summary of turns that have been compacted away and the Gemini context cache holding its
+    research context, if any.
+    """
+    return {
+        "approved_idea": approved_idea, "contents": [], "summary": "",
+        "context_key": None, "context_cache": None, "context_cache_expires": 0,
+    }
+
+def _chat_history_tokens(contents):
+    return sum(estimate_tokens(part["text"]) for turn in contents for part in turn["parts"])
+
+@traced("stage.follow_up_compaction")
+def _compact_follow_up_chat(chat):
+    """
+    Folds all but the most recent exchanges into the chat's rolling summary.
+    If summarizing fails, the older turns are dropped so the history stays bounded.
+    """
+    keep = 2 * CHAT_RECENT_EXCHANGES
+    older, recent = chat["contents"][:-keep], chat["contents"][-keep:]
+    if not older:
+        return
+    transcript = "\n".join(
+        f"{'User' if turn['role'] == 'user' else 'Assistant'}: {turn['parts'][0]['text']}" for turn in older
+    )
+    summary = query_model(format_chat_compaction_prompt(chat["summary"], transcript))
+    if summary.startswith("⚠️"):
+        report_warning("Could not summarize the earlier conversation; older turns were dropped.")
+    else:
+        chat["summary"] = summary.strip()
+    chat["contents"] = recent
+
+def _follow_up_context_cache(chat, instruction, context_key):
+    """
+    Returns the name of the Gemini context cache holding the chat's research context, uploading
+    it on the first turn and again when the context changes or the cache is about to expire.
+    None means the context is too short to cache (or caching failed) and is sent with each turn.
+    """
+    if chat.get("context_key") != context_key or time.time() >= chat.get("context_cache_expires", 0):
+        chat["context_key"] = context_key
+        chat["context_cache"] = create_context_cache(instruction)
+        chat["context_cache_expires"] = time.time() + CONTEXT_CACHE_TTL_SECONDS - 60 # Renewed a minute early
+    return chat["context_cache"]
+
+@traced("stage.follow_up_chat")
+def ask_follow_up_chat(chat, approved_idea, literature_summary, properties, user_question, uploaded_text_context=None):
+    """
+    Answers a follow-up question as the next turn of a chat created by new_follow_up_chat().
+    The research context is the system instruction, uploaded once to Gemini's context cache
+    when it is long enough and referred to by name on later turns. Each request adds the
+    conversation summary, the recent history and the question, fitted into
+    CHAT_TURNS_TOKEN_BUDGET. The exchange is appended to the chat, which is compacted once its
+    history grows past CHAT_HISTORY_TOKEN_LIMIT. Returns the answer.
+    Includes uploaded text context, read from session state unless it is passed in.
+    """
+    if uploaded_text_context is None:
+        uploaded_text_context = get_combined_uploaded_text()
+    instruction = format_follow_up_chat_instruction(
+        approved_idea, literature_summary, properties, uploaded_text_context,
+        budget=PROMPT_TOKEN_BUDGET - CHAT_TURNS_TOKEN_BUDGET
+    )
+    context_key = hashlib.sha256(instruction.encode("utf-8")).hexdigest()
+    cached_context = _follow_up_context_cache(chat, instruction, context_key)
+    turns = format_follow_up_chat_turns(chat["contents"], user_question, chat["summary"], budget=CHAT_TURNS_TOKEN_BUDGET)
+    response = query_model_chat(turns, system_instruction=instruction, cached_context=cached_context)
+    if cached_context and response == CONTEXT_CACHE_MISSING_ERROR:
+        # The cache expired early; resend the context now and upload it again next turn
+        chat["context_cache"], chat["context_cache_expires"] = None, 0
+        response = query_model_chat(turns, system_instruction=instruction)
+    if response.startswith("⚠️"):
+        report_error(response)
         return "Error answering question."
+
+    question_turn = {"role": "user", "parts": [{"text": user_question}]}
+
+    chat["contents"].extend([question_turn, {"role": "model", "parts": [{"text": response}]}])
+    if _chat_history_tokens(chat["contents"]) > CHAT_HISTORY_TOKEN_LIMIT:
+        _compact_follow_up_chat(chat)
     return response
 
-def suggest_search_queries_from_ai(research_idea, literature_summary):
+@traced("stage.search_queries")
+def suggest_search_queries_from_ai(research_idea, literature_summary, uploaded_text_context=None):
     """
     Calls the AI model to suggest search queries based on the research idea and summary.
-    Includes uploaded text context.
+    Includes uploaded text context, read from session state unless it is passed in.
     """
-    uploaded_text_context = get_combined_uploaded_text()
+    if uploaded_text_context is None:
+        uploaded_text_context = get_combined_uploaded_text()
     prompt = format_search_queries_prompt(research_idea, literature_summary, uploaded_text_context)
     raw_queries_text = query_model(prompt)
 
-    if "⚠️ Error:" in raw_queries_text:
-        st.error(raw_queries_text)
+    if raw_queries_text.startswith("⚠️"):
+        report_error(raw_queries_text)
         return []
 
     # Parse the numbered list into individual queries
     queries_list = re.findall(r'^\d+\.\s*(.*)', raw_queries_text, re.MULTILINE)
     if not queries_list:
-        st.warning("Could not parse search queries into a list. Displaying raw AI output.")
+        report_warning("Could not parse search queries into a list. Displaying raw AI output.")
         return [raw_queries_text]
     return queries_list
 
 
-def generate_literature_summary_from_ai(idea):
+@traced("stage.literature_summary")
+def generate_literature_summary_from_ai(idea, uploaded_text_context=None):
     """
     Calls the AI model to generate a literature summary.
-    Includes uploaded text context.
+    Includes uploaded text context, read from session state unless it is passed in
+    (background stages and the batch CLI cannot read session state).
     """
-    uploaded_text_context = get_combined_uploaded_text()
+    if uploaded_text_context is None:
+        uploaded_text_context = get_combined_uploaded_text()
     prompt = format_literature_summary_prompt(idea, uploaded_text_context)
     summary = query_model(prompt)
-    if "⚠️ Error:" in summary:
-        st.error(summary)
+    if summary.startswith("⚠️"):
+        report_error(summary)
         return "Error generating summary."
     return summary
 
+@traced("stage.properties")
 def generate_properties_from_ai(idea):
     """
     Calls the AI model to generate properties/predictions.
     """
     prompt = format_properties_prediction_prompt(idea)
     props = query_model(prompt)
-    if "⚠️ Error:" in props:
-        st.error(props)
+    if props.startswith("⚠️"):
+        report_error(props)
         return "Error generating properties."
     return props
 
+@traced("stage.final_response")
 def compile_final_response_from_ai(idea, literature_summary, properties):
     """
     Calls the AI model to compile the final response.
     """
     prompt = format_final_response_prompt(idea, literature_summary, properties)
     final_response_text = query_model(prompt)
-    if "⚠️ Error:" in final_response_text:
-        st.error(final_response_text)
+    if final_response_text.startswith("⚠️"):
+        report_error(final_response_text)
         return "Error compiling final response."
     return final_response_text
 
-def perform_chemical_lookup(name_or_cas):
+# Placeholders the stage functions above return instead of raising when a model call fails
+STAGE_ERRORS = ("Error generating summary.", "Error generating properties.", "Error compiling final response.")
+
+def is_stage_error(result):
+    """
+    True if a stage's return value stands for a failed model call: a placeholder from
+    STAGE_ERRORS, a raw "⚠️ ..." message from gemini_api, or no output at all.
+    """
+    if isinstance(result, list):
+        return not result or all(is_stage_error(item) for item in result)
+    if isinstance(result, str):
+        return not result.strip() or result in STAGE_ERRORS or result.lstrip().startswith("⚠️")
+    return result is None
+
+# --- Pipeline DAG ---
+# Each generated stage lists the values it is computed from. A stage's stored result is
+# reused as long as the fingerprint of its inputs is unchanged; changing an input (or
+# regenerating an upstream stage) only recomputes the stages downstream of it.
+PIPELINE_STAGES = {
+    'literature_summary': {
+        'inputs': ('approved_idea', 'uploaded_text'),
+        'run': generate_literature_summary_from_ai,
+    },
+    'properties': {
+        'inputs': ('approved_idea',),
+        'run': generate_properties_from_ai,
+    },
+    'final_response': {
+        'inputs': ('approved_idea', 'literature_summary', 'properties'),
+        'run': compile_final_response_from_ai,
+    },
+}
+
+def _pipeline_value(state, name):
+    if name == 'uploaded_text':
+        return combine_uploaded_papers(state.get('uploaded_papers_data'))
+    return state.get(name)
+
+def stage_inputs(stage_name, state):
+    """
+    Returns the argument tuple for a stage's run function, read from a session-state-like mapping.
+    """
+    return tuple(_pipeline_value(state, name) for name in PIPELINE_STAGES[stage_name]['inputs'])
+
+def stage_fingerprint(inputs):
+    return hashlib.sha256(repr(inputs).encode("utf-8")).hexdigest()
+
+def is_stage_current(stage_name, state):
+    """
+    True if the stage has a stored result that was computed from the current inputs.
+    """
+    if state.get(stage_name) is None:
+        return False
+    recorded = (state.get('stage_fingerprints') or {}).get(stage_name)
+    return recorded == stage_fingerprint(stage_inputs(stage_name, state))
+
+def record_stage_result(stage_name, state, result, inputs):
+    """
+    Stores a stage result together with the fingerprint of the inputs it was computed from.
+    """
+    state[stage_name] = result
+    state['stage_fingerprints'][stage_name] = stage_fingerprint(inputs)
+
+def downstream_stages(stage_name):
+    """
+    Returns every stage that (transitively) consumes the given stage or input, in DAG order.
+    """
+    found = []
+    frontier = [stage_name]
+    while frontier:
+        current = frontier.pop(0)
+        for name, spec in PIPELINE_STAGES.items():
+            if current in spec['inputs'] and name not in found:
+                found.append(name)
+                frontier.append(name)
+    return found
+
+def invalidate_stage(stage_name, state):
+    """
+    Forces a stage to be regenerated, e.g. after the user rejected its output.
+    Downstream stages are cleared too; stages that don't depend on it are kept.
+    Returns the names of all invalidated stages.
+    """
+    invalidated = [stage_name] + downstream_stages(stage_name)
+    for name in invalidated:
+        state[name] = None
+        state['stage_fingerprints'].pop(name, None)
+    return invalidated
+
+@traced("stage.chemical_lookup")
+def perform_chemical_lookup(name_or_cas, progress=None):
     """
     Performs a chemical lookup using the chemical_lookup module.
-    Also fetches the image bytes if an image URL is found.
+    Also fetches the image bytes (through the local image store) if an image URL is found.
+    progress, if given, is called with (step, status) for each resolver and the image download.
     """
-    cid, image_url, source, matched_name = fetch_chemical_info(name_or_cas)
+    cid, image_url, source, matched_name = fetch_chemical_info(name_or_cas, progress)
     image_bytes = None
     if image_url:
-        try:
-            response = requests.get(image_url, timeout=10)
-            response.raise_for_status()
-            image_bytes = response.content
-        except requests.exceptions.RequestException as e:
-            st.warning(f"Could not download chemical image from {image_url}: {e}")
-            image_bytes = None
+        if progress:
+            progress("Structure image", "running")
+        image_bytes = fetch_structure_image(image_url)
+        if image_bytes is None:
+            report_warning(f"Could not download chemical image from {image_url}.")
+        if progress:
+            progress("Structure image", "found" if image_bytes else "not found")
     return cid, image_url, source, matched_name, image_bytes
+
+
+class ChemicalLookupCancelled(Exception):
+    """Raised inside a background lookup that was cancelled or ran past its deadline."""
+
+
+class ChemicalLookupJob:
+    """
+    A chemical lookup running in the background (see start_chemical_lookup()). The UI polls it
+    for the steps tried so far and, once done, the perform_chemical_lookup() result.
+    Cancelling, or passing the deadline, stops it before its next resolver; a request already
+    in flight finishes in the background and its answer is dropped.
+    """
+    def __init__(self, query, deadline_seconds):
+        self.query = query
+        self.deadline_seconds = deadline_seconds
+        self.deadline = time.monotonic() + deadline_seconds
+        self.future = None
+        self._steps = {} # step -> "running" / "found" / "not found" / "failed", in the order tried
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+
+    def _progress(self, step, status):
+        # Called from the lookup thread between resolvers
+        if self._cancelled.is_set():
+            raise ChemicalLookupCancelled(f"Lookup of '{self.query}' was cancelled.")
+        if time.monotonic() >= self.deadline:
+            raise ChemicalLookupCancelled(f"Lookup of '{self.query}' ran past its deadline.")
+        with self._lock:
+            self._steps[step] = status
+
+    def steps(self):
+        with self._lock:
+            return list(self._steps.items())
+
+    def cancel(self):
+        self._cancelled.set()
+        self.future.cancel() # Takes effect only if it hasn't started yet
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def done(self):
+        return self.future.done()
+
+    def timed_out(self):
+        return not self.future.done() and time.monotonic() >= self.deadline
+
+    def seconds_left(self):
+        return max(0.0, self.deadline - time.monotonic())
+
+    def result(self):
+        """
+        The (cid, image_url, source, matched_name, image_bytes) tuple of a finished lookup.
+        Raises ChemicalLookupCancelled if it was cancelled or timed out.
+        """
+        if self.cancelled or self.future.cancelled():
+            raise ChemicalLookupCancelled(f"Lookup of '{self.query}' was cancelled.")
+        return self.future.result(timeout=0)
+
+
+def start_chemical_lookup(name_or_cas, deadline_seconds=CHEMICAL_LOOKUP_DEADLINE_SECONDS):
+    """
+    Starts perform_chemical_lookup() on the lookup executor and returns its ChemicalLookupJob
+    immediately.
+    """
+    job = ChemicalLookupJob(name_or_cas, deadline_seconds)
+    job.future = _lookup_executor.submit(propagate(perform_chemical_lookup), name_or_cas, job._progress)
+    return job
+
+
+@traced("stage.chemical_lookup_many")
+def perform_chemical_lookup_many(names, fetch_images=True):
+    """
+    Looks up many chemical names or CAS numbers at once using batched PubChem requests.
+    Returns a dict {name: (cid, image_url, source, matched_name, image_bytes)} in input order.
+    Image download failures are logged rather than shown, since this also runs outside the UI.
+    image_bytes is None when the download failed or did not return an image.
+    """
+    identities = fetch_chemical_info_many(names)
+
+    def download(image_url):
+        if not image_url or not fetch_images:
+            return None
+        return fetch_structure_image(image_url) # Logs its own failures
+
+    with ThreadPoolExecutor(max_workers=MAX_LOOKUP_WORKERS) as executor:
+        images = list(executor.map(propagate(download), [identity[1] for identity in identities.values()]))
+
+    return {
+        name: (*identity, image_bytes)
+        for (name, identity), image_bytes in zip(identities.items(), images)
+    }
+
+
+def prefetch_chemical_structures(names):
+    """
+    Starts resolving structures for the given names in the background and returns immediately.
+    New names are resolved together with perform_chemical_lookup_many; names already being
+    resolved (by any session) share the in-flight lookup. Returns a dict {name: Future} whose
+    results are (cid, image_url, source, matched_name, image_bytes) tuples.
+    """
+    futures = {}
+    new_futures = {}
+    with _prefetch_lock:
+        for name in names:
+            key = cache_key(name)
+            if key not in _prefetch_inflight:
+                _prefetch_inflight[key] = new_futures[name] = Future()
+            futures[name] = _prefetch_inflight[key]
+
+    if new_futures:
+        _prefetch_executor.submit(propagate(_run_prefetch_batch), new_futures)
+    return futures
+
+@traced("stage.structure_prefetch")
+def _run_prefetch_batch(futures):
+    try:
+        results = perform_chemical_lookup_many(list(futures))
+        for name, future in futures.items():
+            future.set_result(results[name])
+    except Exception as e:
+        for future in futures.values():
+            if not future.done():
+                future.set_exception(e)
+    finally:
+        # Finished lookups are served by the chemical cache and image store from now on
+        with _prefetch_lock:
+            for name in futures:
+                _prefetch_inflight.pop(cache_key(name), None)